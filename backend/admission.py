@@ -0,0 +1,405 @@
+# backend/admission.py
+"""
+Control de carga del agente.
+- Carriles de prioridad: "high" (peticiones interactivas, por defecto) y
+  "low" (jobs async y X-Agent-Priority: low). El carril de la petición
+  vive en un ContextVar; los límites de abajo lo usan para dar el
+  siguiente lugar libre primero al carril "high".
+- ConcurrencyLimiter: llamadas en curso a un recurso (etapa del LLM, LLM
+  en total, SQLite, Tavily), con fila por prioridad.
+- AdmissionController: preguntas atendidas a la vez y en fila. Con la
+  fila llena, una petición "high" desplaza a la última "low" en espera;
+  si no hay a quién desplazar se rechaza de inmediato (429 con
+  Retry-After) en lugar de esperar hasta el timeout del cliente.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from .config import (
+    ADMISSION_MAX_CONCURRENCY,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT,
+    ADMISSION_LOW_PRIORITY_SHARE,
+    LLM_MAX_CONCURRENCY,
+    SQLITE_MAX_CONCURRENCY,
+    SQL_EXPORT_MAX_CONCURRENCY,
+    TAVILY_MAX_CONCURRENCY,
+)
+from .metrics import ADMISSION_EVENTS, ADMISSION_QUEUE, ADMISSION_WAIT_SECONDS
+
+# Carril -> prioridad (menor = se atiende antes)
+LANES = {"high": 0, "low": 1}
+
+
+# ---------------------------
+# SEMÁFORO CON PRIORIDAD
+# ---------------------------
+
+class PrioritySemaphore:
+    """
+    Semáforo de asyncio que entrega los lugares libres por prioridad y,
+    dentro de la misma prioridad, por orden de llegada. Un lugar liberado
+    pasa directo al siguiente en la fila (nadie se lo salta).
+    """
+
+    def __init__(self, value: int):
+        self._value = value
+        self._seq = itertools.count()
+        # [prioridad, llegada, future, se puede desplazar]
+        self._waiters: List[list] = []
+
+    def locked(self) -> bool:
+        return self._value <= 0
+
+    def waiting(self) -> int:
+        return sum(1 for entry in self._waiters if not entry[2].done())
+
+    def try_acquire(self) -> bool:
+        """
+        Toma un lugar solo si hay uno libre, sin esperar.
+        """
+        if self._value > 0:
+            self._value -= 1
+            return True
+        return False
+
+    async def acquire(self, priority: int = 0, evictable: bool = True) -> None:
+        if self.try_acquire():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._seq), future, evictable])
+        try:
+            await future
+        except BaseException:
+            # Cancelada justo después de recibir el lugar: se devuelve
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            future = heapq.heappop(self._waiters)[2]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._value += 1
+
+    def evict(self, below: int, error: BaseException) -> bool:
+        """
+        Saca de la fila al último en llegar de la prioridad más baja (mayor
+        que `below`) y le entrega `error`. Devuelve False si no hay a quién.
+        """
+        candidates = [e for e in self._waiters if e[0] > below and e[3] and not e[2].done()]
+        if not candidates:
+            return False
+        max(candidates, key=lambda e: (e[0], e[1]))[2].set_exception(error)
+        return True
+
+
+# ---------------------------
+# CARRILES
+# ---------------------------
+
+_current_lane: ContextVar[str] = ContextVar("agent_lane", default="high")
+
+
+def current_lane() -> str:
+    return _current_lane.get()
+
+
+@contextmanager
+def lane(name: str) -> Iterator[str]:
+    """
+    Marca el carril del código dentro del bloque (y de las tareas que cree).
+    """
+    if name not in LANES:
+        raise ValueError(f"Carril desconocido: {name}")
+    token = _current_lane.set(name)
+    try:
+        yield name
+    finally:
+        try:
+            _current_lane.reset(token)
+        except ValueError:
+            # Igual que en metrics.tracing: un stream cerrado desde otra tarea
+            pass
+
+
+# ---------------------------
+# LÍMITE DE CONCURRENCIA
+# ---------------------------
+
+class ConcurrencyLimiter:
+    """
+    Límite de llamadas en curso a un recurso (0 = sin límite). Los hilos
+    (API síncrona) y el event loop tienen cada uno su semáforo con el
+    mismo límite; en el event loop la fila respeta el carril de la petición.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._thread_slots = threading.Semaphore(max_concurrency) if max_concurrency > 0 else None
+        self._async_slots = PrioritySemaphore(max_concurrency) if max_concurrency > 0 else None
+        self.in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.wait_seconds = 0.0
+
+    def _waited(self, started: float) -> float:
+        waited = time.perf_counter() - started
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+            self.calls += 1
+            self.wait_seconds += waited
+        return waited
+
+    def _queued(self) -> float:
+        with self._lock:
+            self.waiting += 1
+        return time.perf_counter()
+
+    def _done(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    @contextmanager
+    def slot(self) -> Iterator[float]:
+        """
+        Ocupa un lugar mientras dura el bloque. Devuelve los segundos que
+        se esperó turno.
+        """
+        started = self._queued()
+        if self._thread_slots is not None:
+            self._thread_slots.acquire()
+        waited = self._waited(started)
+        try:
+            yield waited
+        finally:
+            self._done()
+            if self._thread_slots is not None:
+                self._thread_slots.release()
+
+    @asynccontextmanager
+    async def aslot(self) -> AsyncIterator[float]:
+        started = self._queued()
+        try:
+            if self._async_slots is not None:
+                await self._async_slots.acquire(LANES[current_lane()])
+        except BaseException:
+            with self._lock:
+                self.waiting -= 1
+            raise
+        waited = self._waited(started)
+        try:
+            yield waited
+        finally:
+            self._done()
+            if self._async_slots is not None:
+                self._async_slots.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "calls": self.calls,
+                "avg_wait_seconds": round(self.wait_seconds / self.calls, 4) if self.calls else 0.0,
+            }
+
+
+# Un límite por servicio externo, compartido por todas las peticiones
+UPSTREAM_LIMITERS = {
+    "llm": ConcurrencyLimiter(LLM_MAX_CONCURRENCY),
+    "sqlite": ConcurrencyLimiter(SQLITE_MAX_CONCURRENCY),
+    "tavily": ConcurrencyLimiter(TAVILY_MAX_CONCURRENCY),
+    # Exportaciones: conexiones propias del pool (ver db_client.get_pool)
+    "sql_export": ConcurrencyLimiter(SQL_EXPORT_MAX_CONCURRENCY),
+}
+
+
+def upstream_limiter(name: str) -> ConcurrencyLimiter:
+    return UPSTREAM_LIMITERS[name]
+
+
+def upstreams_snapshot() -> Dict[str, Dict[str, Any]]:
+    return {name: limiter.snapshot() for name, limiter in UPSTREAM_LIMITERS.items()}
+
+
+# ---------------------------
+# CONTROL DE ADMISIÓN
+# ---------------------------
+
+class AdmissionRejected(Exception):
+    """
+    La petición no se admitió. `reason` es "queue_full", "queue_timeout",
+    "evicted" o "jobs_full"; `retry_after` son los segundos sugeridos
+    antes de reintentar.
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Agente saturado ({reason}); reintentar en {retry_after} s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Admite hasta `max_concurrency` preguntas a la vez y deja hasta
+    `max_queue` esperando turno, como mucho `queue_timeout` segundos. El
+    carril "low" ocupa como máximo `low_share` de los lugares, así siempre
+    queda espacio para las peticiones interactivas.
+    """
+
+    # Peso de la última petición en el promedio de duración
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float, low_share: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        enabled = max_concurrency > 0
+        self.low_slots = max(1, int(max_concurrency * low_share)) if enabled else 0
+        self._slots = PrioritySemaphore(max_concurrency) if enabled else None
+        self._low = PrioritySemaphore(self.low_slots) if enabled else None
+        self.in_flight: Counter = Counter()
+        self.waiting: Counter = Counter()
+        # Espera sujeta a max_queue (los jobs tienen su propio límite)
+        self.bounded_waiting = 0
+        self.results: Counter = Counter()
+        self.avg_seconds: Optional[float] = None
+
+    def retry_after(self) -> int:
+        """
+        Segundos hasta que probablemente haya lugar: lo que tardan en
+        vaciarse la fila y los lugares ocupados al ritmo actual.
+        """
+        avg = self.avg_seconds or 1.0
+        queued = sum(self.waiting.values())
+        slots = max(1, self.max_concurrency)
+        return min(60, max(1, math.ceil(avg * (queued + 1) / slots)))
+
+    @asynccontextmanager
+    async def admit(self, lane_name: str = "high", bounded: bool = True) -> AsyncIterator[float]:
+        """
+        Ocupa un lugar mientras dura el bloque, con el carril marcado para
+        los límites de cada servicio. Devuelve los segundos de espera.
+        `bounded=False` (jobs) espera sin tope de fila ni de tiempo y no
+        puede ser desplazada. Lanza AdmissionRejected si no hay lugar.
+        """
+        if lane_name not in LANES:
+            raise ValueError(f"Carril desconocido: {lane_name}")
+
+        started = time.perf_counter()
+        if self._slots is not None:
+            await self._wait_turn(lane_name, bounded)
+        waited = time.perf_counter() - started
+        self._event(lane_name, "admitted")
+        ADMISSION_WAIT_SECONDS.observe(waited, lane=lane_name)
+
+        self.in_flight[lane_name] += 1
+        self._publish(lane_name)
+        try:
+            with lane(lane_name):
+                yield waited
+        finally:
+            self.in_flight[lane_name] -= 1
+            self._learn(time.perf_counter() - started - waited)
+            if self._slots is not None:
+                self._slots.release()
+                if lane_name == "low":
+                    self._low.release()
+            self._publish(lane_name)
+
+    async def _wait_turn(self, lane_name: str, bounded: bool) -> None:
+        if self._try_acquire(lane_name):
+            return
+
+        priority = LANES[lane_name]
+        if bounded and self.max_queue > 0 and self.bounded_waiting >= self.max_queue:
+            # Una petición "high" toma el lugar en la fila de la última "low"
+            evicted = AdmissionRejected("evicted", self.retry_after())
+            if not (priority == 0 and (self._slots.evict(priority, evicted) or self._low.evict(-1, evicted))):
+                self._event(lane_name, "queue_full")
+                raise AdmissionRejected("queue_full", self.retry_after())
+            self._event("low", "evicted")
+
+        self.waiting[lane_name] += 1
+        self.bounded_waiting += bounded
+        self._publish(lane_name)
+        try:
+            timeout = self.queue_timeout if bounded and self.queue_timeout > 0 else None
+            await asyncio.wait_for(self._acquire(lane_name, priority, bounded), timeout)
+        except asyncio.TimeoutError:
+            self._event(lane_name, "queue_timeout")
+            raise AdmissionRejected("queue_timeout", self.retry_after()) from None
+        finally:
+            self.waiting[lane_name] -= 1
+            self.bounded_waiting -= bounded
+            self._publish(lane_name)
+
+    def _try_acquire(self, lane_name: str) -> bool:
+        # Sin await de por medio: la decisión y la toma del lugar son atómicas
+        if lane_name == "low":
+            if self._low.locked() or self._slots.locked():
+                return False
+            return self._low.try_acquire() and self._slots.try_acquire()
+        return self._slots.try_acquire()
+
+    async def _acquire(self, lane_name: str, priority: int, evictable: bool) -> None:
+        if lane_name == "low":
+            await self._low.acquire(priority, evictable)
+        try:
+            await self._slots.acquire(priority, evictable)
+        except BaseException:
+            if lane_name == "low":
+                self._low.release()
+            raise
+
+    def _learn(self, seconds: float) -> None:
+        if self.avg_seconds is None:
+            self.avg_seconds = seconds
+        else:
+            self.avg_seconds += self.EWMA_ALPHA * (seconds - self.avg_seconds)
+
+    def _event(self, lane_name: str, result: str) -> None:
+        self.results[f"{lane_name}_{result}"] += 1
+        ADMISSION_EVENTS.inc(lane=lane_name, result=result)
+
+    def _publish(self, lane_name: str) -> None:
+        ADMISSION_QUEUE.set(self.waiting[lane_name], lane=lane_name, state="waiting")
+        ADMISSION_QUEUE.set(self.in_flight[lane_name], lane=lane_name, state="in_flight")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "low_slots": self.low_slots,
+            "in_flight": {name: self.in_flight[name] for name in LANES},
+            "waiting": {name: self.waiting[name] for name in LANES},
+            "results": dict(self.results),
+            "avg_seconds": round(self.avg_seconds, 4) if self.avg_seconds is not None else None,
+            "retry_after": self.retry_after(),
+        }
+
+
+# Compartido por /agent, /agent/stream y los jobs
+admission = AdmissionController(
+    ADMISSION_MAX_CONCURRENCY,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT,
+    ADMISSION_LOW_PRIORITY_SHARE,
+)
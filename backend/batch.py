@@ -0,0 +1,166 @@
+# backend/batch.py
+"""
+Preguntas en lote (POST /agent/batch), para reportes que mandan cientos
+de preguntas:
+- Las preguntas iguales (misma forma normalizada que usa la caché) corren
+  una sola vez y su resultado se reparte.
+- El router clasifica ROUTER_BATCH_SIZE preguntas por llamada
+  (AgentRouter.aclassify_batch); las que no vengan en la respuesta se
+  clasifican solas como siempre.
+- El mismo SQL generado para preguntas distintas se ejecuta una sola vez
+  por batch (ver shared()).
+- Corren BATCH_CONCURRENCY a la vez, en el carril "low" del control de
+  admisión, y los resultados salen en orden de término.
+"""
+
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, TypeVar
+
+from .admission import admission
+from .config import ROUTER_BATCH_SIZE
+from .intent_classifier import normalize_text
+from .metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Resultados compartidos del batch en curso (None fuera de un batch). Las
+# tareas de cada pregunta heredan el mismo dict.
+_shared_results: ContextVar[Optional[Dict[Hashable, asyncio.Future]]] = ContextVar("agent_batch_shared", default=None)
+
+
+async def shared(key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+    """
+    Dentro de un batch, una sola ejecución por llave: las demás preguntas
+    esperan el mismo resultado. Fuera de un batch solo llama a `factory`.
+    """
+    results = _shared_results.get()
+    if results is None:
+        return await factory()
+
+    future = results.get(key)
+    record_cache("batch_shared", "miss" if future is None else "coalesced")
+    if future is None:
+        future = results[key] = asyncio.ensure_future(factory())
+    # shield: si se cancela una pregunta, las demás siguen esperando
+    return await asyncio.shield(future)
+
+
+def dedupe(messages: List[str]) -> Dict[str, List[int]]:
+    """
+    Agrupa los índices de las preguntas iguales. La llave de cada grupo es
+    su primer mensaje, tal cual llegó.
+    """
+    groups: Dict[str, List[int]] = {}
+    first: Dict[str, str] = {}
+    for index, message in enumerate(messages):
+        key = first.setdefault(normalize_text(message), message)
+        groups.setdefault(key, []).append(index)
+    return groups
+
+
+class BatchDecisions:
+    """
+    Decisiones del router por grupos de `size` preguntas. Cada grupo se
+    clasifica la primera vez que una de sus preguntas lo necesita: las
+    primeras respuestas no esperan a que se clasifique todo el batch.
+    """
+
+    def __init__(
+        self,
+        classify: Callable[[List[str]], Awaitable[Dict[str, Dict[str, Any]]]],
+        messages: List[str],
+        size: int,
+    ):
+        self.classify = classify
+        self.chunks = [messages[i:i + size] for i in range(0, len(messages), size)] if size > 1 else []
+        self.chunk_of = {message: n for n, chunk in enumerate(self.chunks) for message in chunk}
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.decided = 0
+
+    async def get(self, message: str) -> Optional[Dict[str, Any]]:
+        n = self.chunk_of.get(message)
+        if n is None:
+            return None
+        task = self.tasks.get(n)
+        if task is None:
+            task = self.tasks[n] = asyncio.create_task(self._classify(self.chunks[n]))
+        decisions = await asyncio.shield(task)
+        return decisions.get(message)
+
+    async def _classify(self, chunk: List[str]) -> Dict[str, Dict[str, Any]]:
+        try:
+            decisions = await self.classify(chunk)
+        except Exception as e:
+            # Cada pregunta del grupo se clasifica sola
+            logger.warning("Falló la clasificación por lotes: %s", e)
+            return {}
+        self.decided += len(decisions)
+        return decisions
+
+    def close(self) -> None:
+        for task in self.tasks.values():
+            task.cancel()
+
+
+async def run_batch(
+    router: Any,
+    messages: List[str],
+    concurrency: int,
+    payload: Callable[[Dict[str, Any]], Dict[str, Any]],
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Corre las preguntas con `router` (AgentRouter) y va devolviendo, en
+    orden de término, una línea por pregunta recibida:
+    {"index", "message", "deduplicated", "status": "ok" | "error",
+     "result" | "error"}. `payload` convierte el resultado del router en el
+    cuerpo de /agent. La última línea es {"summary": {...}}.
+    """
+    started = time.perf_counter()
+    groups = dedupe(messages)
+    decisions = BatchDecisions(router.aclassify_batch, list(groups), ROUTER_BATCH_SIZE)
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(message: str) -> Dict[str, Any]:
+        async with slots, admission.admit("low", bounded=False):
+            return await router.aroute(message, router_result=await decisions.get(message))
+
+    # Las tareas copian el contexto al crearse: todas ven el mismo dict
+    token = _shared_results.set({})
+    tasks = {asyncio.create_task(run_one(message)): message for message in groups}
+    _shared_results.reset(token)
+
+    errors = 0
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                message = tasks[task]
+                try:
+                    line = {"status": "ok", "result": payload(task.result())}
+                except Exception as e:
+                    errors += len(groups[message])
+                    line = {"status": "error", "error": str(e)}
+                for n, index in enumerate(groups[message]):
+                    yield {"index": index, "message": messages[index], "deduplicated": n > 0, **line}
+    finally:
+        # El cliente se desconectó o algo falló: no dejar preguntas corriendo
+        for task in tasks:
+            task.cancel()
+        decisions.close()
+
+    yield {
+        "summary": {
+            "messages": len(messages),
+            "unique": len(groups),
+            "errors": errors,
+            "router_chunks": len(decisions.tasks),
+            "batched_decisions": decisions.decided,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+    }
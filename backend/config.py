@@ -19,3 +19,197 @@ LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.2-8b-instruct")
 # Tavily
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY", "")
 DB_PATH = os.getenv("DB_PATH", "./tickets.db")
+
+# Cliente HTTP compartido (pool de conexiones keep-alive)
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "50"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+TAVILY_API_URL = os.getenv("TAVILY_API_URL", "https://api.tavily.com")
+
+# Clasificador local de intención (evita la llamada al LLM router en casos obvios)
+ROUTER_FAST_PATH_ENABLED = os.getenv("ROUTER_FAST_PATH_ENABLED", "true").lower() == "true"
+ROUTER_FAST_PATH_MIN_CONFIDENCE = float(os.getenv("ROUTER_FAST_PATH_MIN_CONFIDENCE", "0.6"))
+
+# Caché de respuestas del agente
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+# TTL en segundos por intención (0 = no guardar esa intención)
+RESPONSE_CACHE_TTL_SQL = float(os.getenv("RESPONSE_CACHE_TTL_SQL", "300"))
+RESPONSE_CACHE_TTL_WEB = float(os.getenv("RESPONSE_CACHE_TTL_WEB", "600"))
+RESPONSE_CACHE_TTL_LLM = float(os.getenv("RESPONSE_CACHE_TTL_LLM", "3600"))
+# Coincidencia por embeddings para paráfrasis (requiere endpoint de embeddings)
+RESPONSE_CACHE_EMBEDDINGS = os.getenv("RESPONSE_CACHE_EMBEDDINGS", "false").lower() == "true"
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+# Solo se compara con las entradas más recientes de la misma intención
+RESPONSE_CACHE_SIMILARITY_CANDIDATES = int(os.getenv("RESPONSE_CACHE_SIMILARITY_CANDIDATES", "256"))
+LLM_EMBEDDING_MODEL = os.getenv("LLM_EMBEDDING_MODEL", "text-embedding-nomic-embed-text-v1.5")
+
+# Pool de conexiones SQLite de solo lectura
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+SQLITE_POOL_TIMEOUT = float(os.getenv("SQLITE_POOL_TIMEOUT", "10"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+
+# Presupuesto por query SQL generado por el LLM
+SQL_TIMEOUT_SECONDS = float(os.getenv("SQL_TIMEOUT_SECONDS", "5"))
+SQL_MAX_VM_STEPS = int(os.getenv("SQL_MAX_VM_STEPS", "200000000"))
+SQL_PROGRESS_INTERVAL = int(os.getenv("SQL_PROGRESS_INTERVAL", "10000"))
+# Filas estimadas máximas que puede recorrer un join sin índice (filas de la
+# tabla externa × filas de cada SCAN interno). Un solo SCAN no cuenta.
+SQL_MAX_PLAN_ROWS = int(os.getenv("SQL_MAX_PLAN_ROWS", "5000000"))
+
+# Paginación de resultados SQL
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "200"))
+SQL_COUNT_TIMEOUT_SECONDS = float(os.getenv("SQL_COUNT_TIMEOUT_SECONDS", "1"))
+
+# Exportación de resultados SQL (sin límite de filas)
+# El timeout cuenta solo el tiempo dentro de SQLite, no la descarga.
+SQL_EXPORT_TIMEOUT_SECONDS = float(os.getenv("SQL_EXPORT_TIMEOUT_SECONDS", "300"))
+SQL_EXPORT_BATCH_SIZE = int(os.getenv("SQL_EXPORT_BATCH_SIZE", "1000"))
+# Guardia del plan para exportar: exportar tablas completas es el punto,
+# así que solo se rechazan joins cartesianos mucho más grandes
+SQL_EXPORT_MAX_PLAN_ROWS = int(os.getenv("SQL_EXPORT_MAX_PLAN_ROWS", "100000000"))
+# Exportaciones a la vez (0 = sin límite). Usan conexiones extra del pool,
+# para no quitarle conexiones a /agent mientras el cliente descarga.
+SQL_EXPORT_MAX_CONCURRENCY = int(os.getenv("SQL_EXPORT_MAX_CONCURRENCY", "2"))
+
+# Presupuesto (tokens aprox.) del resultado SQL dentro del prompt de respuesta
+SQL_SUMMARY_TOKEN_BUDGET = int(os.getenv("SQL_SUMMARY_TOKEN_BUDGET", "1500"))
+
+# Modo del router:
+# "two_call": el router clasifica y una segunda llamada responde
+# "inline_answer": para la intención "llm" el router responde en la misma llamada
+ROUTER_MODE = os.getenv("ROUTER_MODE", "two_call")
+
+# Planes de varias acciones: con más de 1, el router puede pedir varias
+# consultas SQL y/o búsquedas web independientes (intención "plan"). Se
+# ejecutan en paralelo (en la API async), cada una con su timeout, antes
+# de una sola llamada que redacta la respuesta. 1 = una acción por pregunta.
+ROUTER_MAX_ACTIONS = int(os.getenv("ROUTER_MAX_ACTIONS", "3"))
+PLAN_ACTION_TIMEOUT = float(os.getenv("PLAN_ACTION_TIMEOUT", "15"))
+
+# Ejecución especulativa (solo en la API async): ramas que se lanzan en
+# paralelo con el router. "" = desactivado, "llm", "web" o "llm,web".
+# Cada rama es trabajo extra que se tira si el router elige otra cosa.
+SPECULATIVE_BRANCHES = [
+    b.strip() for b in os.getenv("SPECULATIVE_BRANCHES", "").split(",") if b.strip()
+]
+# Máximo de peticiones especulando a la vez; por encima de esto (carga alta)
+# se vuelve al flujo secuencial para no gastar slots del LLM
+SPECULATIVE_MAX_INFLIGHT = int(os.getenv("SPECULATIVE_MAX_INFLIGHT", "4"))
+
+# Caché del prefijo del prompt en el proveedor
+# llama.cpp: reutiliza el KV cache del prefijo común entre peticiones
+LLM_CACHE_PROMPT = os.getenv("LLM_CACHE_PROMPT", "true").lower() == "true"
+# Gemini: TTL (segundos) del contexto cacheado para los system prompts que
+# se repiten; 0 = solo la caché implícita de Google
+GEMINI_CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+
+# Esquema del router: se lee de la base al arrancar y se recorta por mensaje
+SCHEMA_PRUNING_ENABLED = os.getenv("SCHEMA_PRUNING_ENABLED", "true").lower() == "true"
+# Filas leídas por tabla para sacar valores de ejemplo
+SCHEMA_SAMPLE_ROWS = int(os.getenv("SCHEMA_SAMPLE_ROWS", "2000"))
+SCHEMA_SAMPLE_VALUES = int(os.getenv("SCHEMA_SAMPLE_VALUES", "3"))
+# Columnas de texto con hasta N valores distintos se listan completas
+SCHEMA_ENUM_MAX_VALUES = int(os.getenv("SCHEMA_ENUM_MAX_VALUES", "8"))
+
+# Salida estructurada para respuestas JSON (router):
+# "json_schema" (response_format), "grammar" (GBNF, solo llama.cpp) u "off".
+# OpenAI y Gemini usan su modo nativo salvo con "off".
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "json_schema")
+
+# Varios servidores LLM locales (OpenAI-like) separados por coma.
+# Si no se define, se usa solo LLM_API_BASE.
+LLM_API_BASES = [
+    url.strip().rstrip("/") for url in os.getenv("LLM_API_BASES", LLM_API_BASE).split(",") if url.strip()
+]
+# Circuit breaker: fallos seguidos para sacar un servidor y segundos fuera
+LLM_CIRCUIT_FAILURES = int(os.getenv("LLM_CIRCUIT_FAILURES", "3"))
+LLM_CIRCUIT_COOLDOWN = float(os.getenv("LLM_CIRCUIT_COOLDOWN", "30"))
+# Health checks en segundo plano (segundos entre rondas; 0 = desactivados)
+LLM_HEALTH_CHECK_INTERVAL = float(os.getenv("LLM_HEALTH_CHECK_INTERVAL", "10"))
+LLM_HEALTH_CHECK_TIMEOUT = float(os.getenv("LLM_HEALTH_CHECK_TIMEOUT", "2"))
+# Hedging (API async): duplicar la petición a otro servidor si tarda más
+# que el p95 reciente (nunca antes de LLM_HEDGE_MIN_DELAY segundos)
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+
+# Modelo por etapa: el router (clasificación corta) puede usar un modelo
+# chico y rápido y las respuestas uno más grande. Cada etapa lee
+# LLM_<ETAPA>_PROVIDER, _MODEL, _API_BASES, _TIMEOUT y _MAX_CONCURRENCY;
+# lo que no se defina usa la configuración general de arriba.
+# MODEL vacío = modelo por defecto del proveedor; MAX_CONCURRENCY 0 = sin límite.
+def _llm_stage(prefix: str) -> dict:
+    api_bases = os.getenv(f"{prefix}_API_BASES", "")
+    return {
+        "provider": os.getenv(f"{prefix}_PROVIDER", LLM_PROVIDER),
+        "model": os.getenv(f"{prefix}_MODEL", ""),
+        "api_bases": [url.strip().rstrip("/") for url in api_bases.split(",") if url.strip()] or LLM_API_BASES,
+        "timeout": float(os.getenv(f"{prefix}_TIMEOUT", str(HTTP_TIMEOUT))),
+        "max_concurrency": int(os.getenv(f"{prefix}_MAX_CONCURRENCY", "0")),
+    }
+
+
+LLM_STAGES = {
+    "router": _llm_stage("LLM_ROUTER"),
+    "sql_answer": _llm_stage("LLM_SQL_ANSWER"),
+    "web_answer": _llm_stage("LLM_WEB_ANSWER"),
+    "llm_answer": _llm_stage("LLM_ANSWER"),
+}
+
+# Caché de búsquedas web (llave = consulta normalizada). Las búsquedas
+# iguales que llegan al mismo tiempo se agrupan en una sola llamada a Tavily.
+WEB_SEARCH_CACHE_TTL = float(os.getenv("WEB_SEARCH_CACHE_TTL", "120"))  # 0 = no guardar
+WEB_SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("WEB_SEARCH_CACHE_MAX_ENTRIES", "500"))
+
+# Búsqueda web: resultados por consulta y si se pide el texto completo de
+# cada página (más descarga, pero mejores pasajes para el contexto)
+WEB_SEARCH_MAX_RESULTS = int(os.getenv("WEB_SEARCH_MAX_RESULTS", "3"))
+WEB_SEARCH_RAW_CONTENT = os.getenv("WEB_SEARCH_RAW_CONTENT", "false").lower() == "true"
+# Presupuesto (tokens aprox.) de los resultados web dentro del prompt de respuesta
+WEB_CONTEXT_TOKEN_BUDGET = int(os.getenv("WEB_CONTEXT_TOKEN_BUDGET", "1200"))
+
+# Nivel de logging ("DEBUG" muestra el detalle de cada petición)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Permite pedir la traza JSON de una petición con la cabecera X-Agent-Debug: 1
+DEBUG_TRACE_ENABLED = os.getenv("DEBUG_TRACE_ENABLED", "true").lower() == "true"
+
+# Grabación de tráfico real para reproducirlo en benchmarks (ver
+# traffic_recorder.py y bench/replay.py). Vacío = apagado. Guarda los
+# mensajes de los usuarios: activarlo solo donde eso esté permitido.
+TRAFFIC_RECORD_PATH = os.getenv("TRAFFIC_RECORD_PATH", "")
+# Proporción de peticiones que se graban (0 a 1)
+TRAFFIC_RECORD_SAMPLE_RATE = float(os.getenv("TRAFFIC_RECORD_SAMPLE_RATE", "1.0"))
+# Al pasar este tamaño el log deja de crecer (0 = sin límite)
+TRAFFIC_RECORD_MAX_MB = float(os.getenv("TRAFFIC_RECORD_MAX_MB", "500"))
+
+# Control de admisión (ver admission.py): preguntas atendidas a la vez y en
+# fila (0 = sin límite). Con la fila llena se responde 429 con Retry-After.
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+# Segundos máximos en fila antes del 429 (debajo del timeout de los clientes)
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "20"))
+# Parte de los lugares que puede ocupar el carril "low" (jobs, X-Agent-Priority: low)
+ADMISSION_LOW_PRIORITY_SHARE = float(os.getenv("ADMISSION_LOW_PRIORITY_SHARE", "0.5"))
+
+# Llamadas en curso por servicio externo (0 = sin límite). El del LLM suma
+# todas las etapas; el de SQLite evita que los hilos esperen el pool.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "0"))
+SQLITE_MAX_CONCURRENCY = int(os.getenv("SQLITE_MAX_CONCURRENCY", str(SQLITE_POOL_SIZE)))
+TAVILY_MAX_CONCURRENCY = int(os.getenv("TAVILY_MAX_CONCURRENCY", "8"))
+
+# Jobs async (POST /agent/jobs): pendientes como máximo y segundos que se
+# guarda el resultado después de terminar
+JOBS_MAX_PENDING = int(os.getenv("JOBS_MAX_PENDING", "500"))
+JOBS_RESULT_TTL = float(os.getenv("JOBS_RESULT_TTL", "600"))
+
+# /agent/batch: preguntas como máximo por petición y cuántas corren a la
+# vez (cada una pasa además por el control de admisión en el carril "low")
+BATCH_MAX_MESSAGES = int(os.getenv("BATCH_MAX_MESSAGES", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+# Preguntas por llamada al router en un batch (0 o 1 = una llamada por pregunta)
+ROUTER_BATCH_SIZE = int(os.getenv("ROUTER_BATCH_SIZE", "8"))
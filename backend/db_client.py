@@ -4,11 +4,38 @@ Módulo para manejar la conexión a la base de datos SQLite
 y ejecutar consultas de solo lectura de forma segura.
 """
 
+import base64
+import json
+import os
+import queue
+import re
 import sqlite3
-from typing import Any, Dict
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
 
-from .config import DB_PATH
+from .config import (
+    DB_PATH,
+    SQLITE_POOL_SIZE,
+    SQLITE_POOL_TIMEOUT,
+    SQLITE_CACHE_SIZE_KB,
+    SQLITE_MMAP_SIZE,
+    SQLITE_STATEMENT_CACHE,
+    SQL_TIMEOUT_SECONDS,
+    SQL_MAX_VM_STEPS,
+    SQL_PROGRESS_INTERVAL,
+    SQL_MAX_PLAN_ROWS,
+    SQL_MAX_ROWS,
+    SQL_COUNT_TIMEOUT_SECONDS,
+    SQL_EXPORT_TIMEOUT_SECONDS,
+    SQL_EXPORT_BATCH_SIZE,
+    SQL_EXPORT_MAX_PLAN_ROWS,
+    SQL_EXPORT_MAX_CONCURRENCY,
+)
 
+T = TypeVar("T")
 
 FORBIDDEN_SQL_KEYWORDS = [
     "insert",
@@ -49,36 +76,577 @@ def is_safe_select_query(query: str) -> bool:
     return True
 
 
-def run_select_query(query: str) -> Dict[str, Any]:
+class SQLiteConnectionPool:
+    """
+    Pool de conexiones SQLite de larga vida, abiertas en modo solo lectura
+    (URI con mode=ro y PRAGMA query_only). Reutilizar conexiones conserva
+    la caché de páginas, el esquema ya parseado y los statements preparados.
+    Es seguro usarlo desde varios hilos: cada conexión la usa un hilo a la vez.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        size: int = SQLITE_POOL_SIZE,
+        timeout: float = SQLITE_POOL_TIMEOUT,
+        cache_size_kb: int = SQLITE_CACHE_SIZE_KB,
+        mmap_size: int = SQLITE_MMAP_SIZE,
+        statement_cache: int = SQLITE_STATEMENT_CACHE,
+    ):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.statement_cache = statement_cache
+
+        # LIFO: la conexión usada más recientemente tiene la caché más caliente
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+        # (huella de la base, filas por tabla), para estimar el costo de
+        # los planes de ejecución
+        self._table_rows: Optional[Tuple[Tuple[int, int, int], Dict[str, int]]] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(
+            uri,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=self.statement_cache,
+        )
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA cache_size = -{self.cache_size_kb}")
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        # Creamos conexiones nuevas solo hasta el tamaño del pool
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError("No hay conexiones SQLite disponibles en el pool")
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._created -= 1
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Presta una conexión del pool y la devuelve al terminar, incluso si
+        el query lanza una excepción.
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+        except sqlite3.OperationalError:
+            # Errores normales del query (sintaxis, tabla inexistente...):
+            # la conexión sigue sana
+            self._idle.put(conn)
+            raise
+        except sqlite3.DatabaseError:
+            # Cualquier otro error de SQLite: descartamos la conexión
+            self._discard(conn)
+            raise
+        except BaseException:
+            self._idle.put(conn)
+            raise
+        else:
+            self._idle.put(conn)
+
+    def table_row_counts(self, conn: sqlite3.Connection) -> Dict[str, int]:
+        """
+        Número de filas por tabla. Usa sqlite_stat1 (ANALYZE) si existe; si
+        no, COUNT(*) con el presupuesto corto de SQL_COUNT_TIMEOUT_SECONDS
+        y, si no alcanza, MAX(rowid) como estimación. Se vuelve a calcular
+        cuando cambia la base (ver db_signature).
+        """
+        signature = db_signature(self.db_path)
+        cached = self._table_rows
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        counts: Dict[str, int] = {}
+        tables = [
+            row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            )
+        ]
+
+        try:
+            # La primera cifra de cada fila es el total de filas de la tabla
+            for tbl, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+                counts[tbl] = max(counts.get(tbl, 0), int(stat.split()[0]))
+        except sqlite3.OperationalError:
+            pass  # No hay estadísticas de ANALYZE
+
+        for table in tables:
+            if table not in counts:
+                counts[table] = self._count_rows(conn, table)
+
+        self._table_rows = (signature, counts)
+        return counts
+
+    def _count_rows(self, conn: sqlite3.Connection, table: str) -> int:
+        with QueryBudget(conn, timeout=SQL_COUNT_TIMEOUT_SECONDS) as budget:
+            try:
+                return conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+            except sqlite3.OperationalError:
+                if not budget.exceeded:
+                    raise
+
+        # Tabla muy grande: con rowid autoincremental, MAX(rowid) es una
+        # buena cota y SQLite la lee del índice en O(log n)
+        try:
+            return conn.execute(f'SELECT MAX(rowid) FROM "{table}"').fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            return 0  # Tabla WITHOUT ROWID
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+def db_signature(db_path: str) -> Tuple[int, int, int]:
+    """
+    Huella del archivo SQLite (y su WAL, si existe). Cambia cuando
+    alguien escribe en la base de datos.
+    """
+    try:
+        st = os.stat(db_path)
+    except OSError:
+        return (0, 0, 0)
+
+    try:
+        wal_mtime = os.stat(f"{db_path}-wal").st_mtime_ns
+    except OSError:
+        wal_mtime = 0
+
+    return (st.st_mtime_ns, st.st_size, wal_mtime)
+
+
+_pool: Optional[SQLiteConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> SQLiteConnectionPool:
+    """
+    Devuelve el pool compartido (se crea en el primer uso). Tiene una
+    conexión extra por cada exportación permitida a la vez.
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = SQLiteConnectionPool(DB_PATH, size=SQLITE_POOL_SIZE + max(0, SQL_EXPORT_MAX_CONCURRENCY))
+        return _pool
+
+
+def close_pool() -> None:
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+class QueryBudget:
+    """
+    Límite de tiempo y de pasos de la VM de SQLite para un query.
+    Usa el progress handler de SQLite: cuando se agota el presupuesto,
+    el handler devuelve 1 y SQLite interrumpe el query con
+    OperationalError("interrupted").
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        timeout: float = SQL_TIMEOUT_SECONDS,
+        max_steps: int = SQL_MAX_VM_STEPS,
+        interval: int = SQL_PROGRESS_INTERVAL,
+    ):
+        self.conn = conn
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.interval = interval
+        self.steps = 0
+        self.exceeded: Optional[str] = None
+
+    def _check(self) -> int:
+        self.steps += self.interval
+
+        if self.max_steps and self.steps > self.max_steps:
+            self.exceeded = "step_budget_exceeded"
+            return 1
+
+        if self.timeout and time.monotonic() > self.deadline:
+            self.exceeded = "query_timeout"
+            return 1
+
+        return 0
+
+    def __enter__(self) -> "QueryBudget":
+        self.deadline = time.monotonic() + self.timeout
+        self.conn.set_progress_handler(self._check, self.interval)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.conn.set_progress_handler(None, 0)
+
+    def error(self) -> Dict[str, Any]:
+        if self.exceeded == "query_timeout":
+            message = f"El query superó el tiempo máximo de {self.timeout} s."
+        else:
+            message = f"El query superó el límite de {self.max_steps} pasos de ejecución."
+
+        return _error_result(
+            message,
+            self.exceeded,
+            {"timeout_seconds": self.timeout, "max_steps": self.max_steps, "steps": self.steps},
+        )
+
+
+PLAN_LINE_RE = re.compile(r"^(SCAN|SEARCH) (?:TABLE )?(\w+)")
+# "FROM tickets t", "JOIN asignaciones AS a", ", tickets t2"
+TABLE_ALIAS_RE = re.compile(r"(?:\bfrom|\bjoin|,)\s*(\w+)(?:\s+(?:as\s+)?(\w+))?", re.IGNORECASE)
+
+# "LIMIT 10", "LIMIT 10 OFFSET 20" o "LIMIT 20, 10" al final del query
+LIMIT_RE = re.compile(r"\blimit\s+(\d+)(?:\s+offset\s+(\d+)|\s*,\s*(\d+))?\s*$", re.IGNORECASE)
+# Con agregados, GROUP BY o DISTINCT el LIMIT no evita recorrer todo
+AGGREGATE_RE = re.compile(
+    r"\b(?:count|sum|avg|min|max|total|group_concat)\s*\(|\bgroup\s+by\b|\bdistinct\b", re.IGNORECASE
+)
+
+# Filas estimadas que devuelve una búsqueda por índice (SEARCH)
+INDEXED_SEARCH_ROWS = 10
+
+
+def _limit_rows(query: str) -> Optional[int]:
+    """
+    Filas que pide el LIMIT final (más el OFFSET), si el query termina en
+    uno y el LIMIT de verdad corta la ejecución.
+    """
+    match = LIMIT_RE.search(query)
+    if match is None or AGGREGATE_RE.search(query):
+        return None
+    return sum(int(n) for n in match.groups() if n)
+
+
+def check_query_plan(
+    conn: sqlite3.Connection, query: str, max_rows: int = SQL_MAX_PLAN_ROWS
+) -> Optional[Dict[str, Any]]:
+    """
+    Revisa EXPLAIN QUERY PLAN antes de ejecutar el query. Cada nivel del
+    plan (mismo "parent") es un loop anidado: el primer loop es la tabla
+    externa y los demás se repiten por cada fila de ella. Solo se cobra el
+    SCAN completo de una tabla interna (un join sin condición usable):
+    filas externas × filas de los SCAN internos. Un solo SCAN, o joins por
+    índice (SEARCH), son lineales y los cubre QueryBudget. Con un LIMIT que
+    corta la ejecución, la tabla externa cuenta a lo más LIMIT filas.
+    Devuelve un error estructurado si el costo supera `max_rows`, o None.
+    """
+    if not max_rows:
+        return None
+
+    row_counts = get_pool().table_row_counts(conn)
+
+    # El plan usa el alias de la tabla cuando lo hay
+    aliases = {table: table for table in row_counts}
+    for table, alias in TABLE_ALIAS_RE.findall(query):
+        if table in row_counts and alias:
+            aliases[alias] = table
+
+    # parent -> [(tipo, filas)] en el orden de los loops
+    levels: Dict[int, List[Tuple[str, int]]] = {}
+    sorts = False
+
+    for _, parent, _, detail in conn.execute(f"EXPLAIN QUERY PLAN {query}"):
+        # Ordenar o agrupar en un b-tree temporal lee todo antes del LIMIT
+        sorts = sorts or detail.startswith("USE TEMP B-TREE")
+        match = PLAN_LINE_RE.match(detail)
+        if not match:
+            continue
+
+        kind, table = match.groups()
+        if kind == "SCAN":
+            rows = row_counts.get(aliases.get(table, table), 1)
+        else:
+            rows = INDEXED_SEARCH_ROWS
+
+        levels.setdefault(parent, []).append((kind, max(rows, 1)))
+
+    limit = None if sorts else _limit_rows(query)
+    estimated = 0
+    for parent, loops in levels.items():
+        inner_scans = [rows for kind, rows in loops[1:] if kind == "SCAN"]
+        if not inner_scans:
+            continue
+
+        outer = loops[0][1]
+        if parent == 0 and limit is not None:
+            outer = min(outer, limit)
+        cost = outer
+        for rows in inner_scans:
+            cost *= rows
+        estimated += cost
+
+    if estimated > max_rows:
+        return _error_result(
+            "El query recorrería demasiadas filas "
+            f"(~{estimated:,} estimadas, máximo {max_rows:,}). "
+            "Agrega filtros o evita joins sin condición.",
+            "plan_rejected",
+            {"estimated_rows": estimated, "max_rows": max_rows},
+        )
+
+    return None
+
+
+def _error_result(message: str, code: str, detail: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Resultado de error con la misma forma que un resultado normal, más un
+    código estable (`error_code`) y detalles para el cliente.
+    """
+    return {
+        "error": message,
+        "error_code": code,
+        "error_detail": detail,
+        "columns": [],
+        "rows": [],
+    }
+
+
+def encode_continuation_token(
+    query: str, offset: int, page_size: int, total_rows: Optional[int] = None
+) -> str:
+    """
+    Token opaco para pedir la siguiente página de un resultado.
+    Contiene el query, así que se vuelve a validar al usarlo, y el total
+    ya calculado para no volver a contar en cada página.
+    """
+    state = {"q": query, "o": offset, "n": page_size, "t": total_rows}
+    payload = json.dumps(state, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_continuation_token(token: str) -> Dict[str, Any]:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        total = state.get("t")
+        return {
+            "q": str(state["q"]),
+            "o": int(state["o"]),
+            "n": int(state["n"]),
+            "t": int(total) if total is not None else None,
+        }
+    except Exception:
+        raise ValueError("Token de continuación inválido.")
+
+
+def run_select_query(query: str, max_rows: int = SQL_MAX_ROWS) -> Dict[str, Any]:
     """
     Ejecuta un SELECT seguro y devuelve:
     {
         "columns": [...],
-        "rows": [...]
+        "rows": [...],              # como máximo `max_rows` filas
+        "truncated": bool,          # hay más filas de las devueltas
+        "total_rows": int | None,   # total (o None si contarlas es muy caro)
+        "next_token": str | None    # para pedir la siguiente página
     }
     """
+    return _run_page(query, 0, max_rows)
+
+
+def fetch_page(token: str) -> Dict[str, Any]:
+    """
+    Devuelve la página indicada por un token de continuación, con la
+    misma forma que run_select_query().
+    """
+    try:
+        state = decode_continuation_token(token)
+    except ValueError as e:
+        return _error_result(str(e), "invalid_token")
+
+    page_size = max(1, min(state["n"], SQL_MAX_ROWS))
+    return _run_page(state["q"], state["o"], page_size, known_total=state["t"])
+
+
+def _run_page(
+    query: str, offset: int, limit: int, known_total: Optional[int] = None
+) -> Dict[str, Any]:
     if not is_safe_select_query(query):
-        return {
-            "error": "El query no es seguro o no es un SELECT.",
-            "columns": [],
-            "rows": [],
-        }
+        return _error_result("El query no es seguro o no es un SELECT.", "unsafe_query")
+
+    inner = query.strip().rstrip(";")
 
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        conn.close()
+        with get_pool().connection() as conn:
+            rejection = check_query_plan(conn, inner)
+            if rejection is not None:
+                return rejection
+
+            with QueryBudget(conn) as budget:
+                try:
+                    # Pedimos una fila extra para saber si hay más
+                    if offset:
+                        cursor = conn.execute(
+                            f"SELECT * FROM ({inner}) LIMIT ? OFFSET ?", (limit + 1, offset)
+                        )
+                    else:
+                        cursor = conn.execute(inner)
+                    try:
+                        rows = cursor.fetchmany(limit + 1)
+                        column_names = [desc[0] for desc in cursor.description]
+                    finally:
+                        cursor.close()
+                except sqlite3.OperationalError:
+                    if budget.exceeded:
+                        return budget.error()
+                    raise
+
+            truncated = len(rows) > limit
+            rows = rows[:limit]
+
+            if truncated:
+                total_rows = known_total
+                if total_rows is None:
+                    total_rows = _estimate_total_rows(conn, inner)
+                next_token = encode_continuation_token(inner, offset + limit, limit, total_rows)
+            else:
+                total_rows = offset + len(rows)
+                next_token = None
 
         return {
             "columns": column_names,
             "rows": rows,
+            "truncated": truncated,
+            "total_rows": total_rows,
+            "next_token": next_token,
         }
     except Exception as e:
-        return {
-            "error": str(e),
-            "columns": [],
-            "rows": [],
-        }
+        return _error_result(str(e), "execution_error")
+
+
+def _estimate_total_rows(conn: sqlite3.Connection, query: str) -> Optional[int]:
+    """
+    Cuenta las filas del resultado con un presupuesto corto.
+    Si no alcanza, devuelve None en lugar de bloquear la respuesta.
+    """
+    with QueryBudget(conn, timeout=SQL_COUNT_TIMEOUT_SECONDS) as budget:
+        try:
+            return conn.execute(f"SELECT COUNT(*) FROM ({query})").fetchone()[0]
+        except sqlite3.OperationalError:
+            if budget.exceeded:
+                return None
+            raise
+
+
+# ---------------------------
+# EXPORTACIÓN EN STREAMING
+# ---------------------------
+
+def validate_export_query(query: str) -> Optional[Dict[str, Any]]:
+    """
+    Valida un query antes de exportarlo (seguridad y plan de ejecución,
+    con el tope de SQL_EXPORT_MAX_PLAN_ROWS). Devuelve un resultado de
+    error o None si se puede exportar.
+    """
+    if not is_safe_select_query(query):
+        return _error_result("El query no es seguro o no es un SELECT.", "unsafe_query")
+
+    try:
+        with get_pool().connection() as conn:
+            return check_query_plan(conn, query.strip().rstrip(";"), max_rows=SQL_EXPORT_MAX_PLAN_ROWS)
+    except Exception as e:
+        return _error_result(str(e), "execution_error")
+
+
+def iter_select_batches(
+    query: str, batch_size: int = SQL_EXPORT_BATCH_SIZE
+) -> Iterator[Tuple[List[str], List[tuple]]]:
+    """
+    Ejecuta el query y va devolviendo (columnas, lote de filas) directo
+    del cursor con fetchmany, sin acumular el resultado en memoria.
+    La conexión se devuelve al pool cuando el generador termina o se cierra.
+    SQL_EXPORT_TIMEOUT_SECONDS cuenta solo el tiempo dentro de SQLite: el
+    tiempo que el cliente tarda en descargar cada lote no se descuenta.
+    Llamar antes a validate_export_query().
+    """
+    with get_pool().connection() as conn:
+        budget = _ExportBudget(conn)
+        cursor = budget.run(lambda: conn.execute(query.strip().rstrip(";")))
+        try:
+            columns = [desc[0] for desc in cursor.description]
+
+            # El primer lote se entrega aunque venga vacío, para
+            # que el cliente siempre reciba las columnas
+            rows = budget.run(lambda: cursor.fetchmany(batch_size))
+            yield columns, rows
+
+            while rows:
+                rows = budget.run(lambda: cursor.fetchmany(batch_size))
+                if rows:
+                    yield columns, rows
+        finally:
+            cursor.close()
+
+
+class _ExportBudget:
+    """
+    Tiempo de SQLite acumulado de una exportación. Cada paso (execute o
+    fetchmany) corre con un QueryBudget por el tiempo que queda.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, timeout: float = SQL_EXPORT_TIMEOUT_SECONDS):
+        self.conn = conn
+        self.timeout = timeout
+        self.spent = 0.0
+
+    def _timeout_error(self) -> TimeoutError:
+        return TimeoutError(f"La exportación superó el tiempo máximo de {self.timeout} s en SQLite.")
+
+    def run(self, step: Callable[[], T]) -> T:
+        remaining = self.timeout - self.spent
+        if self.timeout and remaining <= 0:
+            raise self._timeout_error()
+
+        started = time.monotonic()
+        try:
+            with QueryBudget(self.conn, timeout=remaining if self.timeout else 0, max_steps=0) as budget:
+                try:
+                    return step()
+                except sqlite3.OperationalError:
+                    if budget.exceeded:
+                        raise self._timeout_error()
+                    raise
+        finally:
+            self.spent += time.monotonic() - started
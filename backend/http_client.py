@@ -0,0 +1,76 @@
+# backend/http_client.py
+"""
+Clientes HTTP compartidos por todo el backend.
+Un solo pool de conexiones keep-alive evita abrir un socket TCP
+(y un handshake TLS) nuevo en cada llamada al LLM o a Tavily.
+"""
+
+from typing import Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from .config import (
+    HTTP_TIMEOUT,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY,
+)
+
+_async_client: Optional[httpx.AsyncClient] = None
+_session: Optional[requests.Session] = None
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Devuelve el cliente async compartido (se crea en el primer uso).
+    """
+    global _async_client
+
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    return _async_client
+
+
+def get_http_session() -> requests.Session:
+    """
+    Devuelve la sesión síncrona compartida, para las rutas que siguen
+    usando `requests`.
+    """
+    global _session
+
+    if _session is None:
+        adapter = HTTPAdapter(
+            pool_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            pool_maxsize=HTTP_MAX_CONNECTIONS,
+        )
+        _session = requests.Session()
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+
+    return _session
+
+
+async def close_http_clients() -> None:
+    """
+    Cierra los pools compartidos (se llama al apagar la API).
+    """
+    global _async_client, _session
+
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+    if _session is not None:
+        _session.close()
+        _session = None
@@ -0,0 +1,138 @@
+# backend/intent_classifier.py
+"""
+Clasificador de intención local (sin LLM).
+Usa reglas de palabras clave sobre el mensaje y sobre las tablas y
+columnas del esquema para resolver los casos obvios en microsegundos.
+Si no está seguro, el router sigue usando el LLM.
+"""
+
+import re
+import unicodedata
+from typing import Any, Dict, Set
+
+from .prompts import DB_SCHEMA_DESCRIPTION
+
+
+# Palabras de columnas demasiado genéricas para indicar una consulta SQL
+GENERIC_SCHEMA_TOKENS = {
+    "fecha", "tiempo", "total", "inicio", "fin", "registro", "cierre",
+    "unidad", "negocio", "personal", "servicio", "motivo", "ubicacion",
+}
+
+# Pistas de consulta analítica (conteos, promedios, rankings...)
+SQL_CUES = [
+    r"\bcuant[oa]s\b", r"\bpromedio\b", r"\bconteo\b", r"\bcontar\b",
+    r"\btop\b", r"\branking\b", r"\bsuma\b", r"\bporcentaje\b",
+    r"\bmaximo\b", r"\bminimo\b", r"\btabla\b", r"\bbase de datos\b",
+]
+
+# Pistas de búsqueda web: (patrón, peso)
+WEB_CUES = [
+    (r"\bnoticias?\b", 2),
+    (r"\bclima\b", 2),
+    (r"\bpronostico\b", 2),
+    (r"\btrending\b", 2),
+    (r"\ben internet\b", 2),
+    (r"\bbusca(r)? en (la )?web\b", 2),
+    (r"\bhoy\b", 1),
+    (r"\bactual(es|mente)?\b", 1),
+    (r"\breciente(s)?\b", 1),
+    (r"\bultim[oa]s?\b", 1),
+    (r"\bprecio\b", 1),
+]
+
+# Pistas de conocimiento general: (patrón, peso)
+LLM_CUES = [
+    (r"^(explica(me)?|define|resume|traduce|escribe|redacta)\b", 2),
+    (r"\bque (es|son|significa)\b", 2),
+    (r"\bcomo funciona\b", 2),
+    (r"\bdiferencia entre\b", 2),
+    (r"^(hola|gracias|buen(os|as) (dias|tardes|noches))\b", 2),
+    (r"\bpor que\b", 1),
+    (r"\bejemplo\b", 1),
+]
+
+
+def normalize_text(text: str) -> str:
+    """
+    Minúsculas, sin acentos, sin signos de puntuación y con espacios simples.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class IntentClassifier:
+    """
+    Pre-clasificador por reglas. classify() devuelve un dict con la misma
+    forma que la respuesta JSON del router LLM, más un "confidence" en [0, 1].
+    """
+
+    def __init__(self, schema_description: str = DB_SCHEMA_DESCRIPTION):
+        self.tables: Set[str] = set()
+        self.columns: Set[str] = set()
+        self.values: Set[str] = set()
+        self._load_schema(schema_description)
+
+    def _load_schema(self, schema_description: str) -> None:
+        for line in schema_description.splitlines():
+            line = line.strip()
+
+            table = re.match(r"^Tabla (\w+):", line)
+            if table:
+                self.tables.add(normalize_text(table.group(1)))
+                continue
+
+            column = re.match(r"^- (\w+)", line)
+            if column:
+                self.columns.add(normalize_text(column.group(1)))
+
+            # Valores literales documentados, ej. ("EN PROCESO", "ATENDIDO")
+            for value in re.findall(r'"([^"]+)"', line):
+                self.values.add(normalize_text(value))
+
+        # Los valores se buscan como palabras completas: un valor corto
+        # leído de la base (ej. "TI") no debe coincidir dentro de "tiempo"
+        self.value_patterns = [
+            re.compile(rf"\b{re.escape(value)}\b") for value in self.values if value
+        ]
+
+        self.column_tokens = {
+            token
+            for column in self.columns
+            for token in column.split("_")
+            if len(token) > 2 and token not in GENERIC_SCHEMA_TOKENS
+        }
+
+    def classify(self, user_message: str) -> Dict[str, Any]:
+        text = normalize_text(user_message)
+        words = set(text.split())
+
+        sql_score = 0
+        sql_score += 2 * sum(
+            1 for table in self.tables
+            if table in words or table.rstrip("s") in words
+        )
+        sql_score += 2 * sum(1 for column in self.columns if column in text)
+        sql_score += 2 * sum(1 for pattern in self.value_patterns if pattern.search(text))
+        sql_score += len(self.column_tokens & words)
+        sql_score += sum(1 for cue in SQL_CUES if re.search(cue, text))
+
+        web_score = sum(weight for cue, weight in WEB_CUES if re.search(cue, text))
+        llm_score = sum(weight for cue, weight in LLM_CUES if re.search(cue, text))
+
+        scores = {"sql": sql_score, "web": web_score, "llm": llm_score}
+        ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+        (intent, best), (_, second) = ranked[0], ranked[1]
+
+        # Confianza: qué tanto gana la mejor intención sobre la segunda
+        confidence = (best - second) / (best + 1) if best > 0 else 0.0
+
+        return {
+            "intent": intent,
+            "sql_query": "",
+            "web_query": user_message.strip() if intent == "web" else "",
+            "explanation": f"Clasificador local, puntajes {scores}",
+            "confidence": round(confidence, 3),
+        }
@@ -0,0 +1,153 @@
+# backend/jobs.py
+"""
+Jobs async para preguntas lentas: POST /agent/jobs devuelve un id al
+instante y la pregunta corre en segundo plano en el carril "low" (ver
+admission.py), sin tope de espera en la fila. El resultado se consulta
+con GET /agent/jobs/{id} o se espera por SSE en /agent/jobs/{id}/events,
+y se guarda JOBS_RESULT_TTL segundos después de terminar.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .admission import AdmissionRejected, admission
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ("done", "error", "cancelled")
+# Sin cambios en este tiempo, el stream de eventos manda un keep-alive
+KEEPALIVE_SECONDS = 15
+
+
+class Job:
+    """
+    Estado de un job: queued -> running -> done | error | cancelled.
+    """
+
+    def __init__(self, request: Any):
+        self.id = uuid.uuid4().hex
+        self.request = request
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def set_status(self, status: str) -> None:
+        self.status = status
+        if status == "running":
+            self.started_at = time.time()
+        elif status in FINISHED:
+            self.finished_at = time.time()
+        # Despierta a quien espera un cambio y prepara el siguiente aviso
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Jobs en memoria del proceso. `run` recibe la petición del job y
+    devuelve el cuerpo de la respuesta (el mismo de /agent).
+    """
+
+    def __init__(self, run: Callable[[Any], Awaitable[Dict[str, Any]]], max_pending: int, ttl: float):
+        self.run = run
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.jobs: Dict[str, Job] = {}
+        self.submitted = 0
+
+    def pending(self) -> int:
+        return sum(1 for job in self.jobs.values() if not job.finished)
+
+    def submit(self, request: Any) -> Job:
+        self._expire()
+        if self.max_pending > 0 and self.pending() >= self.max_pending:
+            raise AdmissionRejected("jobs_full", admission.retry_after())
+
+        job = Job(request)
+        self.jobs[job.id] = job
+        self.submitted += 1
+        job.task = asyncio.create_task(self._run(job))
+        # Un job cancelado antes de empezar no llega a correr _run
+        job.task.add_done_callback(lambda task: self._cancelled(job, task))
+        return job
+
+    async def _run(self, job: Job) -> None:
+        try:
+            async with admission.admit("low", bounded=False):
+                job.set_status("running")
+                job.result = await self.run(job.request)
+            job.set_status("done")
+        except Exception as e:
+            logger.warning("Falló el job %s: %s", job.id, e)
+            job.error = str(e)
+            job.set_status("error")
+
+    def _cancelled(self, job: Job, task: asyncio.Task) -> None:
+        if task.cancelled() and not job.finished:
+            job.set_status("cancelled")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._expire()
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.get(job_id)
+        if job is not None and not job.finished and job.task is not None:
+            job.task.cancel()
+        return job
+
+    async def wait_change(self, job: Job, status: str, timeout: float) -> bool:
+        """
+        Espera hasta que el job deje el estado `status` o pasen `timeout`
+        segundos. Devuelve True si cambió.
+        """
+        if job.status != status:
+            return True
+        try:
+            await asyncio.wait_for(job._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _expire(self) -> None:
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished and now - job.finished_at > self.ttl
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def snapshot(self) -> Dict[str, Any]:
+        statuses: Dict[str, int] = {}
+        for job in self.jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "max_pending": self.max_pending,
+            "pending": self.pending(),
+            "submitted": self.submitted,
+            "by_status": statuses,
+        }
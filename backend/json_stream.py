@@ -0,0 +1,163 @@
+# backend/json_stream.py
+"""
+Parser incremental para el JSON del router.
+Se alimenta con los fragmentos que va generando el LLM y:
+- expone los campos de texto de primer nivel en cuanto se cierran
+  (por ejemplo "intent" o "sql_query"), y las listas de strings de
+  primer nivel ("sql_queries") en cuanto se cierra la lista, y
+- devuelve el contenido de un campo elegido ("answer") conforme llega,
+  para poder mandarlo al usuario antes de que termine el JSON.
+Ignora el texto antes del primer "{" (por ejemplo un bloque ```json).
+"""
+
+import json
+from typing import Dict, List, Optional, Union
+
+_SIMPLE_ESCAPES = {
+    '"': '"', "\\": "\\", "/": "/",
+    "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t",
+}
+
+
+class JsonFieldStreamer:
+    def __init__(self, stream_field: Optional[str] = None):
+        self.stream_field = stream_field
+        self.text = ""
+        # Campos de texto (o listas de strings) de primer nivel ya completos
+        self.fields: Dict[str, Union[str, List[str]]] = {}
+        self.done = False
+
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._in_escape = False
+        self._escape = ""          # secuencia de escape en curso (ej. "u00e")
+        self._high_surrogate: Optional[int] = None
+        self._expect_key = False
+        self._current = []         # contenido del string actual
+        self._is_key = False
+        self._last_key: Optional[str] = None
+        self._value_key: Optional[str] = None  # llave cuyo valor string estamos leyendo
+        self._list_key: Optional[str] = None   # llave cuya lista estamos leyendo
+        self._list_items: List[str] = []
+
+    def feed(self, chunk: str) -> List[str]:
+        """
+        Procesa un fragmento. Devuelve los pedazos nuevos del campo
+        `stream_field` (ya sin escapes JSON).
+        """
+        self.text += chunk
+        emitted: List[str] = []
+
+        for ch in chunk:
+            if self.done:
+                break
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                    self._expect_key = True
+                continue
+
+            if self._in_string:
+                piece = self._string_char(ch)
+                if piece and self._streaming():
+                    emitted.append(piece)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._current = []
+                self._is_key = self._depth == 1 and self._expect_key
+                if not self._is_key and self._depth == 1:
+                    self._value_key = self._last_key
+            elif ch in "{[":
+                if ch == "[" and self._depth == 1:
+                    self._list_key = self._last_key
+                    self._list_items = []
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and ch == "]" and self._list_key is not None:
+                    self.fields[self._list_key] = self._list_items
+                    self._list_key = None
+                if self._depth == 0:
+                    self.done = True
+            elif ch == "," and self._depth == 1:
+                self._expect_key = True
+            elif ch == ":" and self._depth == 1:
+                self._expect_key = False
+
+        return ["".join(emitted)] if emitted else []
+
+    def _streaming(self) -> bool:
+        return (
+            self.stream_field is not None
+            and not self._is_key
+            and self._value_key == self.stream_field
+        )
+
+    def _string_char(self, ch: str) -> str:
+        """
+        Procesa un carácter dentro de un string. Devuelve el texto
+        decodificado que aporta (vacío si es parte de un escape o el cierre).
+        """
+        if self._in_escape:
+            self._escape += ch
+            if self._escape[0] == "u":
+                if len(self._escape) < 5:
+                    return ""
+                decoded = self._unicode_escape(int(self._escape[1:], 16))
+            else:
+                decoded = _SIMPLE_ESCAPES.get(self._escape, self._escape)
+            self._in_escape = False
+            self._escape = ""
+            self._current.append(decoded)
+            return decoded
+
+        if ch == "\\":
+            self._in_escape = True
+            return ""
+
+        if ch == '"':
+            self._close_string()
+            return ""
+
+        self._current.append(ch)
+        return ch
+
+    def _unicode_escape(self, code: int) -> str:
+        # Los caracteres fuera del BMP llegan como par sustituto: \ud83d\ude00
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+            return ""
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            high, self._high_surrogate = self._high_surrogate, None
+            return chr(0x10000 + ((high - 0xD800) << 10) + (code - 0xDC00))
+        return chr(code)
+
+    def _close_string(self) -> None:
+        self._in_string = False
+        value = "".join(self._current)
+
+        if self._is_key:
+            self._last_key = value
+        elif self._depth == 1 and self._value_key is not None:
+            self.fields[self._value_key] = value
+            self._value_key = None
+        elif self._depth == 2 and self._list_key is not None:
+            self._list_items.append(value)
+
+    def result(self) -> Dict[str, object]:
+        """
+        JSON completo, si ya se puede parsear; si no, los campos completos.
+        """
+        start = self.text.find("{")
+        end = self.text.rfind("}")
+        if start != -1 and end > start:
+            try:
+                return json.loads(self.text[start:end + 1])
+            except ValueError:
+                pass
+        return dict(self.fields)
@@ -1,20 +1,45 @@
 # backend/llm_client.py
 
-import requests
-from typing import List, Dict, Any
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from typing import List, Dict, Any, Iterator, AsyncIterator, Optional, Tuple
 from .config import (
     LLM_PROVIDER,
     OPENAI_API_KEY,
     GEMINI_API_KEY,
-    LLM_API_BASE,
     LLM_MODEL,
+    LLM_EMBEDDING_MODEL,
+    HTTP_TIMEOUT,
+    LLM_CACHE_PROMPT,
+    GEMINI_CONTEXT_CACHE_TTL,
+    LLM_STRUCTURED_OUTPUT,
+    LLM_API_BASES,
+    LLM_STAGES,
+)
+from .admission import ConcurrencyLimiter, upstream_limiter
+from .http_client import get_async_http_client, get_http_session
+from .llm_endpoints import LLMEndpointError, get_llm_endpoints
+from .metrics import LLM_ERRORS, LLM_FIRST_TOKEN_SECONDS, record_llm_usage, span
+from .result_summarizer import estimate_tokens
+from .traffic_recorder import record_llm_call
+from .structured_output import (
+    json_schema_to_gbnf,
+    lmstudio_response_format,
+    openai_text_format,
+    gemini_response_schema,
 )
 
 # IMPORTS SEGÚN PROVEEDOR
 try:
-    from openai import OpenAI
+    from openai import OpenAI, AsyncOpenAI
 except:
     OpenAI = None
+    AsyncOpenAI = None
 
 try:
     from google import genai
@@ -22,6 +47,61 @@ try:
 except:
     genai = None
 
+logger = logging.getLogger(__name__)
+
+JSON_INSTRUCTION = (
+    "Responde únicamente con un JSON válido. No incluyas explicación, "
+    "texto adicional, ni comentarios. Solo devuelve un objeto JSON."
+)
+
+# Modelo por defecto de cada proveedor cuando la etapa no define uno
+DEFAULT_MODELS = {
+    "local": LLM_MODEL,
+    "openai": "gpt-5-mini",
+    "gemini": "gemini-2.5-flash",
+}
+
+# Un system prompt de Gemini se cachea explícitamente a partir de esta
+# cantidad de usos (los prompts con datos variables nunca se repiten)
+GEMINI_CACHE_MIN_USES = 2
+GEMINI_CACHE_MAX_TRACKED = 1000
+
+
+class PromptCacheStats:
+    """
+    Tokens de prompt enviados al proveedor y cuántos se sirvieron desde su
+    caché de prefijos (KV cache de llama.cpp, prompt caching de OpenAI,
+    context caching de Gemini).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, prompt_tokens: Optional[int], cached_tokens: Optional[int]) -> None:
+        if prompt_tokens is None:
+            return
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens or 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            ratio = self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cached_ratio": round(ratio, 4),
+            }
+
+
+# Compartida por todos los clientes (etapas)
+PROMPT_CACHE_STATS = PromptCacheStats()
+
 
 class LLMClient:
     """
@@ -29,66 +109,330 @@ class LLMClient:
     - LM Studio / Ollama / llama.cpp (OpenAI-like)
     - OpenAI oficial
     - Gemini (Google)
+
+    Cada método tiene su versión async (achat, achat_json, achat_stream)
+    que usa el pool HTTP compartido en lugar de bloquear un hilo.
+
+    Con `stage` ("router", "sql_answer", "web_answer", "llm_answer") el
+    proveedor, modelo, servidores, timeout y concurrencia salen de
+    LLM_STAGES; sin él se usa la configuración general sin límite.
     """
 
-    def __init__(self):
+    def __init__(self, stage: Optional[str] = None):
+        if stage is not None and stage not in LLM_STAGES:
+            raise ValueError(f"Etapa LLM desconocida: {stage}")
+
+        settings = LLM_STAGES[stage] if stage else {
+            "provider": LLM_PROVIDER,
+            "model": "",
+            "api_bases": LLM_API_BASES,
+            "timeout": HTTP_TIMEOUT,
+            "max_concurrency": 0,
+        }
+        self.stage = stage or "default"
+        self.provider = settings["provider"]
+        self.model = settings["model"] or DEFAULT_MODELS.get(self.provider, "")
+        self.timeout = settings["timeout"]
+        self.limiter = ConcurrencyLimiter(settings["max_concurrency"])
+
+        # Pool de servidores locales de esta etapa
+        if self.provider == "local":
+            self.endpoints = get_llm_endpoints(settings["api_bases"])
+
         # OpenAI client
-        if LLM_PROVIDER == "openai" and OpenAI:            
+        if self.provider == "openai" and OpenAI:
 
             self.openai_client = OpenAI(api_key=OPENAI_API_KEY)
-            self.openai_model = "gpt-5-mini"
+            self.openai_model = self.model
+            self.openai_embedding_model = "text-embedding-3-small"
+
+        # El cliente async de OpenAI se crea en el primer uso, dentro del event loop
+        self._async_openai_client = None
+
+        self.cache_stats = PROMPT_CACHE_STATS
 
         # Gemini client
-        if LLM_PROVIDER == "gemini":
+        if self.provider == "gemini":
             self.gemini_client = genai.Client(api_key=GEMINI_API_KEY)
-            self.gemini_model = "gemini-2.5-flash" 
+            self.gemini_model = self.model
+            self.gemini_embedding_model = "gemini-embedding-001"
+            # Contextos cacheados: hash del system prompt -> (nombre, expira)
+            self._gemini_caches: Dict[str, Tuple[str, float]] = {}
+            self._gemini_cache_uses: Counter = Counter()
+            self._gemini_cache_failed = set()
+
+    def stage_info(self) -> Dict[str, Any]:
+        """
+        Configuración y uso de la etapa (para /agent/stats).
+        """
+        return {
+            "provider": self.provider,
+            "model": self.model,
+            "timeout": self.timeout,
+            **self.limiter.snapshot(),
+        }
 
     # ---------------------------
     # INTERFAZ PRINCIPAL
     # ---------------------------
-    def chat(self, messages: List[Dict[str, str]]) -> str:
+    def chat(self, messages: List[Dict[str, str]], schema: Optional[Dict[str, Any]] = None) -> str:
         """
-        Devuelve texto plano generado por el LLM.
+        Devuelve texto plano generado por el LLM. Con `schema` (JSON Schema)
+        se pide salida estructurada al proveedor.
         """
-        if LLM_PROVIDER == "local":
-            return self._lmstudio(messages)
+        with self._instrumented(messages) as (attrs, output), self._slot() as waited:
+            attrs["queue_ms"] = round(waited * 1000, 2)
+            if self.provider == "local":
+                text = self._lmstudio(messages, schema)
 
-        elif LLM_PROVIDER == "openai":
-            return self._openai(messages)
+            elif self.provider == "openai":
+                text = self._openai(messages, schema)
 
-        elif LLM_PROVIDER == "gemini":
-            return self._gemini(messages)
+            elif self.provider == "gemini":
+                text = self._gemini(messages, schema)
 
-        else:
-            raise ValueError(f"Proveedor LLM desconocido: {LLM_PROVIDER}")
+            else:
+                raise ValueError(f"Proveedor LLM desconocido: {self.provider}")
+
+            output.append(text)
+            return text
+
+    def chat_stream(self, messages: List[Dict[str, str]], schema: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """
+        Igual que chat(), pero va devolviendo los fragmentos de texto
+        (tokens) conforme el proveedor los genera. El lugar en el límite de
+        concurrencia se ocupa hasta que el stream termina o se cierra.
+        """
+        with self._instrumented(messages) as (attrs, output), self._slot() as waited:
+            attrs["queue_ms"] = round(waited * 1000, 2)
+            if self.provider == "local":
+                stream = self._lmstudio_stream(messages, schema)
+
+            elif self.provider == "openai":
+                stream = self._openai_stream(messages, schema)
+
+            elif self.provider == "gemini":
+                stream = self._gemini_stream(messages, schema)
+
+            else:
+                raise ValueError(f"Proveedor LLM desconocido: {self.provider}")
+
+            started = time.perf_counter()
+            first = True
+            try:
+                for piece in stream:
+                    if first:
+                        first = False
+                        self._first_token(attrs, started)
+                    output.append(piece)
+                    yield piece
+            finally:
+                stream.close()
+
+    async def achat(self, messages: List[Dict[str, str]], schema: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Versión async de chat().
+        """
+        with self._instrumented(messages) as (attrs, output):
+            async with self._aslot() as waited:
+                attrs["queue_ms"] = round(waited * 1000, 2)
+                if self.provider == "local":
+                    text = await self._almstudio(messages, schema)
+
+                elif self.provider == "openai":
+                    text = await self._aopenai(messages, schema)
+
+                elif self.provider == "gemini":
+                    text = await self._agemini(messages, schema)
+
+                else:
+                    raise ValueError(f"Proveedor LLM desconocido: {self.provider}")
+
+                output.append(text)
+                return text
+
+    async def achat_stream(self, messages: List[Dict[str, str]], schema: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        Versión async de chat_stream().
+        """
+        with self._instrumented(messages) as (attrs, output):
+            async with self._aslot() as waited:
+                attrs["queue_ms"] = round(waited * 1000, 2)
+                if self.provider == "local":
+                    stream = self._almstudio_stream(messages, schema)
+
+                elif self.provider == "openai":
+                    stream = self._aopenai_stream(messages, schema)
+
+                elif self.provider == "gemini":
+                    stream = self._agemini_stream(messages, schema)
+
+                else:
+                    raise ValueError(f"Proveedor LLM desconocido: {self.provider}")
+
+                started = time.perf_counter()
+                first = True
+                try:
+                    async for piece in stream:
+                        if first:
+                            first = False
+                            self._first_token(attrs, started)
+                        output.append(piece)
+                        yield piece
+                finally:
+                    await stream.aclose()
 
     # ---------------------------
-    # PETICIÓN JSON UNIVERSAL
+    # INSTRUMENTACIÓN
     # ---------------------------
-    def chat_json(self, messages):
+
+    @contextmanager
+    def _instrumented(self, messages: List[Dict[str, str]]) -> Iterator[Tuple[Dict[str, Any], List[str]]]:
         """
-        Envía un prompt para recibir un JSON válido.
-        Si el modelo responde texto mixto, limpiamos y extraemos el JSON.
+        Span "llm_<etapa>" de la llamada (incluye la espera de turno, que
+        queda en queue_ms), conteo de errores por proveedor y grabación
+        de la llamada si la petición se está grabando (traffic_recorder.py).
+        Devuelve (atributos del span, lista donde se agrega la salida).
+        """
+        started = time.perf_counter()
+        output: List[str] = []
+        status = "cancelled"
+        with span(f"llm_{self.stage}", provider=self.provider, model=self.model) as attrs:
+            try:
+                yield attrs, output
+                status = "ok"
+            except Exception as e:
+                status = "error"
+                LLM_ERRORS.inc(stage=self.stage, provider=self.provider, error=type(e).__name__)
+                raise
+            finally:
+                record_llm_call(self.stage, messages, "".join(output), started, attrs, status)
+
+    @contextmanager
+    def _slot(self) -> Iterator[float]:
         """
+        Lugar en el límite de la etapa y en el del LLM en total
+        (LLM_MAX_CONCURRENCY). Devuelve la espera sumada de ambos.
+        """
+        with self.limiter.slot() as stage_wait, upstream_limiter("llm").slot() as llm_wait:
+            yield stage_wait + llm_wait
+
+    @asynccontextmanager
+    async def _aslot(self) -> AsyncIterator[float]:
+        async with self.limiter.aslot() as stage_wait, upstream_limiter("llm").aslot() as llm_wait:
+            yield stage_wait + llm_wait
+
+    def _first_token(self, attrs: Dict[str, Any], started: float) -> None:
+        elapsed = time.perf_counter() - started
+        LLM_FIRST_TOKEN_SECONDS.observe(elapsed, stage=self.stage)
+        attrs["first_token_ms"] = round(elapsed * 1000, 2)
+
+    # ---------------------------
+    # EMBEDDINGS
+    # ---------------------------
+    def embed(self, text: str) -> List[float]:
+        """
+        Devuelve el vector de embedding del texto.
+        """
+        if self.provider == "local":
+            return self.endpoints.call(lambda base: self._lmstudio_embed(base, text))
 
-        # Añadir instrucción estricta
-        json_instruction = {
-            "role": "system",
-            "content": (
-                "Responde únicamente con un JSON válido. No incluyas explicación, "
-                "texto adicional, ni comentarios. Solo devuelve un objeto JSON."
+        elif self.provider == "openai":
+            response = self.openai_client.embeddings.create(
+                model=self.openai_embedding_model, input=text
             )
-        }
+            return response.data[0].embedding
+
+        elif self.provider == "gemini":
+            response = self.gemini_client.models.embed_content(
+                model=self.gemini_embedding_model, contents=text
+            )
+            return response.embeddings[0].values
+
+        else:
+            raise ValueError(f"Proveedor LLM desconocido: {self.provider}")
+
+    async def aembed(self, text: str) -> List[float]:
+        """
+        Versión async de embed().
+        """
+        if self.provider == "local":
+            return await self.endpoints.acall(lambda base: self._almstudio_embed(base, text))
+
+        elif self.provider == "openai":
+            response = await self._get_async_openai().embeddings.create(
+                model=self.openai_embedding_model, input=text
+            )
+            return response.data[0].embedding
 
-        full_messages = [json_instruction] + messages
+        elif self.provider == "gemini":
+            response = await self.gemini_client.aio.models.embed_content(
+                model=self.gemini_embedding_model, contents=text
+            )
+            return response.embeddings[0].values
+
+        else:
+            raise ValueError(f"Proveedor LLM desconocido: {self.provider}")
 
-        raw_output = self.chat(full_messages)
+    # ---------------------------
+    # PETICIÓN JSON UNIVERSAL
+    # ---------------------------
+    def chat_json(self, messages, schema: Optional[Dict[str, Any]] = None):
+        """
+        Envía un prompt para recibir un JSON válido.
+        Con `schema` el proveedor restringe la salida a ese esquema; si aun
+        así el modelo responde texto mixto, limpiamos y extraemos el JSON.
+        """
+        raw_output = self.chat(self._json_messages(messages), schema)
 
         # Intentar extraer JSON
         cleaned = self._extract_json(raw_output)
 
         return cleaned
 
+    async def achat_json(self, messages, schema: Optional[Dict[str, Any]] = None):
+        """
+        Versión async de chat_json().
+        """
+        raw_output = await self.achat(self._json_messages(messages), schema)
+
+        return self._extract_json(raw_output)
+
+    def chat_json_stream(self, messages, schema: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """
+        Como chat_json(), pero devuelve el texto crudo en fragmentos para
+        parsearlo de forma incremental (ver json_stream.py). Al terminar,
+        usar parse_json() con el texto completo.
+        """
+        return self.chat_stream(self._json_messages(messages), schema)
+
+    def achat_json_stream(self, messages, schema: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        Versión async de chat_json_stream().
+        """
+        return self.achat_stream(self._json_messages(messages), schema)
+
+    def parse_json(self, text: str):
+        """
+        Extrae el JSON de una respuesta completa del modelo.
+        """
+        return self._extract_json(text)
+
+    def _json_messages(self, messages):
+        """
+        Añade la instrucción estricta de responder solo con JSON al final
+        del system prompt, para que el prompt empiece siempre igual y el
+        proveedor pueda reutilizar el prefijo cacheado.
+        """
+        if messages and messages[0]["role"] == "system":
+            system = {
+                "role": "system",
+                "content": f"{messages[0]['content']}\n\n{JSON_INSTRUCTION}",
+            }
+            return [system] + messages[1:]
+
+        return [{"role": "system", "content": JSON_INSTRUCTION}] + messages
+
     # ---------------------------
     # UTILIDAD: EXTRACCIÓN DE JSON
     # ---------------------------
@@ -127,35 +471,321 @@ class LLMClient:
         # 4. Si todo falla → error visible
         raise ValueError(f"El modelo no devolvió JSON válido: {text}")
 
+    # ---------------------------
+    # UTILIDADES POR PROVEEDOR
+    # ---------------------------
+
+    def _lmstudio_payload(
+        self,
+        messages: List[Dict[str, str]],
+        stream: bool = False,
+        schema: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": 0.2,
+        }
+        if LLM_CACHE_PROMPT:
+            # llama.cpp: reutilizar el KV cache del prefijo común
+            payload["cache_prompt"] = True
+        if schema and LLM_STRUCTURED_OUTPUT == "json_schema":
+            payload["response_format"] = lmstudio_response_format(schema)
+        elif schema and LLM_STRUCTURED_OUTPUT == "grammar":
+            payload["grammar"] = json_schema_to_gbnf(schema)
+        if stream:
+            payload["stream"] = True
+            # El último chunk trae el uso de tokens
+            payload["stream_options"] = {"include_usage": True}
+            if LLM_CACHE_PROMPT:
+                # llama.cpp: timings (prompt_n, cache_n) en cada chunk, así
+                # un stream cortado antes del final igual reporta la caché
+                payload["timings_per_token"] = True
+        return payload
+
+    def _lmstudio_delta(self, line: str, usage: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """
+        Extrae el texto incremental de una línea SSE ("data: {...}").
+        Devuelve None si la línea no trae texto. Si se pasa `usage`, ahí se
+        guardan el uso de tokens y los timings que lleguen en el stream.
+        """
+        if not line or not line.startswith("data:"):
+            return None
+
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return None
+
+        chunk = json.loads(data)
+        if usage is not None:
+            for key in ("usage", "timings"):
+                if chunk.get(key):
+                    usage[key] = chunk[key]
+
+        choices = chunk.get("choices") or []
+        if not choices:
+            return None
+
+        return choices[0].get("delta", {}).get("content") or None
+
+    def _openai_input(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        # Mensajes nativos (no texto aplanado): así el system prompt es un
+        # prefijo idéntico entre llamadas y OpenAI lo sirve desde su caché
+        return [{"role": msg["role"], "content": msg["content"]} for msg in messages]
+
+    def _gemini_contents(self, messages: List[Dict[str, str]]):
+        # Convertir messages (role, content) a estructura de Google.
+        # Los mensajes "system" van aparte, en system_instruction.
+        contents = []
+        for msg in messages:
+            if msg["role"] == "system":
+                continue
+            role = "user" if msg["role"] == "user" else "model"
+            contents.append(
+                types.Content(
+                    role=role,
+                    parts=[types.Part.from_text(text=msg["content"])]
+                )
+            )
+        return contents
+
+    def _gemini_system(self, messages: List[Dict[str, str]]) -> str:
+        return "\n\n".join(msg["content"] for msg in messages if msg["role"] == "system")
+
+    def _gemini_config(self, system: str, cache_name: Optional[str], schema: Optional[Dict[str, Any]] = None):
+        """
+        Con contexto cacheado el system prompt ya vive en la caché de Google;
+        si no, se manda como system_instruction. Con `schema` se pide JSON
+        restringido a ese esquema.
+        """
+        # HttpOptions.timeout va en milisegundos
+        options: Dict[str, Any] = {"http_options": types.HttpOptions(timeout=int(self.timeout * 1000))}
+        if cache_name:
+            options["cached_content"] = cache_name
+        elif system:
+            options["system_instruction"] = system
+
+        if schema and LLM_STRUCTURED_OUTPUT != "off":
+            options["response_mime_type"] = "application/json"
+            options["response_schema"] = gemini_response_schema(schema)
+
+        return types.GenerateContentConfig(**options)
+
+    def _gemini_cache_key(self, system: str) -> Optional[str]:
+        """
+        Devuelve la llave del system prompt si vale la pena cachearlo
+        explícitamente: se repite y no falló antes (por ejemplo por ser más
+        corto que el mínimo que acepta Gemini).
+        """
+        if not system or GEMINI_CONTEXT_CACHE_TTL <= 0:
+            return None
+
+        key = hashlib.sha256(system.encode("utf-8")).hexdigest()
+        if key in self._gemini_cache_failed:
+            return None
+
+        if len(self._gemini_cache_uses) > GEMINI_CACHE_MAX_TRACKED:
+            self._gemini_cache_uses.clear()
+        self._gemini_cache_uses[key] += 1
+        if self._gemini_cache_uses[key] < GEMINI_CACHE_MIN_USES:
+            return None
+
+        return key
+
+    def _gemini_cached_name(self, key: str) -> Optional[str]:
+        entry = self._gemini_caches.get(key)
+        # Margen de un minuto para no usar un contexto a punto de expirar
+        if entry and entry[1] > time.time() + 60:
+            return entry[0]
+        return None
+
+    def _gemini_cache_create_config(self, system: str):
+        return types.CreateCachedContentConfig(
+            system_instruction=system,
+            ttl=f"{GEMINI_CONTEXT_CACHE_TTL}s",
+        )
+
+    def _gemini_cache_created(self, key: str, cache) -> str:
+        self._gemini_caches[key] = (cache.name, time.time() + GEMINI_CONTEXT_CACHE_TTL)
+        return cache.name
+
+    def _gemini_cache_failed_for(self, key: str, error: Exception) -> None:
+        # No se reintenta: seguimos con system_instruction y la caché implícita
+        logger.warning("No se pudo crear el contexto cacheado de Gemini: %s", error)
+        self._gemini_cache_failed.add(key)
+
+    def _gemini_cache(self, system: str) -> Optional[str]:
+        key = self._gemini_cache_key(system)
+        if key is None:
+            return None
+
+        name = self._gemini_cached_name(key)
+        if name is None:
+            try:
+                cache = self.gemini_client.caches.create(
+                    model=self.gemini_model,
+                    config=self._gemini_cache_create_config(system),
+                )
+                name = self._gemini_cache_created(key, cache)
+            except Exception as e:
+                self._gemini_cache_failed_for(key, e)
+        return name
+
+    async def _agemini_cache(self, system: str) -> Optional[str]:
+        key = self._gemini_cache_key(system)
+        if key is None:
+            return None
+
+        name = self._gemini_cached_name(key)
+        if name is None:
+            try:
+                cache = await self.gemini_client.aio.caches.create(
+                    model=self.gemini_model,
+                    config=self._gemini_cache_create_config(system),
+                )
+                name = self._gemini_cache_created(key, cache)
+            except Exception as e:
+                self._gemini_cache_failed_for(key, e)
+        return name
+
+    # ---------------------------
+    # USO DE TOKENS
+    # ---------------------------
+
+    def _record_usage(self, prompt_tokens: Optional[int], completion_tokens: Optional[int], cached_tokens: Optional[int]) -> None:
+        self.cache_stats.record(prompt_tokens, cached_tokens)
+        record_llm_usage(self.stage, prompt_tokens, completion_tokens, cached_tokens)
+
+    def _record_lmstudio_usage(self, data: Dict[str, Any]) -> None:
+        usage = data.get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+
+        # llama.cpp: timings.cache_n = tokens del prefijo reutilizados del KV cache,
+        # timings.prompt_n = tokens que sí tuvo que procesar
+        timings = data.get("timings") or {}
+        if cached_tokens is None and "cache_n" in timings:
+            cached_tokens = timings["cache_n"]
+            if prompt_tokens is None:
+                prompt_tokens = timings.get("prompt_n", 0) + cached_tokens
+        if completion_tokens is None:
+            completion_tokens = timings.get("predicted_n")
+
+        self._record_usage(prompt_tokens, completion_tokens, cached_tokens)
+
+    def _record_openai_usage(self, usage) -> None:
+        if usage is None:
+            return
+        details = getattr(usage, "input_tokens_details", None)
+        self._record_usage(usage.input_tokens, usage.output_tokens, getattr(details, "cached_tokens", 0))
+
+    def _record_gemini_usage(self, metadata) -> None:
+        if metadata is None:
+            return
+        self._record_usage(
+            metadata.prompt_token_count,
+            metadata.candidates_token_count,
+            metadata.cached_content_token_count,
+        )
+
+    # Streams cortados antes de terminar (el router se cierra en cuanto la
+    # decisión está completa, o pierde un hedge): el uso se registra con lo
+    # que haya llegado y, si el proveedor no mandó nada, se estima.
+
+    def _record_stream_usage(self, messages: List[Dict[str, str]], output: List[str], usage: Dict[str, Any]) -> None:
+        # llama.cpp/OpenAI-like mandan usage y timings en el último fragmento
+        if usage:
+            self._record_lmstudio_usage(usage)
+        else:
+            self._record_cut_usage(messages, output)
+
+    def _record_gemini_stream_usage(self, messages: List[Dict[str, str]], output: List[str], metadata) -> None:
+        # Gemini manda usage_metadata en cada fragmento: el prompt y la
+        # caché ya se conocen aunque el stream se corte
+        if metadata is not None and metadata.prompt_token_count:
+            self._record_usage(
+                metadata.prompt_token_count,
+                metadata.candidates_token_count or estimate_tokens("".join(output)),
+                metadata.cached_content_token_count,
+            )
+        else:
+            self._record_cut_usage(messages, output)
+
+    def _record_cut_usage(self, messages: List[Dict[str, str]], output: List[str]) -> None:
+        """
+        Sin datos del proveedor: prompt y completion se estiman (~4
+        caracteres por token) y se registran aparte, sin contar para la
+        tasa de aciertos de la caché de prefijos (no se sabe cuánto se
+        sirvió desde ahí).
+        """
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in messages)
+        completion_tokens = estimate_tokens("".join(output)) if output else 0
+        record_llm_usage(self.stage, prompt_tokens, completion_tokens, None, estimated=True)
+
+    def _openai_options(self, schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if schema and LLM_STRUCTURED_OUTPUT != "off":
+            return {"text": openai_text_format(schema)}
+        return {}
+
+    def _get_async_openai(self):
+        if not OPENAI_API_KEY:
+            raise ValueError("OPENAI_API_KEY no está configurado")
+
+        if self._async_openai_client is None:
+            self._async_openai_client = AsyncOpenAI(
+                api_key=OPENAI_API_KEY,
+                http_client=get_async_http_client(),
+            )
+        return self._async_openai_client
+
     # ---------------------------
     # IMPLEMENTACIONES
     # ---------------------------
 
-    def _lmstudio(self, messages: List[Dict[str, str]]) -> str:
+    def _lmstudio(self, messages: List[Dict[str, str]], schema: Optional[Dict[str, Any]] = None) -> str:
         """
         Para LM Studio / Ollama / llama.cpp / servidores OpenAI-like.
+        La petición va al servidor menos ocupado de LLM_API_BASES.
         """
-        url = f"{LLM_API_BASE}/chat/completions"
+        payload = self._lmstudio_payload(messages, schema=schema)
+        #print(f"Payload: {payload}")
+        data = self.endpoints.call(lambda base: self._lmstudio_post(base, payload))
 
-        print(f"URL API LOCAL: {url}")
+        self._record_lmstudio_usage(data)
+        return data["choices"][0]["message"]["content"]
 
-        payload = {
-            "model": LLM_MODEL,
-            "messages": messages,
-            "temperature": 0.2,
-        }
-        #print(f"Payload: {payload}")
-        response = requests.post(url, json=payload, timeout=60)
+    def _lmstudio_post(self, base: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        url = f"{base}/chat/completions"
+
+        logger.debug("URL API LOCAL: %s", url)
+
+        response = get_http_session().post(url, json=payload, timeout=self.timeout)
         #print(f"Response: {response}")
         if not response.ok:
-            raise RuntimeError(
-                f"Error LLM local: {response.status_code} -> {response.text}"
-            )
+            raise self._lmstudio_error("LLM", response.status_code, response.text)
 
-        data = response.json()
-        return data["choices"][0]["message"]["content"]
+        return response.json()
 
-    def _openai(self, messages):
+    def _lmstudio_embed(self, base: str, text: str) -> List[float]:
+        response = get_http_session().post(
+            f"{base}/embeddings",
+            json={"model": LLM_EMBEDDING_MODEL, "input": text},
+            timeout=self.timeout,
+        )
+        if not response.ok:
+            raise self._lmstudio_error("embeddings", response.status_code, response.text)
+        return response.json()["data"][0]["embedding"]
+
+    def _lmstudio_error(self, what: str, status_code: int, body: str) -> RuntimeError:
+        """
+        Los errores del servidor (5xx) o de saturación (429) permiten probar
+        otro servidor del pool; los demás (4xx) son errores de la petición.
+        """
+        error_class = LLMEndpointError if status_code >= 500 or status_code == 429 else RuntimeError
+        return error_class(f"Error {what} local: {status_code} -> {body}")
+
+    def _openai(self, messages, schema: Optional[Dict[str, Any]] = None):
         """
         Cliente actualizado para la API Responses de OpenAI (2025+)
         """
@@ -163,41 +793,231 @@ class LLMClient:
         if not OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY no está configurado")
 
-        # Convertimos los mensajes tipo ChatGPT a texto lineal, como lo requiere Responses
-        input_text = ""
-        for msg in messages:
-            role = msg["role"]
-            content = msg["content"]
-            input_text += f"{role.upper()}: {content}\n"
-
         # Llamada al endpoint moderno
         response = self.openai_client.responses.create(
-            model=self.openai_model,  
-            input=input_text,
+            model=self.openai_model,
+            input=self._openai_input(messages),
+            **self._openai_options(schema),
+            timeout=self.timeout,
         )
 
+        self._record_openai_usage(response.usage)
         return response.output_text
 
-    def _gemini(self, messages):
+    def _gemini(self, messages, schema: Optional[Dict[str, Any]] = None):
         """
         Implementación que convierte mensajes estilo OpenAI
         a contenido compatible con Google GenAI (nuevo SDK).
         """
 
-        # Convertir messages (role, content) a estructura de Google
-        contents = []
-        for msg in messages:
-            role = "user" if msg["role"] == "user" else "model"
-            contents.append(
-                types.Content(
-                    role=role,
-                    parts=[types.Part.from_text(text=msg["content"])]
-                )
-            )
-
+        system = self._gemini_system(messages)
         response = self.gemini_client.models.generate_content(
             model=self.gemini_model,
-            contents=contents,
+            contents=self._gemini_contents(messages),
+            config=self._gemini_config(system, self._gemini_cache(system), schema),
+        )
+
+        self._record_gemini_usage(response.usage_metadata)
+        return response.text
+
+    # ---------------------------
+    # IMPLEMENTACIONES EN STREAMING
+    # ---------------------------
+
+    def _lmstudio_stream(self, messages: List[Dict[str, str]], schema: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """
+        Streaming para servidores OpenAI-like: la respuesta llega como
+        Server-Sent Events ("data: {...}") terminando con "data: [DONE]".
+        """
+        payload = self._lmstudio_payload(messages, stream=True, schema=schema)
+
+        return self.endpoints.stream(lambda base: self._lmstudio_stream_from(base, payload))
+
+    def _lmstudio_stream_from(self, base: str, payload: Dict[str, Any]) -> Iterator[str]:
+        url = f"{base}/chat/completions"
+
+        with get_http_session().post(url, json=payload, timeout=self.timeout, stream=True) as response:
+            if not response.ok:
+                raise self._lmstudio_error("LLM", response.status_code, response.text)
+
+            usage, output = {}, []
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    delta = self._lmstudio_delta(line, usage)
+                    if delta:
+                        output.append(delta)
+                        yield delta
+            finally:
+                self._record_stream_usage(payload["messages"], output, usage)
+
+    def _openai_stream(self, messages, schema: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """
+        Streaming con la API Responses: nos quedamos solo con los
+        eventos de texto incremental.
+        """
+
+        if not OPENAI_API_KEY:
+            raise ValueError("OPENAI_API_KEY no está configurado")
+
+        stream = self.openai_client.responses.create(
+            model=self.openai_model,
+            input=self._openai_input(messages),
+            **self._openai_options(schema),
+            timeout=self.timeout,
+            stream=True,
+        )
+
+        # Cerrar el stream al salir corta la generación aunque se deje a medias
+        output, completed = [], False
+        with stream:
+            try:
+                for event in stream:
+                    if event.type == "response.output_text.delta" and event.delta:
+                        output.append(event.delta)
+                        yield event.delta
+                    elif event.type == "response.completed":
+                        completed = True
+                        self._record_openai_usage(event.response.usage)
+            finally:
+                if not completed:
+                    self._record_cut_usage(messages, output)
+
+    def _gemini_stream(self, messages, schema: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """
+        Streaming con el SDK de Google GenAI.
+        """
+
+        system = self._gemini_system(messages)
+        stream = self.gemini_client.models.generate_content_stream(
+            model=self.gemini_model,
+            contents=self._gemini_contents(messages),
+            config=self._gemini_config(system, self._gemini_cache(system), schema),
+        )
+
+        usage_metadata, output = None, []
+        try:
+            for chunk in stream:
+                usage_metadata = chunk.usage_metadata or usage_metadata
+                if chunk.text:
+                    output.append(chunk.text)
+                    yield chunk.text
+        finally:
+            self._record_gemini_stream_usage(messages, output, usage_metadata)
+            # Si se corta a medias, cerrar el stream corta la generación
+            stream.close()
+
+    # ---------------------------
+    # IMPLEMENTACIONES ASYNC
+    # ---------------------------
+
+    async def _almstudio(self, messages: List[Dict[str, str]], schema: Optional[Dict[str, Any]] = None) -> str:
+        payload = self._lmstudio_payload(messages, schema=schema)
+        data = await self.endpoints.acall(lambda base: self._almstudio_post(base, payload))
+
+        self._record_lmstudio_usage(data)
+        return data["choices"][0]["message"]["content"]
+
+    async def _almstudio_post(self, base: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = await get_async_http_client().post(
+            f"{base}/chat/completions", json=payload, timeout=self.timeout
+        )
+        if response.is_error:
+            raise self._lmstudio_error("LLM", response.status_code, response.text)
+
+        return response.json()
+
+    async def _almstudio_embed(self, base: str, text: str) -> List[float]:
+        response = await get_async_http_client().post(
+            f"{base}/embeddings", json={"model": LLM_EMBEDDING_MODEL, "input": text}, timeout=self.timeout
+        )
+        if response.is_error:
+            raise self._lmstudio_error("embeddings", response.status_code, response.text)
+        return response.json()["data"][0]["embedding"]
+
+    async def _aopenai(self, messages, schema: Optional[Dict[str, Any]] = None) -> str:
+        response = await self._get_async_openai().responses.create(
+            model=self.openai_model,
+            input=self._openai_input(messages),
+            **self._openai_options(schema),
+            timeout=self.timeout,
+        )
+
+        self._record_openai_usage(response.usage)
+        return response.output_text
+
+    async def _agemini(self, messages, schema: Optional[Dict[str, Any]] = None) -> str:
+        system = self._gemini_system(messages)
+        response = await self.gemini_client.aio.models.generate_content(
+            model=self.gemini_model,
+            contents=self._gemini_contents(messages),
+            config=self._gemini_config(system, await self._agemini_cache(system), schema),
         )
 
+        self._record_gemini_usage(response.usage_metadata)
         return response.text
+
+    def _almstudio_stream(self, messages: List[Dict[str, str]], schema: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        payload = self._lmstudio_payload(messages, stream=True, schema=schema)
+
+        return self.endpoints.astream(lambda base: self._almstudio_stream_from(base, payload))
+
+    async def _almstudio_stream_from(self, base: str, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        url = f"{base}/chat/completions"
+
+        async with get_async_http_client().stream("POST", url, json=payload, timeout=self.timeout) as response:
+            if response.is_error:
+                body = await response.aread()
+                raise self._lmstudio_error("LLM", response.status_code, body.decode(errors="replace"))
+
+            usage, output = {}, []
+            try:
+                async for line in response.aiter_lines():
+                    delta = self._lmstudio_delta(line, usage)
+                    if delta:
+                        output.append(delta)
+                        yield delta
+            finally:
+                self._record_stream_usage(payload["messages"], output, usage)
+
+    async def _aopenai_stream(self, messages, schema: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        stream = await self._get_async_openai().responses.create(
+            model=self.openai_model,
+            input=self._openai_input(messages),
+            **self._openai_options(schema),
+            timeout=self.timeout,
+            stream=True,
+        )
+
+        # Cerrar el stream al salir libera la conexión aunque se cancele a medias
+        output, completed = [], False
+        async with stream:
+            try:
+                async for event in stream:
+                    if event.type == "response.output_text.delta" and event.delta:
+                        output.append(event.delta)
+                        yield event.delta
+                    elif event.type == "response.completed":
+                        completed = True
+                        self._record_openai_usage(event.response.usage)
+            finally:
+                if not completed:
+                    self._record_cut_usage(messages, output)
+
+    async def _agemini_stream(self, messages, schema: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        system = self._gemini_system(messages)
+        stream = await self.gemini_client.aio.models.generate_content_stream(
+            model=self.gemini_model,
+            contents=self._gemini_contents(messages),
+            config=self._gemini_config(system, await self._agemini_cache(system), schema),
+        )
+
+        usage_metadata, output = None, []
+        try:
+            async for chunk in stream:
+                usage_metadata = chunk.usage_metadata or usage_metadata
+                if chunk.text:
+                    output.append(chunk.text)
+                    yield chunk.text
+        finally:
+            self._record_gemini_stream_usage(messages, output, usage_metadata)
+            await stream.aclose()
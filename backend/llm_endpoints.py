@@ -0,0 +1,503 @@
+# backend/llm_endpoints.py
+"""
+Pool de servidores LLM locales (OpenAI-like) para repartir la carga entre
+varias máquinas:
+- balanceo: cada petición va al servidor con menos peticiones en curso
+- failover: si un servidor no responde (conexión, timeout, 5xx) se prueba
+  el siguiente, siempre que todavía no se haya mandado nada al usuario
+- circuit breaker: tras LLM_CIRCUIT_FAILURES fallos seguidos, el servidor
+  sale de la rotación durante LLM_CIRCUIT_COOLDOWN segundos; después queda
+  "half_open": recibe una sola petición de prueba y solo vuelve del todo
+  si esa petición sale bien (si falla, el circuito se abre otra vez)
+- health checks: en segundo plano se consulta /models de cada servidor; un
+  servidor caído sale de la rotación y uno con el circuito abierto que
+  responde pasa a half_open (/models no prueba que la generación funcione)
+- hedging (solo async): si la respuesta tarda más que el p95 reciente, se
+  manda un duplicado a otro servidor y se usa el que responda primero
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+import requests
+
+from .config import (
+    LLM_API_BASES,
+    LLM_CIRCUIT_FAILURES,
+    LLM_CIRCUIT_COOLDOWN,
+    LLM_HEALTH_CHECK_INTERVAL,
+    LLM_HEALTH_CHECK_TIMEOUT,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_MIN_DELAY,
+)
+from .http_client import get_async_http_client
+from .metrics import LLM_ENDPOINT_FAILURES
+
+logger = logging.getLogger(__name__)
+
+# Latencias recientes usadas para el p95 del hedging
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+
+
+class LLMEndpointError(RuntimeError):
+    """
+    El servidor respondió con un error propio (5xx): vale la pena
+    intentar con otro servidor.
+    """
+
+
+# Errores del servidor (no de la petición): se cuentan para el circuit
+# breaker y permiten failover
+RETRYABLE_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    httpx.TransportError,
+    LLMEndpointError,
+)
+
+
+class LLMEndpoint:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0          # fallos consecutivos
+        self.open_until = 0.0      # circuito abierto hasta (time.monotonic)
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now: float) -> bool:
+        return now >= self.open_until
+
+    def state(self, now: float) -> str:
+        if not self.available(now):
+            return "open"
+        return "half_open" if self.failures >= LLM_CIRCUIT_FAILURES else "closed"
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "available": self.available(now),
+            "state": self.state(now),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "consecutive_failures": self.failures,
+        }
+
+
+class LLMEndpointPool:
+    def __init__(self, urls: List[str]):
+        if not urls:
+            raise ValueError("Se necesita al menos un servidor LLM (LLM_API_BASES)")
+
+        self.endpoints = [LLMEndpoint(url) for url in urls]
+        self._lock = threading.Lock()
+        # "full": respuesta completa; "first_token": primer fragmento de un stream
+        self._latencies = {
+            "full": deque(maxlen=LATENCY_WINDOW),
+            "first_token": deque(maxlen=LATENCY_WINDOW),
+        }
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    # ---------------------------
+    # SELECCIÓN Y CONTABILIDAD
+    # ---------------------------
+
+    def _acquire(self, tried: List[LLMEndpoint]) -> Optional[LLMEndpoint]:
+        """
+        Elige el servidor con menos peticiones en curso entre los que no se
+        han probado. Un servidor half_open recibe una sola petición de prueba
+        a la vez. Si todos tienen el circuito abierto, se prueba el que se
+        reabre antes, en lugar de fallar sin intentar.
+        """
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in tried]
+            if not candidates:
+                return None
+
+            now = time.monotonic()
+            usable = [
+                e for e in candidates
+                if e.available(now) and not (e.state(now) == "half_open" and e.outstanding)
+            ]
+            if not usable:
+                usable = [min(candidates, key=lambda e: e.open_until)]
+
+            endpoint = min(usable, key=lambda e: (e.outstanding, random.random()))
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            tried.append(endpoint)
+            return endpoint
+
+    def _release(self, endpoint: LLMEndpoint, ok: Optional[bool]) -> None:
+        """
+        ok=True: éxito, ok=False: fallo del servidor, None: cancelada.
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if ok:
+                endpoint.failures = 0
+                endpoint.open_until = 0.0
+            elif ok is False:
+                self._mark_failure(endpoint)
+
+    def _mark_failure(self, endpoint: LLMEndpoint) -> None:
+        LLM_ENDPOINT_FAILURES.inc(endpoint=endpoint.url)
+        endpoint.failures += 1
+        endpoint.errors += 1
+        if endpoint.failures >= LLM_CIRCUIT_FAILURES:
+            endpoint.open_until = time.monotonic() + LLM_CIRCUIT_COOLDOWN
+            logger.warning("Servidor LLM fuera de rotación por %s s: %s", LLM_CIRCUIT_COOLDOWN, endpoint.url)
+
+    def _observe(self, kind: str, started: float) -> None:
+        with self._lock:
+            self._latencies[kind].append(time.perf_counter() - started)
+
+    def _p95(self, kind: str) -> Optional[float]:
+        # Llamar con self._lock tomado
+        samples = sorted(self._latencies[kind])
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[int(len(samples) * 0.95) - 1]
+
+    def hedge_delay(self, kind: str) -> Optional[float]:
+        """
+        Cuánto esperar antes de mandar un duplicado: el p95 de las
+        latencias recientes. None si no hay hedging o no hay datos.
+        """
+        if not LLM_HEDGE_ENABLED or len(self.endpoints) < 2:
+            return None
+
+        with self._lock:
+            p95 = self._p95(kind)
+        return None if p95 is None else max(LLM_HEDGE_MIN_DELAY, p95)
+
+    def _unavailable(self, error: Optional[BaseException]) -> RuntimeError:
+        return RuntimeError(f"Ningún servidor LLM respondió. Último error: {error}")
+
+    # ---------------------------
+    # PETICIONES SÍNCRONAS
+    # ---------------------------
+
+    def call(self, fn: Callable[[str], Any]) -> Any:
+        """
+        Ejecuta `fn(url_base)` con failover entre servidores.
+        """
+        tried: List[LLMEndpoint] = []
+        last_error = None
+
+        while (endpoint := self._acquire(tried)) is not None:
+            started = time.perf_counter()
+            ok = None
+            try:
+                result = fn(endpoint.url)
+                ok = True
+                self._observe("full", started)
+                return result
+            except RETRYABLE_ERRORS as e:
+                ok = False
+                last_error = e
+                logger.warning("Falló el servidor LLM %s: %s", endpoint.url, e)
+            finally:
+                self._release(endpoint, ok)
+
+        raise self._unavailable(last_error)
+
+    def stream(self, fn: Callable[[str], Iterator[str]]) -> Iterator[str]:
+        """
+        Como call(), para streams: solo hay failover si el servidor falla
+        antes de mandar el primer fragmento.
+        """
+        tried: List[LLMEndpoint] = []
+        last_error = None
+
+        while (endpoint := self._acquire(tried)) is not None:
+            started = time.perf_counter()
+            ok = None
+            sent = False
+            pieces = fn(endpoint.url)
+            try:
+                for piece in pieces:
+                    if not sent:
+                        sent = True
+                        self._observe("first_token", started)
+                    yield piece
+                ok = True
+                return
+            except RETRYABLE_ERRORS as e:
+                ok = False
+                if sent:
+                    raise
+                last_error = e
+                logger.warning("Falló el servidor LLM %s: %s", endpoint.url, e)
+            finally:
+                pieces.close()
+                self._release(endpoint, ok)
+
+        raise self._unavailable(last_error)
+
+    # ---------------------------
+    # PETICIONES ASYNC (CON HEDGING)
+    # ---------------------------
+
+    async def acall(self, fn: Callable[[str], Awaitable[Any]]) -> Any:
+        """
+        Versión async de call(). Con hedging, si la primera petición tarda
+        más que el p95 se lanza otra en un segundo servidor; la que termine
+        primero gana y la otra se cancela.
+        """
+        tried: List[LLMEndpoint] = []
+        tasks: Dict[asyncio.Task, LLMEndpoint] = {}
+        last_error = None
+        hedged = False
+
+        async def attempt(endpoint: LLMEndpoint) -> Any:
+            started = time.perf_counter()
+            ok = None
+            try:
+                result = await fn(endpoint.url)
+                ok = True
+                self._observe("full", started)
+                return result
+            except RETRYABLE_ERRORS:
+                ok = False
+                raise
+            finally:
+                self._release(endpoint, ok)
+
+        def launch() -> bool:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                return False
+            tasks[asyncio.create_task(attempt(endpoint))] = endpoint
+            return True
+
+        launch()
+        try:
+            while tasks:
+                delay = None if hedged else self.hedge_delay("full")
+                done, _ = await asyncio.wait(tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # La primera petición ya tardó más que el p95: duplicado
+                    hedged = True
+                    if launch():
+                        self.hedges += 1
+                    continue
+
+                for task in done:
+                    endpoint = tasks.pop(task)
+                    try:
+                        result = task.result()
+                    except RETRYABLE_ERRORS as e:
+                        last_error = e
+                        logger.warning("Falló el servidor LLM %s: %s", endpoint.url, e)
+                        continue
+                    if hedged and endpoint is not tried[0]:
+                        self.hedge_wins += 1
+                    return result
+
+                if not tasks:
+                    launch()
+
+            raise self._unavailable(last_error)
+        finally:
+            # Se espera a las canceladas para que liberen su servidor
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.wait(tasks)
+
+    async def astream(self, fn: Callable[[str], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Versión async de stream(). El hedging compite por el primer
+        fragmento: el stream que lo entregue primero sigue y los demás se
+        cierran.
+        """
+        tried: List[LLMEndpoint] = []
+        # tarea del primer fragmento -> (servidor, stream, inicio)
+        pending: Dict[asyncio.Task, tuple] = {}
+        last_error = None
+        hedged = False
+        winner = None
+
+        def launch() -> bool:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                return False
+            stream = fn(endpoint.url)
+            task = asyncio.create_task(stream.__anext__())
+            pending[task] = (endpoint, stream, time.perf_counter())
+            return True
+
+        async def discard(task: asyncio.Task, ok: Optional[bool]) -> None:
+            endpoint, stream, _ = pending.pop(task)
+            # Hay que esperar a que la tarea suelte el generador antes de cerrarlo
+            task.cancel()
+            await asyncio.wait([task])
+            await stream.aclose()
+            self._release(endpoint, ok)
+
+        launch()
+        try:
+            while pending and winner is None:
+                delay = None if hedged else self.hedge_delay("first_token")
+                done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    hedged = True
+                    if launch():
+                        self.hedges += 1
+                    continue
+
+                for task in done:
+                    endpoint, stream, started = pending[task]
+                    try:
+                        first = task.result()
+                    except StopAsyncIteration:
+                        first = None
+                    except RETRYABLE_ERRORS as e:
+                        last_error = e
+                        logger.warning("Falló el servidor LLM %s: %s", endpoint.url, e)
+                        await discard(task, False)
+                        continue
+
+                    pending.pop(task)
+                    winner = (endpoint, stream, first)
+                    self._observe("first_token", started)
+                    if hedged and endpoint is not tried[0]:
+                        self.hedge_wins += 1
+                    break
+
+                if winner is None and not pending:
+                    launch()
+        finally:
+            for task in list(pending):
+                await discard(task, None)
+
+        if winner is None:
+            raise self._unavailable(last_error)
+
+        endpoint, stream, first = winner
+        ok = None
+        try:
+            if first is not None:
+                yield first
+                async for piece in stream:
+                    yield piece
+            ok = True
+        except RETRYABLE_ERRORS:
+            ok = False
+            raise
+        finally:
+            await stream.aclose()
+            self._release(endpoint, ok)
+
+    # ---------------------------
+    # HEALTH CHECKS
+    # ---------------------------
+
+    async def check_health(self) -> None:
+        """
+        Consulta /models de cada servidor. Uno que no responde sale de la
+        rotación. Uno con el circuito abierto que responde pasa a half_open:
+        /models puede funcionar aunque la generación falle (modelo sin
+        cargar, sin memoria), así que el circuito solo se cierra cuando una
+        petición real sale bien (ver _release).
+        """
+        client = get_async_http_client()
+
+        async def check(endpoint: LLMEndpoint) -> None:
+            try:
+                response = await client.get(f"{endpoint.url}/models", timeout=LLM_HEALTH_CHECK_TIMEOUT)
+                healthy = response.status_code < 500
+            except httpx.HTTPError:
+                healthy = False
+
+            with self._lock:
+                if healthy:
+                    endpoint.open_until = min(endpoint.open_until, time.monotonic())
+                elif endpoint.available(time.monotonic()):
+                    endpoint.failures = max(endpoint.failures, LLM_CIRCUIT_FAILURES - 1)
+                    self._mark_failure(endpoint)
+
+        await asyncio.gather(*(check(e) for e in self.endpoints))
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "endpoints": [e.snapshot(now) for e in self.endpoints],
+                "latency_p95_seconds": {kind: self._p95(kind) for kind in self._latencies},
+                "hedging": LLM_HEDGE_ENABLED,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+            }
+
+
+# Un pool por lista de servidores (cada etapa puede tener la suya)
+_pools: Dict[Tuple[str, ...], LLMEndpointPool] = {}
+_pools_lock = threading.Lock()
+_health_task: Optional[asyncio.Task] = None
+
+
+def get_llm_endpoints(urls: Optional[List[str]] = None) -> LLMEndpointPool:
+    """
+    Devuelve el pool compartido para `urls` (por defecto LLM_API_BASES).
+    """
+    key = tuple(urls or LLM_API_BASES)
+
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = LLMEndpointPool(list(key))
+    return pool
+
+
+def llm_endpoints_snapshot() -> List[Dict[str, Any]]:
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.snapshot() for pool in pools]
+
+
+async def _run_health_checks() -> None:
+    while True:
+        await asyncio.sleep(LLM_HEALTH_CHECK_INTERVAL)
+        with _pools_lock:
+            pools = list(_pools.values())
+        for pool in pools:
+            try:
+                await pool.check_health()
+            except Exception as e:
+                logger.warning("Error en el health check de los servidores LLM: %s", e)
+
+
+def start_health_checks() -> None:
+    """
+    Arranca los health checks en segundo plano (desde el event loop).
+    Revisa los pools que existan en cada ronda.
+    """
+    global _health_task
+
+    if LLM_HEALTH_CHECK_INTERVAL > 0 and _health_task is None:
+        _health_task = asyncio.create_task(_run_health_checks())
+
+
+async def stop_health_checks() -> None:
+    global _health_task
+
+    if _health_task is not None:
+        _health_task.cancel()
+        try:
+            await _health_task
+        except asyncio.CancelledError:
+            pass
+        _health_task = None
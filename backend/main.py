@@ -3,14 +3,57 @@
 API principal del agente usando FastAPI.
 """
 
-from typing import List, Dict, Any, Optional
-from fastapi import FastAPI
+import asyncio
+import csv
+import io
+import json
+import logging
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import List, Dict, Any, Literal, Optional
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool
 
+from .config import (
+    LOG_LEVEL,
+    DEBUG_TRACE_ENABLED,
+    JOBS_MAX_PENDING,
+    JOBS_RESULT_TTL,
+    BATCH_MAX_MESSAGES,
+    BATCH_CONCURRENCY,
+)
 from .router import AgentRouter
+from .http_client import close_http_clients
+from .db_client import close_pool, fetch_page, validate_export_query, iter_select_batches
+from .result_encoding import check_result_format, encode_sql_result
+from .llm_endpoints import llm_endpoints_snapshot, start_health_checks, stop_health_checks
+from .metrics import render_metrics, tracing
+from .traffic_recorder import get_traffic_recorder
+from .admission import LANES, AdmissionRejected, admission, upstream_limiter, upstreams_snapshot
+from .jobs import KEEPALIVE_SECONDS, JobManager
+from .batch import run_batch
+
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+# httpx registra cada petición en INFO: demasiado ruido en el camino caliente
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Health checks de los servidores LLM locales (saca del pool los caídos)
+    start_health_checks()
+    yield
+    await stop_health_checks()
+    # Cerramos los pools compartidos (HTTP y SQLite) al apagar el servidor
+    await close_http_clients()
+    close_pool()
 
-app = FastAPI(title="Agente LLM")
+
+app = FastAPI(title="Agente LLM", lifespan=lifespan)
 
 # CORS para permitir que Streamlit (otro puerto) consuma esta API
 app.add_middleware(
@@ -23,13 +66,40 @@ app.add_middleware(
 
 router = AgentRouter()
 
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    """
+    Agente saturado: 429 con Retry-After para que el cliente reintente
+    más tarde (o mande la pregunta como job).
+    """
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "reason": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+ResultFormat = Literal["rows", "columnar", "arrow"]
+
 class ChatRequest(BaseModel):
     message: str
+    # Codificación de sql_result: "rows" (por defecto), "columnar" o "arrow"
+    result_format: ResultFormat = "rows"
 
 class SQLResult(BaseModel):
+    # Con result_format "columnar"/"arrow" esta forma cambia: ver result_encoding.py
+    encoding: str = "rows"
     columns: list[str] = []
     rows: list[Any] = []
     error: Optional[str] = None
+    # Código estable del error: "unsafe_query", "plan_rejected",
+    # "query_timeout", "step_budget_exceeded" o "execution_error"
+    error_code: Optional[str] = None
+    error_detail: Optional[Dict[str, Any]] = None
+    # Paginación: las filas se limitan a SQL_MAX_ROWS por respuesta
+    truncated: bool = False
+    total_rows: Optional[int] = None
+    next_token: Optional[str] = None
 
 class ChatResponse(BaseModel):
     intent: str
@@ -38,22 +108,78 @@ class ChatResponse(BaseModel):
     sql_result: Optional[SQLResult] = None
     web_query: Optional[str] = None
     web_raw_result: Optional[List[Dict[str, str]]] = None
+    routing: Optional[Dict[str, Any]] = None
+    # Solo en un plan (intent "plan"): una entrada por consulta SQL o
+    # búsqueda web, con "type", "query", "result", "error" y "duration_ms"
+    actions: Optional[List[Dict[str, Any]]] = None
+    cached: bool = False
+    # Solo con la cabecera X-Agent-Debug: tiempos por etapa, tokens y cachés
+    trace: Optional[Dict[str, Any]] = None
 
 
 @app.post("/agent", response_model=ChatResponse)
-def agent_endpoint(req: ChatRequest):
+async def agent_endpoint(
+    req: ChatRequest,
+    x_agent_debug: Optional[str] = Header(default=None),
+    x_agent_priority: Optional[str] = Header(default=None),
+):
     """
     Endpoint principal: recibe un mensaje del usuario
-    y devuelve la respuesta del agente.
+    y devuelve la respuesta del agente. Con el agente saturado responde
+    429 con Retry-After (ver admission.py).
     """
-    
-    result = router.route(req.message)
+    _check_result_format(req.result_format)
+
+    async with admission.admit(_priority_lane(x_agent_priority)):
+        with tracing(_debug_requested(x_agent_debug)) as trace:
+            result = await router.aroute(req.message)
+    if trace is not None:
+        result["trace"] = trace.to_dict()
 
+    if req.result_format != "rows":
+        return _json_response(_chat_payload(result, req.result_format))
+
+    return _chat_response(result, _sql_result_of(result))
+
+
+def _sql_result_of(result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     # Normalizamos el sql_result para ajustarlo al modelo Pydantic
     sql_res = result.get("sql_result")
     if sql_res is not None and not isinstance(sql_res, dict):
         sql_res = None
+    return sql_res
+
 
+def _chat_payload(result: Dict[str, Any], result_format: str) -> Dict[str, Any]:
+    """
+    Cuerpo de la respuesta de /agent como dict serializable.
+    """
+    sql_res = _sql_result_of(result)
+    if result_format == "rows":
+        return _chat_response(result, sql_res).model_dump()
+
+    # Sin validación por celda: el resto de la respuesta sí pasa por
+    # Pydantic y el resultado codificado se agrega ya serializable
+    payload = _chat_response(result, None).model_dump()
+    payload["sql_result"] = encode_sql_result(sql_res, result_format) if sql_res else None
+    payload["actions"] = _encoded_actions(result.get("actions"), result_format)
+    return payload
+
+
+def _encoded_actions(actions: Optional[List[Dict[str, Any]]], result_format: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Acciones de un plan con los resultados SQL en `result_format`.
+    """
+    if actions is None or result_format == "rows":
+        return actions
+    return [
+        {**a, "result": encode_sql_result(a["result"], result_format)}
+        if a["type"] == "sql" and isinstance(a["result"], dict) else a
+        for a in actions
+    ]
+
+
+def _chat_response(result: Dict[str, Any], sql_res: Optional[Dict[str, Any]]) -> ChatResponse:
     return ChatResponse(
         intent=result.get("intent", "llm"),
         reply=result.get("reply", ""),
@@ -61,4 +187,359 @@ def agent_endpoint(req: ChatRequest):
         sql_result=sql_res,
         web_query=result.get("web_query"),
         web_raw_result=result.get("web_raw_result"),
+        routing=result.get("routing"),
+        actions=result.get("actions"),
+        cached=result.get("cached", False),
+        trace=result.get("trace"),
+    )
+
+
+def _debug_requested(header: Optional[str]) -> bool:
+    return DEBUG_TRACE_ENABLED and (header or "").strip().lower() in ("1", "true", "yes")
+
+
+def _priority_lane(header: Optional[str]) -> str:
+    """
+    Carril de la petición según X-Agent-Priority: "high" (por defecto) o "low".
+    """
+    lane = (header or "high").strip().lower()
+    if lane not in LANES:
+        raise HTTPException(status_code=400, detail=f"X-Agent-Priority inválido: {header} (usar high o low)")
+    return lane
+
+
+def _check_result_format(fmt: str) -> None:
+    try:
+        check_result_format(fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _json_response(payload: Dict[str, Any]) -> Response:
+    body = json.dumps(payload, ensure_ascii=False, default=str)
+    return Response(content=body, media_type="application/json")
+
+
+@app.get("/agent/sql/page", response_model=SQLResult)
+async def sql_page_endpoint(token: str, format: ResultFormat = "rows"):
+    """
+    Devuelve la siguiente página de un resultado SQL a partir del
+    `next_token` de una respuesta anterior. No llama al LLM.
+    """
+    _check_result_format(format)
+
+    async with upstream_limiter("sqlite").aslot():
+        page = await asyncio.to_thread(fetch_page, token)
+
+    if format != "rows":
+        return _json_response(encode_sql_result(page, format))
+    return page
+
+
+class ExportRequest(BaseModel):
+    sql_query: str
+    format: Literal["csv", "ndjson"] = "csv"
+
+
+def _export_chunks(sql_query: str, fmt: str):
+    """
+    Convierte cada lote del cursor en un fragmento CSV o NDJSON.
+    Nunca se arma la lista completa de filas. Si el query falla a medias
+    (la respuesta ya salió con 200), la última línea lo dice: en CSV
+    "#ERROR,<código>,<mensaje>" y en NDJSON {"error": ..., "error_code": ...}.
+    """
+    header_written = False
+
+    try:
+        for columns, rows in iter_select_batches(sql_query):
+            buffer = io.StringIO()
+
+            if fmt == "csv":
+                writer = csv.writer(buffer)
+                if not header_written:
+                    writer.writerow(columns)
+                    header_written = True
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str))
+                    buffer.write("\n")
+
+            yield buffer.getvalue()
+    except Exception as e:
+        logger.warning("Exportación interrumpida: %s", e)
+        code = "query_timeout" if isinstance(e, TimeoutError) else "execution_error"
+        buffer = io.StringIO()
+        if fmt == "csv":
+            csv.writer(buffer).writerow(["#ERROR", code, str(e)])
+        else:
+            buffer.write(json.dumps({"error": str(e), "error_code": code}, ensure_ascii=False) + "\n")
+        yield buffer.getvalue()
+
+
+async def _export_stream(sql_query: str, fmt: str):
+    """
+    Ocupa un lugar de exportación (SQL_EXPORT_MAX_CONCURRENCY) mientras
+    dura la descarga; la fila de espera queda en el event loop, sin tomar
+    hilos ni conexiones. Los lotes se leen en el threadpool.
+    """
+    async with upstream_limiter("sql_export").aslot():
+        async for chunk in iterate_in_threadpool(_export_chunks(sql_query, fmt)):
+            yield chunk
+
+
+async def _export_response(sql_query: str, fmt: str):
+    error = await asyncio.to_thread(validate_export_query, sql_query)
+    if error is not None:
+        return JSONResponse(status_code=400, content=SQLResult(**error).model_dump())
+
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    extension = "csv" if fmt == "csv" else "ndjson"
+
+    return StreamingResponse(
+        _export_stream(sql_query, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="resultado.{extension}"'},
     )
+
+
+@app.post("/agent/sql/export")
+async def sql_export_endpoint(req: ExportRequest):
+    """
+    Exporta las filas de un `sql_query` (el que viene en ChatResponse) como
+    CSV o NDJSON en streaming, directo del cursor y sin llamar al LLM.
+    La memoria se mantiene constante sin importar el número de filas.
+    """
+    return await _export_response(req.sql_query, req.format)
+
+
+@app.get("/agent/sql/export")
+async def sql_export_link_endpoint(sql_query: str, format: Literal["csv", "ndjson"] = "csv"):
+    """
+    Misma exportación que el POST, pero con parámetros en la URL para
+    poder usarla como link de descarga.
+    """
+    return await _export_response(sql_query, format)
+
+
+@app.get("/agent/stats")
+def agent_stats_endpoint():
+    """
+    Contadores internos del agente (aciertos/fallos de caché, etc.).
+    """
+    return {
+        "response_cache": router.cache.stats() if router.cache else None,
+        "router": router.stats.snapshot(),
+        "llm_prompt_cache": router.llm.cache_stats.snapshot(),
+        "schema": router.schema.info(),
+        "web_search": router.web_client.cache.stats(),
+        "llm_stages": {stage: llm.stage_info() for stage, llm in router.stage_llms.items()},
+        "llm_endpoints": llm_endpoints_snapshot(),
+        "traffic_record": _traffic_record_stats(),
+        "admission": admission.snapshot(),
+        "upstreams": upstreams_snapshot(),
+        "jobs": jobs.snapshot(),
+    }
+
+
+def _traffic_record_stats() -> Optional[Dict[str, Any]]:
+    recorder = get_traffic_recorder()
+    return recorder.snapshot() if recorder else None
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Histogramas y contadores en formato de texto de Prometheus.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+def _sse(event: str, data: Any) -> str:
+    """
+    Formatea un evento Server-Sent Events.
+    """
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+@app.post("/agent/stream")
+async def agent_stream_endpoint(
+    req: ChatRequest,
+    x_agent_debug: Optional[str] = Header(default=None),
+    x_agent_priority: Optional[str] = Header(default=None),
+):
+    """
+    Igual que /agent, pero responde con Server-Sent Events:
+    - "meta": intención y datos de SQL/web (antes de generar la respuesta)
+    - "token": cada fragmento de la respuesta del LLM
+    - "trace": tiempos por etapa (solo con la cabecera X-Agent-Debug)
+    - "done": fin de la respuesta
+    - "error": si algo falla a mitad del stream
+    La admisión se decide antes de abrir el stream, así el 429 llega como
+    respuesta normal; el lugar se libera al terminar o cortarse el stream.
+    """
+    _check_result_format(req.result_format)
+
+    debug = _debug_requested(x_agent_debug)
+    admitted = AsyncExitStack()
+    await admitted.enter_async_context(admission.admit(_priority_lane(x_agent_priority)))
+
+    async def event_stream():
+        try:
+            with tracing(debug) as trace:
+                try:
+                    async for event, data in router.aroute_stream(req.message):
+                        if event == "token":
+                            yield _sse("token", {"content": data})
+                        elif event == "meta" and data.get("sql_result") and req.result_format != "rows":
+                            meta = {**data, "sql_result": encode_sql_result(data["sql_result"], req.result_format)}
+                            yield _sse("meta", meta)
+                        elif event == "meta" and data.get("actions"):
+                            yield _sse("meta", {**data, "actions": _encoded_actions(data["actions"], req.result_format)})
+                        else:
+                            yield _sse(event, data)
+                    if trace is not None:
+                        yield _sse("trace", trace.to_dict())
+                    yield _sse("done", {})
+                except Exception as e:
+                    yield _sse("error", {"error": str(e)})
+        finally:
+            await admitted.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Si el cliente se desconecta antes de empezar, el generador no corre
+        background=BackgroundTask(admitted.aclose),
+    )
+
+
+# ---------------------------
+# BATCH
+# ---------------------------
+
+class BatchRequest(BaseModel):
+    messages: List[str]
+    result_format: ResultFormat = "rows"
+    # Preguntas a la vez (como máximo BATCH_CONCURRENCY)
+    concurrency: Optional[int] = None
+
+
+@app.post("/agent/batch")
+async def agent_batch_endpoint(req: BatchRequest):
+    """
+    Corre muchas preguntas en una sola petición (ver batch.py). Responde
+    NDJSON: una línea por pregunta, en orden de término, con su `index`
+    en la lista y el mismo cuerpo que /agent; la última línea es el resumen.
+    """
+    _check_result_format(req.result_format)
+    if not req.messages:
+        raise HTTPException(status_code=400, detail="messages está vacío")
+    if len(req.messages) > BATCH_MAX_MESSAGES:
+        raise HTTPException(status_code=400, detail=f"Máximo {BATCH_MAX_MESSAGES} preguntas por batch")
+    if req.concurrency is not None and req.concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency debe ser al menos 1")
+
+    concurrency = min(req.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)
+
+    async def lines():
+        results = run_batch(router, req.messages, concurrency, lambda r: _chat_payload(r, req.result_format))
+        try:
+            async for line in results:
+                yield json.dumps(line, ensure_ascii=False, default=str) + "\n"
+        finally:
+            await results.aclose()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# ---------------------------
+# JOBS ASYNC
+# ---------------------------
+
+async def _run_job(req: ChatRequest) -> Dict[str, Any]:
+    result = await router.aroute(req.message)
+    return _chat_payload(result, req.result_format)
+
+
+jobs = JobManager(_run_job, JOBS_MAX_PENDING, JOBS_RESULT_TTL)
+
+
+def _get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado o expirado")
+    return job
+
+
+@app.post("/agent/jobs", status_code=202)
+async def agent_job_submit_endpoint(req: ChatRequest):
+    """
+    Encola la pregunta como job (carril de baja prioridad) y devuelve su
+    id al instante. El resultado tiene la misma forma que /agent.
+    """
+    _check_result_format(req.result_format)
+
+    job = jobs.submit(req)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/agent/jobs/{job.id}",
+        "events_url": f"/agent/jobs/{job.id}/events",
+    }
+
+
+@app.get("/agent/jobs/{job_id}")
+async def agent_job_endpoint(job_id: str):
+    """
+    Estado del job y, al terminar, su resultado o error.
+    """
+    return _get_job(job_id).to_dict()
+
+
+@app.get("/agent/jobs/{job_id}/events")
+async def agent_job_events_endpoint(job_id: str):
+    """
+    Server-Sent Events del job:
+    - "status": cada cambio de estado (queued, running, ...)
+    - "result": la respuesta, si terminó bien
+    - "error": si falló
+    - "done": fin del stream
+    """
+    job = _get_job(job_id)
+
+    async def event_stream():
+        status = None
+        while True:
+            if job.status != status:
+                status = job.status
+                yield _sse("status", {"status": status})
+            if job.finished:
+                break
+            if not await jobs.wait_change(job, status, KEEPALIVE_SECONDS):
+                # Comentario SSE: mantiene viva la conexión en proxies
+                yield ": keep-alive\n\n"
+
+        if job.status == "done":
+            yield _sse("result", job.result)
+        elif job.status == "error":
+            yield _sse("error", {"error": job.error})
+        yield _sse("done", {})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.delete("/agent/jobs/{job_id}")
+async def agent_job_cancel_endpoint(job_id: str):
+    """
+    Cancela un job en fila o en curso.
+    """
+    job = _get_job(job_id)
+    jobs.cancel(job_id)
+    return job.to_dict()
@@ -0,0 +1,338 @@
+# backend/metrics.py
+"""
+Instrumentación del agente.
+- Contadores e histogramas en memoria, exportados en formato de texto de
+  Prometheus en GET /metrics (sin dependencias extra).
+- span("sql") mide una etapa de la petición: alimenta el histograma
+  agent_stage_duration_seconds y, si la petición pidió traza (cabecera de
+  debug), la agrega a su traza JSON.
+
+La traza activa vive en un ContextVar: las tareas creadas durante la
+petición (ramas especulativas, hedging) la heredan y escriben en la misma.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _label_text(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = [f'{label}="{_escape(value)}"' for label, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(f'{extra[0]}="{extra[1]}"')
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{self._label_text(key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """
+    Valor que sube y baja (filas, peticiones en curso).
+    """
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # llave -> [conteos por bucket (no acumulados), suma, total]
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = ("le", _format_value(bound))
+                    lines.append(f"{self.name}_bucket{self._label_text(key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{self._label_text(key)} {total}")
+                lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return lines
+
+
+# ---------------------------
+# MÉTRICAS DEL AGENTE
+# ---------------------------
+
+REQUEST_SECONDS = Histogram(
+    "agent_request_duration_seconds",
+    "Duración total de cada pregunta, por camino e intención.",
+    ("path", "intent"),
+)
+STAGE_SECONDS = Histogram(
+    "agent_stage_duration_seconds",
+    "Duración de cada etapa (routing, sql, web_search, answer, llm_<etapa>).",
+    ("stage",),
+)
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    "agent_llm_first_token_seconds",
+    "Tiempo hasta el primer fragmento de las llamadas al LLM en streaming.",
+    ("stage",),
+)
+LLM_TOKENS = Counter(
+    "agent_llm_tokens_total",
+    "Tokens de las llamadas al LLM (prompt, completion y prompt servido desde caché). "
+    "prompt_estimated/completion_estimated: streams cortados antes de que el proveedor "
+    "reportara el uso (por ejemplo el router), estimados y sin dato de caché.",
+    ("stage", "kind"),
+)
+LLM_ERRORS = Counter(
+    "agent_llm_errors_total",
+    "Llamadas al LLM que terminaron en error.",
+    ("stage", "provider", "error"),
+)
+LLM_ENDPOINT_FAILURES = Counter(
+    "agent_llm_endpoint_failures_total",
+    "Fallos de cada servidor LLM local (antes del failover).",
+    ("endpoint",),
+)
+CACHE_EVENTS = Counter(
+    "agent_cache_events_total",
+    "Consultas a las cachés del agente (hit, miss, coalesced).",
+    ("cache", "result"),
+)
+UPSTREAM_SECONDS = Histogram(
+    "agent_upstream_duration_seconds",
+    "Latencia de los servicios externos (Tavily).",
+    ("upstream",),
+)
+UPSTREAM_ERRORS = Counter(
+    "agent_upstream_errors_total",
+    "Errores de los servicios externos.",
+    ("upstream",),
+)
+ADMISSION_EVENTS = Counter(
+    "agent_admission_total",
+    "Decisiones del control de admisión por carril (admitted, queue_full, queue_timeout, evicted).",
+    ("lane", "result"),
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "agent_admission_wait_seconds",
+    "Tiempo en la fila de admisión de las peticiones admitidas.",
+    ("lane",),
+)
+ADMISSION_QUEUE = Gauge(
+    "agent_admission_queue",
+    "Peticiones esperando turno (waiting) y en curso (in_flight) por carril.",
+    ("lane", "state"),
+)
+
+REGISTRY: List[_Metric] = [
+    REQUEST_SECONDS,
+    STAGE_SECONDS,
+    LLM_FIRST_TOKEN_SECONDS,
+    LLM_TOKENS,
+    LLM_ERRORS,
+    LLM_ENDPOINT_FAILURES,
+    CACHE_EVENTS,
+    UPSTREAM_SECONDS,
+    UPSTREAM_ERRORS,
+    ADMISSION_EVENTS,
+    ADMISSION_WAIT_SECONDS,
+    ADMISSION_QUEUE,
+]
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------
+# TRAZA POR PETICIÓN
+# ---------------------------
+
+class Trace:
+    """
+    Etapas y llamadas al LLM de una petición, con tiempos relativos a su
+    inicio. Se devuelve en la respuesta cuando se pide con la cabecera de debug.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans: List[Dict[str, Any]] = []
+        self.llm_usage: List[Dict[str, Any]] = []
+        self.events: List[Dict[str, Any]] = []
+
+    def add_span(self, name: str, started: float, elapsed: float, attrs: Dict[str, Any]) -> None:
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "start_ms": round((started - self.started) * 1000, 2),
+                "duration_ms": round(elapsed * 1000, 2),
+                **attrs,
+            })
+
+    def add(self, kind: str, **data: Any) -> None:
+        with self._lock:
+            target = self.llm_usage if kind == "llm_usage" else self.events
+            target.append({"at_ms": round((time.perf_counter() - self.started) * 1000, 2), **data})
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+                "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+                "llm_usage": list(self.llm_usage),
+                "events": list(self.events),
+            }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("agent_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def tracing(enabled: bool) -> Iterator[Optional[Trace]]:
+    """
+    Activa una traza para el código dentro del bloque (si `enabled`).
+    """
+    if not enabled:
+        yield None
+        return
+
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # Un stream cerrado desde otra tarea (cliente desconectado)
+            # termina en otro contexto; ahí la variable ya no importa
+            pass
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Mide una etapa. Devuelve el dict de atributos para que el bloque
+    agregue datos a la traza (por ejemplo la intención elegida).
+    """
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(name, started, elapsed, attrs)
+
+
+def record_llm_usage(
+    stage: str,
+    prompt_tokens: Optional[int],
+    completion_tokens: Optional[int],
+    cached_tokens: Optional[int],
+    estimated: bool = False,
+) -> None:
+    suffix = "_estimated" if estimated else ""
+    for kind, value in (("prompt", prompt_tokens), ("completion", completion_tokens), ("cached", cached_tokens)):
+        if value:
+            LLM_TOKENS.inc(value, stage=stage, kind=kind + suffix)
+
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(
+            "llm_usage",
+            stage=stage,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens,
+            estimated=estimated,
+        )
+
+
+def record_cache(cache: str, result: str) -> None:
+    CACHE_EVENTS.inc(cache=cache, result=result)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add("cache", cache=cache, result=result)
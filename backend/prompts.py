@@ -41,7 +41,7 @@ Tabla asignaciones:
 - estatus_ticket TEXT
 """
 
-ROUTER_SYSTEM_PROMPT = f"""
+ROUTER_INSTRUCTIONS = """
 Eres un router de intención para un agente.
 
 Tu tarea es analizar el mensaje del usuario y decidir cuál de estas intenciones usar:
@@ -61,22 +61,180 @@ Tu tarea es analizar el mensaje del usuario y decidir cuál de estas intenciones
 
 Además:
 - Si la intención es "sql", debes generar un query SQL de SOLO LECTURA
-  (solo SELECT) para la base de datos con este esquema:
-{DB_SCHEMA_DESCRIPTION}
+  (solo SELECT) para la base de datos cuyo esquema viene junto con el
+  mensaje del usuario (solo las tablas y columnas relevantes).
 
 - Si la intención es "web", debes generar un texto corto de búsqueda en inglés
   o español que sirva como query para un motor de búsqueda web.
+"""
 
+ROUTER_SYSTEM_PROMPT = ROUTER_INSTRUCTIONS + """
 Responde SIEMPRE en JSON con esta estructura EXACTA:
 
-{{
+{
   "intent": "sql" | "web" | "llm",
   "sql_query": "<query o vacío>",
   "web_query": "<query o vacío>",
   "explanation": "<breve explicación de por qué elegiste esa intención>"
-}}
+}
+"""
+
+# JSON Schema de la respuesta del router (salida estructurada, ver
+# structured_output.py). El orden importa: "explanation"/"answer" van al
+# final para poder actuar en cuanto intent, sql_query y web_query están listos.
+_ROUTER_DECISION_PROPERTIES = {
+    "intent": {"type": "string", "enum": ["sql", "web", "llm"]},
+    "sql_query": {"type": "string"},
+    "web_query": {"type": "string"},
+}
+
+ROUTER_OUTPUT_SCHEMA = {
+    "title": "router",
+    "type": "object",
+    "properties": {**_ROUTER_DECISION_PROPERTIES, "explanation": {"type": "string"}},
+    "required": [*_ROUTER_DECISION_PROPERTIES, "explanation"],
+    "additionalProperties": False,
+}
+
+ROUTER_INLINE_OUTPUT_SCHEMA = {
+    "title": "router_inline",
+    "type": "object",
+    "properties": {**_ROUTER_DECISION_PROPERTIES, "answer": {"type": "string"}},
+    "required": [*_ROUTER_DECISION_PROPERTIES, "answer"],
+    "additionalProperties": False,
+}
+
+# Variante con planes (ROUTER_MAX_ACTIONS > 1): para preguntas que
+# necesitan varias consultas independientes a la vez. Las listas van
+# después de sql_query/web_query para no retrasar las decisiones simples.
+ROUTER_PLAN_INSTRUCTIONS = """
+4) "plan": cuando la pregunta necesite VARIAS consultas independientes,
+   por ejemplo comparar datos de la base con información de internet, o
+   cifras de dos tablas que no se pueden sacar con un solo query.
+
+- Si la intención es "plan", pon los queries SQL en "sql_queries" y las
+  búsquedas en "web_queries" (pocas acciones en total, 2 o 3, que no
+  dependan unas de otras) y deja "sql_query" y "web_query" vacíos.
+  Para las demás intenciones deja las dos listas vacías.
 """
 
+ROUTER_PLAN_SYSTEM_PROMPT = ROUTER_INSTRUCTIONS + ROUTER_PLAN_INSTRUCTIONS + """
+Responde SIEMPRE en JSON con esta estructura EXACTA:
+
+{
+  "intent": "sql" | "web" | "llm" | "plan",
+  "sql_query": "<query o vacío>",
+  "web_query": "<query o vacío>",
+  "sql_queries": ["<query>", ...],
+  "web_queries": ["<búsqueda>", ...],
+  "explanation": "<breve explicación de por qué elegiste esa intención>"
+}
+"""
+
+_ROUTER_PLAN_PROPERTIES = {
+    **_ROUTER_DECISION_PROPERTIES,
+    "intent": {"type": "string", "enum": ["sql", "web", "llm", "plan"]},
+    "sql_queries": {"type": "array", "items": {"type": "string"}},
+    "web_queries": {"type": "array", "items": {"type": "string"}},
+}
+
+ROUTER_PLAN_OUTPUT_SCHEMA = {
+    "title": "router_plan",
+    "type": "object",
+    "properties": {**_ROUTER_PLAN_PROPERTIES, "explanation": {"type": "string"}},
+    "required": [*_ROUTER_PLAN_PROPERTIES, "explanation"],
+    "additionalProperties": False,
+}
+
+ROUTER_PLAN_INLINE_OUTPUT_SCHEMA = {
+    "title": "router_plan_inline",
+    "type": "object",
+    "properties": {**_ROUTER_PLAN_PROPERTIES, "answer": {"type": "string"}},
+    "required": [*_ROUTER_PLAN_PROPERTIES, "answer"],
+    "additionalProperties": False,
+}
+
+# El esquema va en el mensaje del usuario y no en el system prompt: así
+# el system prompt es idéntico en cada llamada (caché de prefijo) aunque
+# el esquema se recorte según la pregunta
+ROUTER_USER_TEMPLATE = """Esquema de la base de datos:
+{schema}
+
+Mensaje del usuario:
+{message}"""
+
+# Variante de una sola llamada: si la intención es "llm", el router
+# responde directamente en el campo "answer" (ROUTER_MODE="inline_answer")
+ROUTER_INLINE_ANSWER_SYSTEM_PROMPT = ROUTER_INSTRUCTIONS + """
+- Si la intención es "llm", escribe en "answer" la respuesta final para el
+  usuario: en español, concisa y didáctica. Para "sql" y "web" deja "answer" vacío.
+
+Responde SIEMPRE en JSON con esta estructura EXACTA y en este orden:
+
+{
+  "intent": "sql" | "web" | "llm",
+  "sql_query": "<query o vacío>",
+  "web_query": "<query o vacío>",
+  "answer": "<respuesta final si la intención es llm, o vacío>"
+}
+"""
+
+ROUTER_PLAN_INLINE_ANSWER_SYSTEM_PROMPT = ROUTER_INSTRUCTIONS + ROUTER_PLAN_INSTRUCTIONS + """
+- Si la intención es "llm", escribe en "answer" la respuesta final para el
+  usuario: en español, concisa y didáctica. Para las demás deja "answer" vacío.
+
+Responde SIEMPRE en JSON con esta estructura EXACTA y en este orden:
+
+{
+  "intent": "sql" | "web" | "llm" | "plan",
+  "sql_query": "<query o vacío>",
+  "web_query": "<query o vacío>",
+  "sql_queries": ["<query>", ...],
+  "web_queries": ["<búsqueda>", ...],
+  "answer": "<respuesta final si la intención es llm, o vacío>"
+}
+"""
+
+# Variante por lotes (/agent/batch): varias preguntas en una sola llamada.
+# Cada decisión lleva el id de su mensaje; las que falten se clasifican solas.
+ROUTER_BATCH_SYSTEM_PROMPT = ROUTER_INSTRUCTIONS + """
+Vas a recibir VARIOS mensajes de usuario, cada uno con su id entre
+corchetes. Clasifica cada uno por separado, como si fuera el único.
+
+Responde SIEMPRE en JSON con esta estructura EXACTA, con una decisión por
+mensaje y en el mismo orden:
+
+{
+  "decisions": [
+    {"id": <id del mensaje>, "intent": "sql" | "web" | "llm", "sql_query": "<query o vacío>", "web_query": "<query o vacío>"}
+  ]
+}
+"""
+
+ROUTER_BATCH_OUTPUT_SCHEMA = {
+    "title": "router_batch",
+    "type": "object",
+    "properties": {
+        "decisions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"id": {"type": "integer"}, **_ROUTER_DECISION_PROPERTIES},
+                "required": ["id", *_ROUTER_DECISION_PROPERTIES],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["decisions"],
+    "additionalProperties": False,
+}
+
+ROUTER_BATCH_USER_TEMPLATE = """Esquema de la base de datos:
+{schema}
+
+Mensajes del usuario:
+{messages}"""
+
 LLM_ANSWER_SYSTEM_PROMPT_SQL = f"""
 Eres un asistente útil y claro. Responde en español, de forma concisa y didáctica.
 Analiza la pregunta del usuario en conjunto con el contexto siguiente:
@@ -84,7 +242,7 @@ Analiza la pregunta del usuario en conjunto con el contexto siguiente:
 Se ejecutó este query SQL:
 {{sql_query}}
 
-Y este fue el resultado (JSON):
+Y este fue el resultado (resumido si era muy grande):
 {{sql_result}}
 
 Explica el resultado al usuario en español de forma clara.
@@ -101,4 +259,17 @@ Y este fueron los resultados de la búsqueda en internet:
 {{web_result}}
 
 Responde al usuario en español usando esta información.
-"""
\ No newline at end of file
+"""
+
+# Respuesta de un plan: un solo llamado con los resultados de todas las
+# acciones. {actions} trae un bloque por acción (ver AgentRouter._plan_answer).
+LLM_ANSWER_SYSTEM_PROMPT_PLAN = f"""
+Eres un asistente útil y claro. Responde en español, de forma concisa y didáctica.
+Analiza la pregunta del usuario en conjunto con el contexto siguiente.
+
+Para responderla se ejecutaron varias consultas independientes:
+{{actions}}
+
+Combina los resultados en una sola respuesta. Si alguna consulta falló,
+menciónalo brevemente y responde con lo que sí se obtuvo.
+"""
@@ -0,0 +1,200 @@
+# backend/response_cache.py
+"""
+Caché de respuestas del agente.
+La llave es el mensaje normalizado (minúsculas, sin acentos ni puntuación);
+opcionalmente se aceptan paráfrasis comparando embeddings.
+Las entradas guardan la decisión de ruteo y la respuesta final, así que un
+acierto evita por completo las llamadas al LLM.
+"""
+
+import copy
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .db_client import db_signature
+from .intent_classifier import normalize_text
+
+# Intenciones cuya respuesta depende de la base (se invalidan si cambia)
+DB_INTENTS = ("sql", "plan")
+
+
+def _normalized(vector: List[float]) -> List[float]:
+    # Con vectores unitarios la similitud coseno es solo el producto punto
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else list(vector)
+
+
+def _dot(a: List[float], b: List[float]) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+class ResponseCache:
+    """
+    Caché LRU acotada por tamaño, con TTL por intención e invalidación
+    automática de las entradas "sql" cuando cambia el archivo de la BD.
+    Es segura para usarse desde varios hilos.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttls: Dict[str, float],
+        db_path: str,
+        similarity_threshold: float = 0.92,
+        similarity_candidates: int = 256,
+    ):
+        self.max_entries = max_entries
+        self.ttls = ttls
+        self.db_path = db_path
+        self.similarity_threshold = similarity_threshold
+        self.similarity_candidates = similarity_candidates
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def has(self, message: str) -> bool:
+        """
+        Indica si hay una entrada exacta para el mensaje (sin contar estadísticas).
+        Sirve para no calcular embeddings cuando no hacen falta.
+        """
+        with self._lock:
+            return normalize_text(message) in self._entries
+
+    def get(
+        self,
+        message: str,
+        embedding: Optional[List[float]] = None,
+        intent: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Busca una respuesta para el mensaje. Primero por llave exacta y, si
+        se pasan un embedding y la intención probable del mensaje, por
+        similitud con las entradas recientes de esa misma intención (una
+        pregunta de SQL no recibe una respuesta web guardada). La
+        comparación corre fuera del lock y cuesta O(candidatos × dimensión):
+        desde el event loop hay que llamarla en un hilo.
+        Devuelve una copia del resultado guardado o None.
+        """
+        key = normalize_text(message)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._is_valid(key, entry):
+                entry = None
+            if entry is not None:
+                return self._hit(key, entry)
+
+            candidates = []
+            if embedding is not None and intent is not None:
+                candidates = self._similarity_candidates(intent)
+
+        best_key = self._most_similar(_normalized(embedding), candidates) if candidates else None
+
+        with self._lock:
+            entry = self._entries.get(best_key) if best_key is not None else None
+            if entry is not None and self._is_valid(best_key, entry):
+                self._stats["semantic_hits"] += 1
+                return self._hit(best_key, entry)
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, message: str, result: Dict[str, Any], embedding: Optional[List[float]] = None) -> None:
+        """
+        Guarda el resultado completo de route() (intención, datos y respuesta).
+        """
+        intent = result.get("intent", "llm")
+        ttl = self.ttls.get(intent, 0)
+        if ttl <= 0:
+            return
+
+        entry = {
+            "result": copy.deepcopy(result),
+            "intent": intent,
+            "expires_at": time.monotonic() + ttl,
+            "embedding": _normalized(embedding) if embedding is not None else None,
+            "db_signature": db_signature(self.db_path) if intent in DB_INTENTS else None,
+        }
+
+        key = normalize_text(message)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+    # ---------------------------
+    # UTILIDADES INTERNAS (requieren el lock)
+    # ---------------------------
+
+    def _is_valid(self, key: str, entry: Dict[str, Any]) -> bool:
+        """
+        Revisa TTL y, para "sql" y "plan", que la BD no haya cambiado.
+        Las entradas inválidas se eliminan.
+        """
+        if entry["expires_at"] <= time.monotonic():
+            del self._entries[key]
+            self._stats["expirations"] += 1
+            return False
+
+        if entry["intent"] in DB_INTENTS and entry["db_signature"] != db_signature(self.db_path):
+            del self._entries[key]
+            self._stats["invalidations"] += 1
+            return False
+
+        return True
+
+    def _hit(self, key: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        self._stats["hits"] += 1
+        self._entries.move_to_end(key)
+        return copy.deepcopy(entry["result"])
+
+    def _similarity_candidates(self, intent: str) -> List[Tuple[str, List[float]]]:
+        """
+        (llave, embedding) de las entradas más recientes de `intent`, hasta
+        similarity_candidates.
+        """
+        candidates = []
+        for key in reversed(self._entries):
+            entry = self._entries[key]
+            if entry["intent"] == intent and entry["embedding"] is not None:
+                candidates.append((key, entry["embedding"]))
+                if len(candidates) >= self.similarity_candidates:
+                    break
+        return candidates
+
+    def _most_similar(self, embedding: List[float], candidates: List[Tuple[str, List[float]]]) -> Optional[str]:
+        # Sin lock: los embeddings guardados no se modifican
+        best_key, best_score = None, self.similarity_threshold
+        for key, other in candidates:
+            score = _dot(embedding, other)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
@@ -0,0 +1,138 @@
+# backend/result_encoding.py
+"""
+Codificaciones alternativas de un resultado SQL para la respuesta HTTP.
+- "rows": formato original, lista de filas (la valida Pydantic)
+- "columnar": un arreglo por columna más el tipo de cada columna
+- "arrow": Arrow IPC (stream) en base64; requiere pyarrow instalado
+
+Las codificaciones columnar y arrow se serializan directamente a JSON, sin
+pasar cada celda por la validación de Pydantic.
+"""
+
+import base64
+from typing import Any, Dict, List, Sequence
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+RESULT_FORMATS = ("rows", "columnar", "arrow")
+
+# Campos del resultado que se copian tal cual en cualquier codificación
+_PASSTHROUGH_FIELDS = (
+    "error", "error_code", "error_detail", "truncated", "total_rows", "next_token",
+)
+
+
+def _passthrough(sql_result: Dict[str, Any]) -> Dict[str, Any]:
+    encoded = {field: sql_result.get(field) for field in _PASSTHROUGH_FIELDS}
+    encoded["truncated"] = bool(encoded["truncated"])
+    return encoded
+
+
+def _column_type(values: Sequence[Any]) -> str:
+    kinds = set()
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool) or isinstance(value, int):
+            kinds.add("integer")
+        elif isinstance(value, float):
+            kinds.add("real")
+        elif isinstance(value, bytes):
+            kinds.add("blob")
+        else:
+            kinds.add("text")
+
+    if not kinds:
+        return "null"
+    if kinds == {"integer", "real"}:
+        return "real"
+    if len(kinds) == 1:
+        return kinds.pop()
+    return "mixed"
+
+
+def _transpose(columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> List[List[Any]]:
+    if not rows:
+        return [[] for _ in columns]
+    return [list(col) for col in zip(*rows)]
+
+
+def to_columnar(sql_result: Dict[str, Any]) -> Dict[str, Any]:
+    columns = sql_result.get("columns", [])
+    data = _transpose(columns, sql_result.get("rows", []))
+
+    # Los BLOB no existen en JSON: los mandamos en base64
+    types = [_column_type(values) for values in data]
+    for i, kind in enumerate(types):
+        if kind in ("blob", "mixed"):
+            data[i] = [
+                base64.b64encode(v).decode("ascii") if isinstance(v, bytes) else v
+                for v in data[i]
+            ]
+
+    encoded = _passthrough(sql_result)
+    encoded.update({
+        "encoding": "columnar",
+        "columns": columns,
+        "types": types,
+        "data": data,
+    })
+    return encoded
+
+
+def to_arrow(sql_result: Dict[str, Any]) -> Dict[str, Any]:
+    if pa is None:
+        raise ValueError("El formato 'arrow' requiere tener pyarrow instalado.")
+
+    columns = sql_result.get("columns", [])
+    data = _transpose(columns, sql_result.get("rows", []))
+
+    # Columnas con tipos mezclados se mandan como texto
+    arrays = []
+    for values in data:
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays.append(pa.array([None if v is None else str(v) for v in values]))
+
+    # Arrow exige nombres únicos en el esquema
+    names = [f"{name}_{i}" if columns.count(name) > 1 else name for i, name in enumerate(columns)]
+    table = pa.Table.from_arrays(arrays, names=names)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    encoded = _passthrough(sql_result)
+    encoded.update({
+        "encoding": "arrow",
+        "columns": columns,
+        "types": [str(array.type) for array in arrays],
+        "data": base64.b64encode(sink.getvalue().to_pybytes()).decode("ascii"),
+    })
+    return encoded
+
+
+def check_result_format(fmt: str) -> None:
+    """
+    Valida el formato pedido antes de hacer cualquier trabajo.
+    """
+    if fmt not in RESULT_FORMATS:
+        raise ValueError(f"Formato de resultado desconocido: {fmt}")
+    if fmt == "arrow" and pa is None:
+        raise ValueError("El formato 'arrow' requiere tener pyarrow instalado.")
+
+
+def encode_sql_result(sql_result: Dict[str, Any], fmt: str) -> Dict[str, Any]:
+    """
+    Codifica `sql_result` en el formato pedido. "rows" lo deja igual.
+    """
+    if fmt == "columnar":
+        return to_columnar(sql_result)
+    if fmt == "arrow":
+        return to_arrow(sql_result)
+    return sql_result
@@ -0,0 +1,182 @@
+# backend/result_summarizer.py
+"""
+Resumen de resultados SQL para el prompt de respuesta.
+En lugar de pegar todas las filas en el prompt, se construye un resumen
+(conteos, estadísticas por columna, totales por grupo, primeras filas y
+una muestra) que nunca pasa de un presupuesto de tokens.
+"""
+
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+
+from .config import SQL_SUMMARY_TOKEN_BUDGET
+
+# Longitud máxima de cada celda dentro del resumen
+MAX_CELL_CHARS = 60
+# Columnas con hasta este número de valores distintos se usan para agrupar
+MAX_GROUP_CARDINALITY = 20
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimación rápida: ~4 caracteres por token.
+    """
+    return len(text) // 4 + 1
+
+
+def summarize_sql_result(sql_result: Dict[str, Any], token_budget: int = SQL_SUMMARY_TOKEN_BUDGET) -> str:
+    """
+    Devuelve un texto que describe `sql_result` sin pasar de `token_budget`.
+    Si todas las filas caben, se incluyen completas.
+    """
+    if sql_result.get("error"):
+        return f"Error al ejecutar el query: {sql_result['error']}"
+
+    columns = sql_result.get("columns", [])
+    rows = sql_result.get("rows", [])
+    header = _header(sql_result, len(rows))
+
+    # 1) Si todo cabe, mandamos las filas completas
+    full = "\n".join([header, _format_rows(columns, rows)])
+    if estimate_tokens(full) <= token_budget:
+        return full
+
+    # 2) Si no, resumen: estadísticas + grupos + primeras filas + muestra
+    stats = _column_stats(columns, rows)
+    groups = _group_totals(columns, rows)
+
+    for k in (20, 10, 5, 3, 1, 0):
+        sections = [header, stats, groups]
+        if k:
+            sections.append(f"Primeras {min(k, len(rows))} filas:\n{_format_rows(columns, rows[:k])}")
+            sample = _sample(rows[k:], k)
+            if sample:
+                sections.append(f"Muestra de otras filas:\n{_format_rows(columns, sample)}")
+
+        text = "\n\n".join(s for s in sections if s)
+        if estimate_tokens(text) <= token_budget:
+            return text
+
+    # 3) Último recurso: sin grupos y recortado al presupuesto
+    text = "\n\n".join(s for s in (header, stats) if s)
+    return text[: (token_budget - 1) * 4]
+
+
+# ---------------------------
+# SECCIONES DEL RESUMEN
+# ---------------------------
+
+def _header(sql_result: Dict[str, Any], returned: int) -> str:
+    total = sql_result.get("total_rows")
+
+    if sql_result.get("truncated"):
+        total_text = f"{total}" if total is not None else "desconocido (muy grande)"
+        return (
+            f"Filas devueltas: {returned} (el resultado completo tiene {total_text} filas; "
+            "las estadísticas se calcularon sobre las filas devueltas)."
+        )
+
+    return f"Filas devueltas: {returned}."
+
+
+def _format_cell(value: Any) -> str:
+    text = "NULL" if value is None else str(value)
+    if len(text) > MAX_CELL_CHARS:
+        text = text[:MAX_CELL_CHARS] + "…"
+    return text
+
+
+def _format_rows(columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> str:
+    lines = [" | ".join(columns)]
+    for row in rows:
+        lines.append(" | ".join(_format_cell(v) for v in row))
+    return "\n".join(lines)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _numeric_columns(columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> List[int]:
+    numeric = []
+    for i in range(len(columns)):
+        values = [row[i] for row in rows if row[i] is not None]
+        if values and all(_is_number(v) for v in values):
+            numeric.append(i)
+    return numeric
+
+
+def _column_stats(columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> str:
+    if not rows:
+        return ""
+
+    numeric = set(_numeric_columns(columns, rows))
+    lines = ["Estadísticas por columna:"]
+
+    for i, name in enumerate(columns):
+        values = [row[i] for row in rows]
+        present = [v for v in values if v is not None]
+        nulls = len(values) - len(present)
+
+        if i in numeric:
+            total = sum(present)
+            lines.append(
+                f"- {name}: min={min(present)}, max={max(present)}, "
+                f"promedio={round(total / len(present), 4)}, suma={round(total, 4)}, nulos={nulls}"
+            )
+        else:
+            counts = Counter(_format_cell(v) for v in present)
+            top = ", ".join(f"{v} ({c})" for v, c in counts.most_common(5))
+            lines.append(f"- {name}: {len(counts)} valores distintos, nulos={nulls}; más frecuentes: {top}")
+
+    return "\n".join(lines)
+
+
+def _group_totals(columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> str:
+    """
+    Totales por grupo sobre la primera columna categórica de baja cardinalidad.
+    """
+    if not rows:
+        return ""
+
+    numeric = _numeric_columns(columns, rows)
+    group_col: Optional[int] = None
+
+    for i in range(len(columns)):
+        if i in numeric:
+            continue
+        distinct = {row[i] for row in rows}
+        if 1 < len(distinct) <= MAX_GROUP_CARDINALITY:
+            group_col = i
+            break
+
+    if group_col is None:
+        return ""
+
+    groups: Dict[Any, Dict[str, Any]] = {}
+    for row in rows:
+        group = groups.setdefault(row[group_col], {"count": 0, "sums": [0] * len(numeric)})
+        group["count"] += 1
+        for j, i in enumerate(numeric):
+            if row[i] is not None:
+                group["sums"][j] += row[i]
+
+    lines = [f"Totales por {columns[group_col]}:"]
+    ordered = sorted(groups.items(), key=lambda kv: kv[1]["count"], reverse=True)
+    for value, group in ordered[:10]:
+        sums = ", ".join(
+            f"suma {columns[i]}={round(group['sums'][j], 4)}" for j, i in enumerate(numeric)
+        )
+        lines.append(f"- {_format_cell(value)}: {group['count']} filas" + (f"; {sums}" if sums else ""))
+
+    return "\n".join(lines)
+
+
+def _sample(rows: Sequence[Sequence[Any]], k: int) -> List[Sequence[Any]]:
+    """
+    Muestra determinista: filas equiespaciadas.
+    """
+    if k <= 0 or not rows:
+        return []
+    step = max(1, len(rows) // k)
+    return list(rows[::step][:k])
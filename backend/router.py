@@ -1,94 +1,951 @@
 # backend/router.py
 """
 Router de intención: decide si la pregunta del usuario
-debe ir a SQL, búsqueda web o respuesta directa del LLM.
+debe ir a SQL, búsqueda web o respuesta directa del LLM, o a un plan
+con varias consultas SQL y/o búsquedas independientes (intención "plan").
+
+Hay dos variantes de cada flujo: la síncrona (route, route_stream) y la
+async (aroute, aroute_stream), que es la que usa la API. Ambas comparten
+la construcción de prompts y resultados.
 """
+import asyncio
 import json
-from typing import Dict, Any
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from itertools import chain, zip_longest
+from typing import Dict, Any, Iterator, AsyncIterator, List, Optional, Tuple
 
+from .admission import upstream_limiter
+from .batch import shared
 from .llm_client import LLMClient
 from .db_client import run_select_query
 from .web_search import WebSearchClient
-from .prompts import ROUTER_SYSTEM_PROMPT, LLM_ANSWER_SYSTEM_PROMPT_SQL, LLM_ANSWER_SYSTEM_PROMPT_WEB
+from .intent_classifier import IntentClassifier, normalize_text
+from .json_stream import JsonFieldStreamer
+from .schema_index import load_schema_index
+from .speculation import Speculation
+from .response_cache import ResponseCache
+from .result_summarizer import summarize_sql_result
+from .web_context import format_web_context
+from .metrics import REQUEST_SECONDS, record_cache, span
+from .traffic_recorder import record_result, recording
+from .config import (
+    DB_PATH,
+    LLM_STAGES,
+    LLM_STRUCTURED_OUTPUT,
+    ROUTER_MODE,
+    ROUTER_MAX_ACTIONS,
+    PLAN_ACTION_TIMEOUT,
+    SQL_SUMMARY_TOKEN_BUDGET,
+    SPECULATIVE_BRANCHES,
+    SPECULATIVE_MAX_INFLIGHT,
+    ROUTER_FAST_PATH_ENABLED,
+    ROUTER_FAST_PATH_MIN_CONFIDENCE,
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SQL,
+    RESPONSE_CACHE_TTL_WEB,
+    RESPONSE_CACHE_TTL_LLM,
+    RESPONSE_CACHE_EMBEDDINGS,
+    RESPONSE_CACHE_SIMILARITY,
+    RESPONSE_CACHE_SIMILARITY_CANDIDATES,
+)
+from .prompts import (
+    ROUTER_SYSTEM_PROMPT,
+    ROUTER_USER_TEMPLATE,
+    ROUTER_INLINE_ANSWER_SYSTEM_PROMPT,
+    ROUTER_OUTPUT_SCHEMA,
+    ROUTER_INLINE_OUTPUT_SCHEMA,
+    ROUTER_PLAN_SYSTEM_PROMPT,
+    ROUTER_PLAN_INLINE_ANSWER_SYSTEM_PROMPT,
+    ROUTER_PLAN_OUTPUT_SCHEMA,
+    ROUTER_PLAN_INLINE_OUTPUT_SCHEMA,
+    ROUTER_BATCH_SYSTEM_PROMPT,
+    ROUTER_BATCH_USER_TEMPLATE,
+    ROUTER_BATCH_OUTPUT_SCHEMA,
+    LLM_ANSWER_SYSTEM_PROMPT_SQL,
+    LLM_ANSWER_SYSTEM_PROMPT_WEB,
+    LLM_ANSWER_SYSTEM_PROMPT_PLAN,
+)
+
+logger = logging.getLogger(__name__)
+
+# Campos del JSON del router que hacen falta para actuar
+ROUTER_DECISION_FIELDS = ("intent", "sql_query", "web_query")
+# ... y además, si la intención es "plan"
+ROUTER_PLAN_FIELDS = ("sql_queries", "web_queries")
+
+# Etapa (cliente LLM) que redacta la respuesta de cada intención. Un plan
+# casi siempre trae datos de la base, así que lo redacta la etapa de SQL.
+ANSWER_STAGES = {"sql": "sql_answer", "web": "web_answer", "llm": "llm_answer", "plan": "sql_answer"}
+
+
+class RouterStats:
+    """
+    Contadores del router por camino de ejecución:
+    - "cache": respuesta desde la caché (0 llamadas al LLM)
+    - "fast_path": clasificador local + 1 llamada de respuesta
+    - "inline": el router respondió directamente (1 llamada)
+    - "two_call": router LLM + llamada de respuesta (2 llamadas)
+    - "batch": decisión de un router por lotes + 1 llamada de respuesta;
+      la llamada del lote se cuenta una sola vez en record_batch()
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests: Dict[str, Counter] = defaultdict(Counter)
+        self._latency_sum: Dict[str, float] = defaultdict(float)
+        self._llm_calls = 0
+        self._batch_router_calls = 0
+        self._speculation: Dict[str, Counter] = defaultdict(Counter)
+
+    def record(self, path: str, intent: str, started: float, llm_calls: int) -> None:
+        elapsed = time.perf_counter() - started
+        REQUEST_SECONDS.observe(elapsed, path=path, intent=intent)
+        with self._lock:
+            self._requests[path][intent] += 1
+            self._latency_sum[path] += elapsed
+            self._llm_calls += llm_calls
+
+    def record_batch(self) -> None:
+        """
+        Una llamada al router que clasificó varias preguntas a la vez.
+        """
+        with self._lock:
+            self._batch_router_calls += 1
+            self._llm_calls += 1
+
+    def record_speculation(self, outcome: Dict[str, bool]) -> None:
+        """
+        `outcome` es {rama: se_usó}. Las ramas no usadas son trabajo tirado.
+        """
+        with self._lock:
+            for branch, used in outcome.items():
+                self._speculation[branch]["used" if used else "cancelled"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            avg_latency = {}
+            for path, intents in self._requests.items():
+                total = sum(intents.values())
+                avg_latency[path] = round(self._latency_sum[path] / total, 4) if total else 0.0
+
+            return {
+                "mode": ROUTER_MODE,
+                "requests": {path: dict(intents) for path, intents in self._requests.items()},
+                "avg_latency_seconds": avg_latency,
+                "llm_calls": self._llm_calls,
+                "batch_router_calls": self._batch_router_calls,
+                "speculation": {branch: dict(c) for branch, c in self._speculation.items()},
+            }
 
 
 class AgentRouter:
     def __init__(self):
+        # Cliente general (embeddings, parseo) y uno por etapa, cada uno con
+        # su modelo, timeout y límite de concurrencia
         self.llm = LLMClient()
+        self.stage_llms = {stage: LLMClient(stage) for stage in LLM_STAGES}
         self.web_client = WebSearchClient()
+        # Esquema leído de la base; el clasificador usa la versión completa
+        self.schema = load_schema_index()
+        self.classifier = IntentClassifier(self.schema.describe(examples=False))
+        self.stats = RouterStats()
+        # Peticiones con ramas especulativas en curso (solo en el event loop)
+        self._speculating = 0
+        self.cache = None
+        if RESPONSE_CACHE_ENABLED:
+            self.cache = ResponseCache(
+                max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                ttls={
+                    "sql": RESPONSE_CACHE_TTL_SQL,
+                    "web": RESPONSE_CACHE_TTL_WEB,
+                    "llm": RESPONSE_CACHE_TTL_LLM,
+                    # Un plan vence con la más corta de sus fuentes
+                    "plan": min(RESPONSE_CACHE_TTL_SQL, RESPONSE_CACHE_TTL_WEB),
+                },
+                db_path=DB_PATH,
+                similarity_threshold=RESPONSE_CACHE_SIMILARITY,
+                similarity_candidates=RESPONSE_CACHE_SIMILARITY_CANDIDATES,
+            )
 
     def route(self, user_message: str) -> Dict[str, Any]:
         """
         Devuelve un diccionario con:
         {
-          "intent": "sql" | "web" | "llm",
+          "intent": "sql" | "web" | "llm" | "plan",
           "reply": "texto para el usuario",
           "sql_query": str | None,
           "sql_result": {...} | None,
           "web_query": str | None,
-          "web_raw_result": {...} | None
+          "web_raw_result": {...} | None,
+          "actions": [{"type": "sql" | "web", "query", "result", "error",
+                       "duration_ms"}, ...]  (solo en un plan),
+          "routing": {"source": "fast_path" | "llm" | "batch", "confidence": float | None,
+                      "mode": str, "path": str},
+          "cached": bool
         }
+        Con TRAFFIC_RECORD_PATH la petición se graba (ver traffic_recorder.py).
         """
-        # 1) Pedimos al LLM que clasifique la intención
-        router_messages = [
-            {"role": "system", "content": ROUTER_SYSTEM_PROMPT},
-            {"role": "user", "content": user_message},
+        with recording(user_message):
+            return self._route(user_message)
+
+    def _route(self, user_message: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+
+        cached, embedding = self._cache_get(user_message)
+        if cached is not None:
+            self._record(cached, started)
+            return cached
+
+        with span("routing") as attrs:
+            router_result = self._decide(user_message)
+            attrs["source"] = router_result.get("source")
+        messages, result = self._prepare_from(user_message, router_result)
+
+        if messages is not None:
+            with span("answer"):
+                result["reply"] = self._answer_llm(result).chat(messages)
+
+        self._finish(user_message, result, embedding, started)
+        return result
+
+    def route_stream(self, user_message: str) -> Iterator[Tuple[str, Any]]:
+        """
+        Versión en streaming de route(). Genera tuplas (evento, datos):
+        - ("meta", {...})  una sola vez, con la intención y los datos de SQL/web
+        - ("token", "...") por cada fragmento de la respuesta del LLM
+        """
+        with recording(user_message):
+            yield from self._route_stream(user_message)
+
+    def _route_stream(self, user_message: str) -> Iterator[Tuple[str, Any]]:
+        started = time.perf_counter()
+
+        cached, embedding = self._cache_get(user_message)
+        if cached is not None:
+            self._record(cached, started)
+            reply = cached.pop("reply")
+            yield "meta", cached
+            yield "token", reply
+            return
+
+        router_result = self._fast_path(user_message)
+
+        if router_result is None and ROUTER_MODE == "inline_answer":
+            # El router puede traer la respuesta: la mandamos conforme llega
+            streamer = JsonFieldStreamer("answer")
+            result, tokens = None, []
+
+            stream = self._router_llm().chat_json_stream(self._router_messages(user_message), self._router_schema())
+            try:
+                for chunk in stream:
+                    for piece in streamer.feed(chunk):
+                        if streamer.fields.get("intent") != "llm":
+                            continue
+                        if result is None:
+                            result = self._inline_result(user_message)
+                            yield "meta", result
+                        tokens.append(piece)
+                        yield "token", piece
+
+                    # Para "sql"/"web" no hace falta esperar el resto del JSON
+                    if result is None and self._decision_ready(streamer):
+                        break
+            finally:
+                stream.close()
+
+            if result is not None:
+                self._finish(user_message, {**result, "reply": "".join(tokens)}, embedding, started)
+                return
+
+            router_result = self._streamed_decision(streamer)
+
+        elif router_result is None:
+            with span("routing", source="llm"):
+                router_result = self._llm_decide(user_message)
+
+        messages, result = self._prepare_from(user_message, router_result)
+
+        reply = result.pop("reply", None)
+        yield "meta", result
+
+        if messages is None:
+            tokens = [reply]
+            yield "token", reply
+        else:
+            tokens = []
+            with span("answer"):
+                for token in self._answer_llm(result).chat_stream(messages):
+                    tokens.append(token)
+                    yield "token", token
+
+        self._finish(user_message, {**result, "reply": "".join(tokens)}, embedding, started)
+
+    async def aroute(self, user_message: str, router_result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Versión async de route(): no bloquea el event loop mientras
+        esperamos al LLM, a Tavily o a SQLite. `router_result` es una
+        decisión ya tomada (ver aclassify_batch) que evita llamar al router.
+        """
+        with recording(user_message):
+            return await self._aroute(user_message, router_result)
+
+    async def _aroute(self, user_message: str, router_result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        started = time.perf_counter()
+
+        cached, embedding = await self._acache_get(user_message)
+        if cached is not None:
+            self._record(cached, started)
+            return cached
+
+        router_result = router_result or self._fast_path(user_message)
+        speculation = self._start_speculation(user_message, router_result, stream=False)
+
+        try:
+            if router_result is None:
+                with span("routing", source="llm"):
+                    router_result = await self._allm_decide(user_message)
+
+            messages, result = await self._aprepare_from(user_message, router_result, speculation)
+
+            # Cancelamos lo que no sirve antes de esperar la respuesta
+            answer_task = self._take_llm_branch(speculation, result) if messages is not None else None
+            self._close_speculation(speculation, result)
+            speculation = None
+
+            if answer_task is not None:
+                with span("answer", speculative=True):
+                    result["reply"] = await answer_task
+            elif messages is not None:
+                with span("answer"):
+                    result["reply"] = await self._answer_llm(result).achat(messages)
+        finally:
+            self._close_speculation(speculation, None)
+
+        self._finish(user_message, result, embedding, started)
+        return result
+
+    async def aroute_stream(self, user_message: str) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Versión async de route_stream().
+        """
+        with recording(user_message):
+            stream = self._aroute_stream(user_message)
+            try:
+                async for event in stream:
+                    yield event
+            finally:
+                await stream.aclose()
+
+    async def _aroute_stream(self, user_message: str) -> AsyncIterator[Tuple[str, Any]]:
+        started = time.perf_counter()
+
+        cached, embedding = await self._acache_get(user_message)
+        if cached is not None:
+            self._record(cached, started)
+            reply = cached.pop("reply")
+            yield "meta", cached
+            yield "token", reply
+            return
+
+        router_result = self._fast_path(user_message)
+        speculation = self._start_speculation(user_message, router_result, stream=True)
+        result = None
+
+        try:
+            if router_result is None and ROUTER_MODE == "inline_answer":
+                streamer = JsonFieldStreamer("answer")
+                tokens = []
+
+                stream = self._router_llm().achat_json_stream(self._router_messages(user_message), self._router_schema())
+                try:
+                    async for chunk in stream:
+                        for piece in streamer.feed(chunk):
+                            if streamer.fields.get("intent") != "llm":
+                                continue
+                            if result is None:
+                                result = self._inline_result(user_message)
+                                self._close_speculation(speculation, result)
+                                speculation = None
+                                yield "meta", result
+                            tokens.append(piece)
+                            yield "token", piece
+
+                        if result is None and self._decision_ready(streamer):
+                            break
+                finally:
+                    await stream.aclose()
+
+                if result is not None:
+                    self._finish(user_message, {**result, "reply": "".join(tokens)}, embedding, started)
+                    return
+
+                router_result = self._streamed_decision(streamer)
+
+            elif router_result is None:
+                with span("routing", source="llm"):
+                    router_result = await self._allm_decide(user_message)
+
+            messages, result = await self._aprepare_from(user_message, router_result, speculation)
+
+            answer_stream = self._take_llm_branch(speculation, result) if messages is not None else None
+            self._close_speculation(speculation, result)
+            speculation = None
+
+            reply = result.pop("reply", None)
+            yield "meta", result
+
+            if messages is None:
+                tokens = [reply]
+                yield "token", reply
+            else:
+                tokens = []
+                with span("answer", speculative=answer_stream is not None):
+                    async for token in answer_stream or self._answer_llm(result).achat_stream(messages):
+                        tokens.append(token)
+                        yield "token", token
+        finally:
+            self._close_speculation(speculation, None)
+
+        self._finish(user_message, {**result, "reply": "".join(tokens)}, embedding, started)
+
+    def _finish(self, user_message: str, result: Dict[str, Any], embedding: Optional[List[float]], started: float) -> None:
+        """
+        Guarda la respuesta en la caché y registra las estadísticas.
+        """
+        self._cache_put(user_message, result, embedding)
+        self._record(result, started)
+
+    def _record(self, result: Dict[str, Any], started: float) -> None:
+        record_result(result)
+        if result.get("cached"):
+            path = "cache"
+        else:
+            path = result.get("routing", {}).get("path", "two_call")
+
+        llm_calls = {"cache": 0, "fast_path": 1, "inline": 1, "batch": 1}.get(path, 2)
+        self.stats.record(path, result.get("intent", "llm"), started, llm_calls)
+
+    # ---------------------------
+    # CACHÉ DE RESPUESTAS
+    # ---------------------------
+    def _cache_get(self, user_message: str) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]]]:
+        """
+        Busca el mensaje en la caché. Devuelve (resultado | None, embedding | None);
+        el embedding se reutiliza después para guardar la respuesta nueva.
+        """
+        if self.cache is None:
+            return None, None
+
+        embedding = None
+        if RESPONSE_CACHE_EMBEDDINGS and not self.cache.has(user_message):
+            try:
+                embedding = self.llm.embed(user_message)
+            except Exception as e:
+                logger.warning("No se pudo calcular el embedding: %s", e)
+
+        return self._cache_lookup(user_message, embedding), embedding
+
+    async def _acache_get(self, user_message: str) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]]]:
+        if self.cache is None:
+            return None, None
+
+        embedding = None
+        if RESPONSE_CACHE_EMBEDDINGS and not self.cache.has(user_message):
+            try:
+                embedding = await self.llm.aembed(user_message)
+            except Exception as e:
+                logger.warning("No se pudo calcular el embedding: %s", e)
+
+        if embedding is None:
+            return self._cache_lookup(user_message, None), None
+        # La búsqueda por similitud recorre muchas entradas: fuera del event loop
+        return await asyncio.to_thread(self._cache_lookup, user_message, embedding), embedding
+
+    def _cache_lookup(self, user_message: str, embedding: Optional[List[float]]) -> Optional[Dict[str, Any]]:
+        # Las paráfrasis solo se buscan entre respuestas de la intención
+        # que predice el clasificador local
+        intent = self.classifier.classify(user_message)["intent"] if embedding is not None else None
+        result = self.cache.get(user_message, embedding, intent)
+        record_cache("response", "miss" if result is None else "hit")
+        if result is not None:
+            result["cached"] = True
+        return result
+
+    def _cache_put(self, user_message: str, result: Dict[str, Any], embedding: Optional[List[float]]) -> None:
+        if self.cache is None:
+            return
+
+        # No guardamos consultas SQL que fallaron
+        sql_result = result.get("sql_result")
+        if isinstance(sql_result, dict) and sql_result.get("error"):
+            return
+        # Ni planes con alguna acción fallida
+        for action in result.get("actions") or []:
+            if action["error"] or (isinstance(action["result"], dict) and action["result"].get("error")):
+                return
+
+        self.cache.put(user_message, {**result, "cached": False}, embedding)
+
+    # ---------------------------
+    # CLASIFICACIÓN Y HERRAMIENTAS
+    # ---------------------------
+
+    def _decide(self, user_message: str) -> Dict[str, Any]:
+        """
+        Clasifica la intención: primero localmente y, si no hay
+        suficiente confianza, le preguntamos al LLM.
+        """
+        router_result = self._fast_path(user_message)
+        if router_result is None:
+            router_result = self._llm_decide(user_message)
+        return router_result
+
+    def _llm_decide(self, user_message: str) -> Dict[str, Any]:
+        """
+        Pide la decisión al LLM en streaming y corta en cuanto intent,
+        sql_query y web_query están completos: el SQL empieza sin esperar
+        (ni pagar) la generación de "explanation".
+        """
+        streamer = JsonFieldStreamer()
+        stream = self._router_llm().chat_json_stream(self._router_messages(user_message), self._router_schema())
+        try:
+            for chunk in stream:
+                streamer.feed(chunk)
+                if self._decision_ready(streamer):
+                    break
+        finally:
+            # Cerrar el stream corta la generación en el servidor
+            stream.close()
+
+        return self._streamed_decision(streamer)
+
+    async def _allm_decide(self, user_message: str) -> Dict[str, Any]:
+        streamer = JsonFieldStreamer()
+        stream = self._router_llm().achat_json_stream(self._router_messages(user_message), self._router_schema())
+        try:
+            async for chunk in stream:
+                streamer.feed(chunk)
+                if self._decision_ready(streamer):
+                    break
+        finally:
+            await stream.aclose()
+
+        return self._streamed_decision(streamer)
+
+    async def aclassify_batch(self, user_messages: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Clasifica varias preguntas con una sola llamada al router (ver
+        batch.py). Las que resuelve el fast path o ya están en la caché no
+        se mandan. Devuelve {mensaje: decisión}; las preguntas que falten
+        en la respuesta del modelo se clasifican solas en aroute().
+        """
+        pending = [
+            m for m in user_messages
+            if self._fast_path(m) is None and not (self.cache is not None and self.cache.has(m))
         ]
+        if len(pending) < 2:
+            return {}
+
+        with span("routing", source="batch", size=len(pending)):
+            data = await self._router_llm().achat_json(self._router_batch_messages(pending), self._router_batch_schema())
+        self.stats.record_batch()
 
-        router_result = self.llm.chat_json(router_messages)
-        
-        print(f"""🤖 Petición al LLM - Detector de Itenciones.""")
+        decisions = {}
+        for item in (data.get("decisions") if isinstance(data, dict) else None) or []:
+            index = item.get("id") if isinstance(item, dict) else None
+            if not isinstance(index, int) or not 0 <= index < len(pending):
+                continue
+            # El esquema por lotes no trae listas de acciones: sin planes
+            if item.get("intent") not in ANSWER_STAGES or item.get("intent") == "plan":
+                continue
+            decision = {field: item.get(field) or "" for field in ROUTER_DECISION_FIELDS}
+            decisions[pending[index]] = {**decision, "source": "batch"}
+        return decisions
+
+    def _decision_ready(self, streamer: JsonFieldStreamer) -> bool:
+        """
+        La decisión está lista cuando intent, sql_query y web_query ya se
+        cerraron. Un plan necesita además sus listas de acciones, y en modo
+        inline, para "llm" también hace falta "answer".
+        """
+        fields = streamer.fields
+        if not all(field in fields for field in ROUTER_DECISION_FIELDS):
+            return False
+        if fields["intent"] == "plan":
+            return all(field in fields for field in ROUTER_PLAN_FIELDS)
+        if ROUTER_MODE == "inline_answer" and fields["intent"] == "llm":
+            return "answer" in fields
+        return True
+
+    def _streamed_decision(self, streamer: JsonFieldStreamer) -> Dict[str, Any]:
+        if self._decision_ready(streamer):
+            return self._llm_decision(dict(streamer.fields))
+        # El modelo no siguió el orden/forma esperados: parseamos todo el texto
+        return self._llm_decision(self.llm.parse_json(streamer.text))
+
+    def _router_llm(self) -> LLMClient:
+        return self.stage_llms["router"]
+
+    def _answer_llm(self, result: Dict[str, Any]) -> LLMClient:
+        return self.stage_llms[ANSWER_STAGES.get(result["intent"], "llm_answer")]
+
+    def _router_schema(self) -> Dict[str, Any]:
+        if ROUTER_MODE == "inline_answer":
+            return ROUTER_PLAN_INLINE_OUTPUT_SCHEMA if ROUTER_MAX_ACTIONS > 1 else ROUTER_INLINE_OUTPUT_SCHEMA
+        return ROUTER_PLAN_OUTPUT_SCHEMA if ROUTER_MAX_ACTIONS > 1 else ROUTER_OUTPUT_SCHEMA
+
+    def _router_batch_schema(self) -> Optional[Dict[str, Any]]:
+        # La gramática GBNF y el esquema de Gemini solo cubren objetos
+        # planos: ahí la lista de decisiones va sin salida estructurada
+        llm = self._router_llm()
+        if llm.provider == "gemini" or (llm.provider == "local" and LLM_STRUCTURED_OUTPUT == "grammar"):
+            return None
+        return ROUTER_BATCH_OUTPUT_SCHEMA
+
+    def _llm_decision(self, router_result: Dict[str, Any]) -> Dict[str, Any]:
+        router_result["source"] = "llm"
+        return router_result
+
+    def _prepare_from(self, user_message: str, router_result: Dict[str, Any]) -> Tuple[Optional[List[Dict[str, str]]], Dict[str, Any]]:
+        """
+        Ejecuta la herramienta que corresponde a la decisión del router.
+        Devuelve los mensajes para la llamada final al LLM y el resultado
+        parcial. Si el router ya trajo la respuesta ("answer"), los mensajes
+        son None y el resultado incluye "reply".
+        """
+        intent, sql_query, web_query = self._parse_router_result(router_result)
+
+        if intent == "plan":
+            # Sin event loop las acciones corren una tras otra; la API
+            # async (aroute) es la que las ejecuta en paralelo
+            actions = [self._run_action(kind, query) for kind, query in self._plan_actions(router_result)]
+            messages, result = self._plan_answer(user_message, actions)
+        elif intent == "sql" and sql_query:
+            with span("sql") as attrs, upstream_limiter("sqlite").slot() as waited:
+                attrs["queue_ms"] = round(waited * 1000, 2)
+                sql_result = run_select_query(sql_query)
+                attrs["error_code"] = sql_result.get("error_code")
+            logger.debug("Se ejecutó el SQL")
+            messages, result = self._sql_answer(user_message, sql_query, sql_result)
+        elif intent == "web" and web_query:
+            #Aquí lanzamos petición a búsqueda en API Tavily
+            with span("web_search"):
+                web_result = self.web_client.search(web_query)
+            messages, result = self._web_answer(user_message, web_query, web_result)
+        else: # Fallback
+            messages, result = self._llm_answer(user_message)
+
+        return self._with_routing(router_result, messages, result)
+
+    async def _aprepare_from(
+        self,
+        user_message: str,
+        router_result: Dict[str, Any],
+        speculation: Optional[Speculation] = None,
+    ) -> Tuple[Optional[List[Dict[str, str]]], Dict[str, Any]]:
+        """
+        Versión async de _prepare_from(). SQLite no tiene API async, así que
+        el query se ejecuta en un hilo aparte. Si hay una búsqueda web
+        especulativa en curso con el mismo query que pidió el router, se
+        reutiliza en lugar de lanzar otra. Las
+        acciones de un plan corren todas a la vez.
+        """
+        intent, sql_query, web_query = self._parse_router_result(router_result)
+
+        if intent == "plan":
+            actions = await asyncio.gather(*(
+                self._arun_action(kind, query) for kind, query in self._plan_actions(router_result)
+            ))
+            messages, result = self._plan_answer(user_message, actions)
+        elif intent == "sql" and sql_query:
+            with span("sql") as attrs:
+                # En un batch, el mismo SQL de otra pregunta se reutiliza
+                sql_result = dict(await shared(("sql", sql_query), lambda: self._arun_sql(sql_query, attrs)))
+                attrs["error_code"] = sql_result.get("error_code")
+            logger.debug("Se ejecutó el SQL")
+            messages, result = self._sql_answer(user_message, sql_query, sql_result)
+        elif intent == "web" and web_query:
+            web_result = None
+            web_task = None
+            # La búsqueda especulativa usó el mensaje tal cual: solo sirve si
+            # el router pidió lo mismo; si no, se cancela al cerrar la especulación
+            if speculation and normalize_text(web_query) == normalize_text(user_message):
+                web_task = speculation.take("web")
+            if web_task is not None:
+                try:
+                    with span("web_search", speculative=True):
+                        web_result = await web_task
+                except Exception as e:
+                    logger.warning("Falló la búsqueda web especulativa: %s", e)
+
+            if web_result is None:
+                with span("web_search"):
+                    web_result = await self.web_client.asearch(web_query)
+            messages, result = self._web_answer(user_message, web_query, web_result)
+        else: # Fallback
+            messages, result = self._llm_answer(user_message)
+
+        return self._with_routing(router_result, messages, result)
+
+    async def _arun_sql(self, sql_query: str, attrs: Dict[str, Any]) -> Dict[str, Any]:
+        async with upstream_limiter("sqlite").aslot() as waited:
+            attrs["queue_ms"] = round(waited * 1000, 2)
+            return await asyncio.to_thread(run_select_query, sql_query)
+
+    # ---------------------------
+    # PLANES DE VARIAS ACCIONES
+    # ---------------------------
+
+    def _plan_actions(self, router_result: Dict[str, Any]) -> List[Tuple[str, str]]:
+        """
+        Acciones del plan como (tipo, query), sin repetidas y alternando
+        SQL y web, hasta ROUTER_MAX_ACTIONS.
+        """
+        def queries(field: str) -> List[str]:
+            values = router_result.get(field)
+            if not isinstance(values, list):
+                return []
+            return [v.strip() for v in values if isinstance(v, str) and v.strip()]
+
+        sql = [("sql", q) for q in queries("sql_queries")]
+        web = [("web", q) for q in queries("web_queries")]
+        actions = list(dict.fromkeys(a for a in chain.from_iterable(zip_longest(sql, web)) if a is not None))
+        return actions[:max(1, ROUTER_MAX_ACTIONS)]
+
+    def _run_action(self, kind: str, query: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        action = {"type": kind, "query": query, "result": None, "error": None}
+        try:
+            if kind == "sql":
+                with span("sql", plan=True) as attrs, upstream_limiter("sqlite").slot() as waited:
+                    attrs["queue_ms"] = round(waited * 1000, 2)
+                    action["result"] = run_select_query(query)
+                    attrs["error_code"] = action["result"].get("error_code")
+            else:
+                with span("web_search", plan=True):
+                    action["result"] = self.web_client.search(query)
+        except Exception as e:
+            logger.warning("Falló la acción %s del plan: %s", kind, e)
+            action["error"] = str(e)
+        action["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return action
+
+    async def _arun_action(self, kind: str, query: str) -> Dict[str, Any]:
+        """
+        Versión async de _run_action(), con tope de PLAN_ACTION_TIMEOUT: una
+        acción lenta o caída no frena la respuesta, que sale con las demás.
+        """
+        started = time.perf_counter()
+        action = {"type": kind, "query": query, "result": None, "error": None}
+        try:
+            if kind == "sql":
+                with span("sql", plan=True) as attrs:
+                    sql_result = await asyncio.wait_for(
+                        shared(("sql", query), lambda: self._arun_sql(query, attrs)),
+                        PLAN_ACTION_TIMEOUT,
+                    )
+                    action["result"] = dict(sql_result)
+                    attrs["error_code"] = sql_result.get("error_code")
+            else:
+                with span("web_search", plan=True):
+                    action["result"] = await asyncio.wait_for(self.web_client.asearch(query), PLAN_ACTION_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("La acción %s del plan pasó de %s s", kind, PLAN_ACTION_TIMEOUT)
+            action["error"] = f"Sin respuesta en {PLAN_ACTION_TIMEOUT:g} s"
+        except Exception as e:
+            logger.warning("Falló la acción %s del plan: %s", kind, e)
+            action["error"] = str(e)
+        action["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return action
+
+    def _with_routing(self, router_result: Dict[str, Any], messages: List[Dict[str, str]], result: Dict[str, Any]) -> Tuple[Optional[List[Dict[str, str]]], Dict[str, Any]]:
+        # Modo inline: si el router ya respondió, no hace falta otra llamada
+        answer = (router_result.get("answer") or "").strip()
+        if result["intent"] == "llm" and answer and router_result.get("source") == "llm":
+            result["reply"] = answer
+            messages = None
+
+        if router_result.get("source") in ("fast_path", "batch"):
+            path = router_result["source"]
+        elif messages is None:
+            path = "inline"
+        else:
+            path = "two_call"
+
+        result["routing"] = self._routing_info(router_result, path)
+        return messages, result
+
+    def _inline_result(self, user_message: str) -> Dict[str, Any]:
+        """
+        Resultado de una respuesta que llega dentro del JSON del router.
+        """
+        _, result = self._llm_answer(user_message)
+        result["routing"] = self._routing_info({"source": "llm"}, "inline")
+        return result
+
+    # ---------------------------
+    # EJECUCIÓN ESPECULATIVA
+    # ---------------------------
+
+    def _start_speculation(self, user_message: str, router_result: Optional[Dict[str, Any]], stream: bool) -> Optional[Speculation]:
+        """
+        Lanza las ramas de SPECULATIVE_BRANCHES en paralelo con la llamada
+        al router. No especula si el fast path ya decidió o si ya hay
+        SPECULATIVE_MAX_INFLIGHT peticiones especulando.
+        """
+        if router_result is not None or not SPECULATIVE_BRANCHES:
+            return None
+        if self._speculating >= SPECULATIVE_MAX_INFLIGHT:
+            return None
+
+        speculation = Speculation()
+
+        # En modo inline el propio router ya trae la respuesta directa
+        if "llm" in SPECULATIVE_BRANCHES and ROUTER_MODE != "inline_answer":
+            messages, _ = self._llm_answer(user_message)
+            llm = self.stage_llms["llm_answer"]
+            if stream:
+                speculation.start_stream("llm", llm.achat_stream(messages))
+            else:
+                speculation.start_task("llm", llm.achat(messages))
+
+        if "web" in SPECULATIVE_BRANCHES:
+            speculation.start_task("web", self.web_client.asearch(user_message))
+
+        if not speculation.branches:
+            return None
+
+        self._speculating += 1
+        return speculation
+
+    def _take_llm_branch(self, speculation: Optional[Speculation], result: Dict[str, Any]):
+        if speculation is None or result["intent"] != "llm":
+            return None
+        return speculation.take("llm")
+
+    def _close_speculation(self, speculation: Optional[Speculation], result: Optional[Dict[str, Any]]) -> None:
+        """
+        Cancela las ramas que no se usaron y registra cuáles se aprovecharon.
+        """
+        if speculation is None:
+            return
+
+        self._speculating -= 1
+        outcome = speculation.cancel()
+        self.stats.record_speculation(outcome)
+
+        if result is not None and "routing" in result:
+            result["routing"]["speculative"] = [name for name, used in outcome.items() if used]
+
+    def _fast_path(self, user_message: str) -> Optional[Dict[str, Any]]:
+        """
+        Intenta clasificar sin LLM. Solo se usa para "llm" y "web", donde no
+        hace falta generar nada (la búsqueda web usa el propio mensaje);
+        "sql" siempre necesita al LLM para escribir el query.
+        """
+        if not ROUTER_FAST_PATH_ENABLED:
+            return None
+
+        prediction = self.classifier.classify(user_message)
+        if (
+            prediction["intent"] in ("llm", "web")
+            and prediction["confidence"] >= ROUTER_FAST_PATH_MIN_CONFIDENCE
+        ):
+            prediction["source"] = "fast_path"
+            return prediction
+
+        return None
+
+    def _routing_info(self, router_result: Dict[str, Any], path: str) -> Dict[str, Any]:
+        return {
+            "source": router_result.get("source", "llm"),
+            "confidence": router_result.get("confidence"),
+            "mode": ROUTER_MODE,
+            "path": path,
+        }
+
+    def _router_messages(self, user_message: str) -> List[Dict[str, str]]:
+        if ROUTER_MODE == "inline_answer":
+            system_prompt = ROUTER_PLAN_INLINE_ANSWER_SYSTEM_PROMPT if ROUTER_MAX_ACTIONS > 1 else ROUTER_INLINE_ANSWER_SYSTEM_PROMPT
+        else:
+            system_prompt = ROUTER_PLAN_SYSTEM_PROMPT if ROUTER_MAX_ACTIONS > 1 else ROUTER_SYSTEM_PROMPT
+
+        user_content = ROUTER_USER_TEMPLATE.format(
+            schema=self.schema.prune(user_message),
+            message=user_message,
+        )
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content},
+        ]
+
+    def _router_batch_messages(self, user_messages: List[str]) -> List[Dict[str, str]]:
+        user_content = ROUTER_BATCH_USER_TEMPLATE.format(
+            # Un solo esquema para todas: el recorte de la unión de los mensajes
+            schema=self.schema.prune("\n".join(user_messages)),
+            messages="\n".join(f"[{i}] {' '.join(message.split())}" for i, message in enumerate(user_messages)),
+        )
+
+        return [
+            {"role": "system", "content": ROUTER_BATCH_SYSTEM_PROMPT},
+            {"role": "user", "content": user_content},
+        ]
+
+    def _parse_router_result(self, router_result: Dict[str, Any]) -> Tuple[str, str, str]:
 
         intent = router_result.get("intent", "llm")
         sql_query = router_result.get("sql_query", "") or ""
         web_query = router_result.get("web_query", "") or ""
 
-        print(f"""🤖 Petición al LLM - Ejecutando tarea [{intent}].""")
+        if intent == "plan":
+            # Un plan de una sola acción es una pregunta normal
+            actions = self._plan_actions(router_result)
+            if len(actions) == 1:
+                intent, query = actions[0]
+                sql_query, web_query = (query, "") if intent == "sql" else ("", query)
+            elif not actions:
+                intent = "llm"
 
-        # 2) Según la intención, actuamos:
-        if intent == "sql" and sql_query:
-            return self._handle_sql(user_message, sql_query)
-        elif intent == "web" and web_query:
-            return self._handle_web(user_message, web_query)
-        else: # Fallback
-            return self._handle_llm(user_message)
-
-    def _handle_sql(self, user_message: str, sql_query: str) -> Dict[str, Any]:
-        
-        # Aquí lanzamos la petición al cliente SQL
-        sql_result = run_select_query(sql_query)
-        print(f"Se ejecuto el SQL")
-        
-        # Construimos una respuesta amigable usando el LLM
-        system_prompt = LLM_ANSWER_SYSTEM_PROMPT_SQL.format(            
+        logger.debug("Ejecutando tarea [%s]", intent)
+
+        return intent, sql_query, web_query
+
+    # ---------------------------
+    # PROMPTS DE RESPUESTA
+    # ---------------------------
+
+    def _sql_answer(self, user_message: str, sql_query: str, sql_result: Dict[str, Any]) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+
+        # Construimos los mensajes para una respuesta amigable usando el LLM
+        # Resumimos el resultado para que el prompt no crezca con el número de filas
+        system_prompt = LLM_ANSWER_SYSTEM_PROMPT_SQL.format(
             sql_query=sql_query,
-            sql_result=sql_result
+            sql_result=summarize_sql_result(sql_result)
             )
 
         messages = [
-            {"role": "system", "content": system_prompt},            
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_message},
         ]
-        
-        reply_text = self.llm.chat(messages=messages)
 
-        return {
+        return messages, {
             "intent": "sql",
-            "reply": reply_text,
             "sql_query": sql_query,
             "sql_result": sql_result,
             "web_query": None,
             "web_raw_result": None,
         }
 
-    def _handle_web(self, user_message: str, web_query: str) -> Dict[str, Any]:
-        
-        #Aquí lanzamos petición a búsqueda en API Tavily
-        web_result = self.web_client.search(web_query)
+    def _web_answer(self, user_message: str, web_query: str, web_result: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
 
-        system_prompt = LLM_ANSWER_SYSTEM_PROMPT_WEB.format(            
+        system_prompt = LLM_ANSWER_SYSTEM_PROMPT_WEB.format(
             web_query=web_query,
-            web_result=web_result
+            web_result=format_web_context(web_result)
             )
 
         messages = [
@@ -96,27 +953,55 @@ class AgentRouter:
             {"role": "user", "content": user_message},
         ]
 
-        reply_text = self.llm.chat(messages)
-
-        return {
+        return messages, {
             "intent": "web",
-            "reply": reply_text,
             "sql_query": None,
             "sql_result": None,
             "web_query": web_query,
             "web_raw_result": web_result,
         }
 
-    def _handle_llm(self, user_message: str) -> Dict[str, Any]:
+    def _plan_answer(self, user_message: str, actions: List[Dict[str, Any]]) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+
+        # El presupuesto del resumen SQL se reparte entre los queries del plan
+        sql_count = sum(1 for action in actions if action["type"] == "sql")
+        token_budget = max(200, SQL_SUMMARY_TOKEN_BUDGET // max(1, sql_count))
+
+        blocks = []
+        for n, action in enumerate(actions, start=1):
+            if action["error"]:
+                body = f"Falló: {action['error']}"
+            elif action["type"] == "sql":
+                body = summarize_sql_result(action["result"], token_budget)
+            else:
+                body = format_web_context(action["result"])
+            label = "Query SQL" if action["type"] == "sql" else "Búsqueda web"
+            blocks.append(f"{n}) {label}:\n{action['query']}\n\nResultado:\n{body}")
+
+        system_prompt = LLM_ANSWER_SYSTEM_PROMPT_PLAN.format(actions="\n\n".join(blocks))
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message},
+        ]
+
+        return messages, {
+            "intent": "plan",
+            "sql_query": None,
+            "sql_result": None,
+            "web_query": None,
+            "web_raw_result": None,
+            "actions": actions,
+        }
+
+    def _llm_answer(self, user_message: str) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
         messages = [
             {"role": "system", "content": "Eres un asistente útil y claro. Responde en español, de forma concisa y didáctica."},
             {"role": "user", "content": user_message},
         ]
-        reply_text = self.llm.chat(messages)
 
-        return {
+        return messages, {
             "intent": "llm",
-            "reply": reply_text,
             "sql_query": None,
             "sql_result": None,
             "web_query": None,
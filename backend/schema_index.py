@@ -0,0 +1,252 @@
+# backend/schema_index.py
+"""
+Esquema de la base de datos para el prompt del router.
+Se lee de SQLite al arrancar (tablas, columnas, tipos y algunos valores de
+ejemplo) y, para cada mensaje, se recorta a las tablas y columnas que
+parecen relevantes por coincidencia de palabras. Un prompt más corto se
+procesa (prefill) más rápido en el modelo local.
+
+Si la base no se puede leer, se usa DB_SCHEMA_DESCRIPTION completo.
+"""
+
+import logging
+import sqlite3
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set
+
+from .config import (
+    SCHEMA_PRUNING_ENABLED,
+    SCHEMA_SAMPLE_ROWS,
+    SCHEMA_SAMPLE_VALUES,
+    SCHEMA_ENUM_MAX_VALUES,
+)
+from .db_client import get_pool
+from .intent_classifier import normalize_text
+from .prompts import DB_SCHEMA_DESCRIPTION
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_HEADER = "Tienes acceso de solo lectura a una base de datos SQLite con estas tablas:"
+
+# Palabras del mensaje que no dicen nada sobre el esquema
+STOPWORDS = {
+    "los", "las", "del", "por", "que", "con", "una", "uno", "son", "hay",
+    "para", "cual", "cuales", "como", "cuantos", "cuantas", "tiene", "tienen",
+    "entre", "sus", "mas", "este", "esta", "estos", "estas", "cada", "todos",
+    "todas", "dame", "muestra", "lista",
+}
+
+# Dos palabras coinciden si son iguales o comparten un prefijo de esta
+# longitud ("colaboradores" ~ "colaborador_asignado")
+MIN_PREFIX = 5
+MAX_VALUE_CHARS = 40
+
+
+def _tokens(text: str) -> Set[str]:
+    words = normalize_text(text.replace("_", " ")).split()
+    return {w for w in words if len(w) >= 3 and w not in STOPWORDS}
+
+
+def _matches(word: str, token: str) -> bool:
+    if word == token:
+        return True
+    return len(word) >= MIN_PREFIX and len(token) >= MIN_PREFIX and word[:MIN_PREFIX] == token[:MIN_PREFIX]
+
+
+def _score(words: Set[str], tokens: Set[str]) -> int:
+    return sum(1 for token in tokens if any(_matches(word, token) for word in words))
+
+
+class SchemaIndex:
+    """
+    `tables` es {tabla: [columna, ...]} y cada columna un dict con
+    name, type, values (ejemplos) y exhaustive (si values son todos los
+    valores posibles). Sin tablas (no se pudo leer la base) se usa
+    `fallback` tal cual.
+    """
+
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]], fallback: str = DB_SCHEMA_DESCRIPTION):
+        self.tables = tables
+        self.fallback = fallback
+
+        # Palabras de cada tabla y columna, para el recorte por mensaje.
+        # En las columnas se quitan las palabras de los nombres de tabla
+        # ("motivo_ticket"): mencionar la tabla no hace relevante la columna.
+        self._table_tokens = {table: _tokens(table) for table in tables}
+        table_words = set().union(*self._table_tokens.values()) if tables else set()
+        self._column_tokens = {
+            (table, col["name"]): (
+                {t for t in _tokens(col["name"]) if not any(_matches(w, t) for w in table_words)},
+                _tokens(" ".join(col["values"])),
+            )
+            for table, columns in tables.items()
+            for col in columns
+        }
+
+        self.description = self.describe() if tables else fallback
+
+    def describe(
+        self,
+        selected: Optional[Dict[str, Optional[Set[str]]]] = None,
+        examples: bool = True,
+    ) -> str:
+        """
+        Texto del esquema. `selected` es {tabla: columnas a detallar}
+        (None = todas); las tablas que no están solo se mencionan.
+        """
+        if not self.tables:
+            return self.fallback
+
+        selected = selected or {table: None for table in self.tables}
+        lines = [SCHEMA_HEADER, ""]
+
+        for table, columns in self.tables.items():
+            if table not in selected:
+                continue
+
+            wanted = selected[table]
+            lines.append(f"Tabla {table}:")
+            others = []
+            for col in columns:
+                if wanted is not None and col["name"] not in wanted:
+                    others.append(col["name"])
+                    continue
+                lines.append(self._column_line(col, examples))
+
+            if others:
+                lines.append(f"- (otras columnas: {', '.join(others)})")
+            lines.append("")
+
+        omitted = [table for table in self.tables if table not in selected]
+        if omitted:
+            lines.append(f"Otras tablas: {', '.join(omitted)}")
+
+        return "\n".join(lines).strip()
+
+    def _column_line(self, col: Dict[str, Any], examples: bool) -> str:
+        line = f"- {col['name']} {col['type']}".rstrip()
+        if col["values"] and (col["exhaustive"] or examples):
+            label = "valores" if col["exhaustive"] else "ejemplos"
+            values = ", ".join(f'"{v}"' for v in col["values"])
+            line += f" ({label} {values})"
+        return line
+
+    def prune(self, message: str) -> str:
+        """
+        Esquema recortado a lo que menciona el mensaje. Si no se reconoce
+        ninguna tabla ni columna, se manda completo.
+        """
+        if not self.tables or not SCHEMA_PRUNING_ENABLED:
+            return self.description
+
+        words = _tokens(message)
+        table_scores: Counter = Counter()
+        column_hits: Dict[str, Set[str]] = {}
+
+        for (table, column), (name_tokens, value_tokens) in self._column_tokens.items():
+            score = 2 * _score(words, name_tokens) + _score(words, value_tokens)
+            if score:
+                table_scores[table] += score
+                column_hits.setdefault(table, set()).add(column)
+
+        for table, tokens in self._table_tokens.items():
+            if _score(words, tokens):
+                table_scores[table] += 3
+
+        if not table_scores:
+            return self.description
+
+        selected: Dict[str, Optional[Set[str]]] = {}
+        for table in table_scores:
+            hits = column_hits.get(table)
+            if not hits:
+                # Solo se mencionó la tabla: no sabemos qué columnas hacen falta
+                selected[table] = None
+                continue
+            # Primera columna (identificador) y columnas compartidas para los JOIN
+            selected[table] = hits | {self.tables[table][0]["name"]} | self._join_columns(table, table_scores)
+
+        return self.describe(selected)
+
+    def _join_columns(self, table: str, tables: Counter) -> Set[str]:
+        names = {col["name"] for col in self.tables[table]}
+        shared = set()
+        for other in tables:
+            if other != table:
+                shared |= names & {col["name"] for col in self.tables[other]}
+        return shared
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "source": "database" if self.tables else "static",
+            "tables": len(self.tables),
+            "columns": sum(len(columns) for columns in self.tables.values()),
+            "pruning": SCHEMA_PRUNING_ENABLED,
+        }
+
+
+# ---------------------------
+# INTROSPECCIÓN
+# ---------------------------
+
+def _sample_values(values: List[Any]) -> Dict[str, Any]:
+    """
+    Valores de ejemplo de una columna de texto. Si hay pocos valores
+    distintos y se repiten mucho, se asume que es una lista cerrada
+    (por ejemplo un estatus) y se mandan todos.
+    """
+    present = [
+        v for v in values
+        if isinstance(v, str) and len(v.strip()) > 1 and '"' not in v and len(v) <= MAX_VALUE_CHARS
+    ]
+    counts = Counter(present)
+
+    if counts and len(counts) <= SCHEMA_ENUM_MAX_VALUES and len(present) >= 5 * len(counts):
+        return {"values": sorted(counts), "exhaustive": True}
+
+    return {
+        "values": [v for v, _ in counts.most_common(SCHEMA_SAMPLE_VALUES)],
+        "exhaustive": False,
+    }
+
+
+def introspect_schema(conn: sqlite3.Connection) -> Dict[str, List[Dict[str, Any]]]:
+    tables: Dict[str, List[Dict[str, Any]]] = {}
+    names = [
+        row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name NOT LIKE 'sqlite_%' ORDER BY rowid"
+        )
+    ]
+
+    for table in names:
+        info = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+        # Muestra acotada: no recorremos tablas grandes completas al arrancar
+        sample = conn.execute(f'SELECT * FROM "{table}" LIMIT ?', (SCHEMA_SAMPLE_ROWS,)).fetchall()
+
+        columns = []
+        for i, (_, name, col_type, *_) in enumerate(info):
+            col_type = (col_type or "").upper()
+            column = {"name": name, "type": col_type, "values": [], "exhaustive": False}
+            if col_type in ("", "TEXT") or "CHAR" in col_type:
+                column.update(_sample_values([row[i] for row in sample]))
+            columns.append(column)
+
+        tables[table] = columns
+
+    return tables
+
+
+def load_schema_index() -> SchemaIndex:
+    """
+    Lee el esquema de la base configurada. Si falla (no existe la base,
+    está bloqueada...), se usa el esquema escrito a mano.
+    """
+    try:
+        with get_pool().connection() as conn:
+            tables = introspect_schema(conn)
+    except sqlite3.Error as e:
+        logger.warning("No se pudo leer el esquema de la base, se usa el estático: %s", e)
+        tables = {}
+
+    return SchemaIndex(tables)
@@ -0,0 +1,99 @@
+# backend/speculation.py
+"""
+Ejecución especulativa: mientras el router decide la intención, se lanzan
+en paralelo las ramas más probables (respuesta directa del LLM y/o
+búsqueda web con el mensaje original). Cuando el router termina se usa la
+rama que coincide y las demás se cancelan.
+
+Cancelar una tarea cierra su conexión HTTP; el servidor del LLM detecta la
+desconexión y libera el slot de generación.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional
+
+_END = object()
+
+
+def _discard_result(task: asyncio.Task) -> None:
+    # Evita el aviso "Task exception was never retrieved" en ramas descartadas
+    if not task.cancelled():
+        task.exception()
+
+
+class SpeculativeStream:
+    """
+    Consume un stream de tokens en segundo plano y los guarda hasta que
+    alguien los pida. Si nadie los pide, cancel() cierra el stream.
+    """
+
+    def __init__(self, stream: AsyncIterator[str]):
+        self._stream = stream
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._pump())
+        self.task.add_done_callback(_discard_result)
+
+    async def _pump(self) -> None:
+        try:
+            async for token in self._stream:
+                self._queue.put_nowait(token)
+        except Exception as e:
+            self._queue.put_nowait(e)
+        finally:
+            # Cerrar el generador cierra la conexión HTTP del stream
+            await self._stream.aclose()
+            self._queue.put_nowait(_END)
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.cancel()
+
+    def cancel(self) -> None:
+        self.task.cancel()
+
+
+class Speculation:
+    """
+    Conjunto de ramas especulativas de una petición.
+    Cada rama es una tarea (asyncio.Task) o un SpeculativeStream.
+    """
+
+    def __init__(self):
+        self.branches: Dict[str, Any] = {}
+        self.used = []
+
+    def start_task(self, name: str, coro) -> None:
+        task = asyncio.create_task(coro)
+        task.add_done_callback(_discard_result)
+        self.branches[name] = task
+
+    def start_stream(self, name: str, stream: AsyncIterator[str]) -> None:
+        self.branches[name] = SpeculativeStream(stream)
+
+    def take(self, name: str) -> Optional[Any]:
+        """
+        Saca la rama `name` (para que no se cancele) y la marca como usada.
+        """
+        branch = self.branches.pop(name, None)
+        if branch is not None:
+            self.used.append(name)
+        return branch
+
+    def cancel(self) -> Dict[str, bool]:
+        """
+        Cancela las ramas que no se usaron. Devuelve {rama: se_usó}.
+        """
+        outcome = {name: True for name in self.used}
+        for name, branch in self.branches.items():
+            branch.cancel()
+            outcome[name] = False
+        self.branches.clear()
+        return outcome
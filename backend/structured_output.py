@@ -0,0 +1,100 @@
+# backend/structured_output.py
+"""
+Salida estructurada (decodificación restringida) para las respuestas JSON.
+A partir de un JSON Schema se arma lo que pide cada proveedor:
+- OpenAI-like (LM Studio, llama.cpp, vLLM): response_format json_schema
+- llama.cpp: gramática GBNF equivalente
+- OpenAI (Responses): text.format json_schema
+- Gemini: response_schema
+
+Así el modelo solo puede generar un JSON válido con los campos en el
+orden del esquema, y _extract_json casi nunca tiene que limpiar nada.
+Soporta objetos planos con campos string (opcionalmente con enum) o
+listas de strings, que es lo que usa el router.
+"""
+
+import json
+from typing import Any, Dict
+
+# Un string JSON: caracteres normales o secuencias de escape
+GBNF_STRING = (
+    'string ::= "\\"" ( [^"\\\\\\x7F\\x00-\\x1F] | "\\\\" '
+    '( ["\\\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] ) )* "\\""'
+)
+# Espacio acotado: sin esto el modelo podría generar espacios sin fin
+GBNF_WS = 'ws ::= | " " | "\\n" | "\\n  "'
+GBNF_STRING_LIST = 'string-list ::= "[" ws ( string ws ( "," ws string ws )* )? "]"'
+
+
+def _gbnf_literal(text: str) -> str:
+    # Literal GBNF que produce exactamente `text` (ya codificado como JSON)
+    return json.dumps(text)
+
+
+def json_schema_to_gbnf(schema: Dict[str, Any]) -> str:
+    """
+    Gramática GBNF para un objeto con campos string (o listas de strings)
+    en orden fijo.
+    """
+    rules = []
+    parts = ['"{" ws']
+
+    for i, (name, prop) in enumerate(schema["properties"].items()):
+        is_list = prop.get("type") == "array" and prop.get("items", {}).get("type") == "string"
+        if prop.get("type") != "string" and not is_list:
+            raise ValueError(f"Tipo no soportado en la gramática: {name} -> {prop.get('type')}")
+
+        if i:
+            parts.append('"," ws')
+        parts.append(f'{_gbnf_literal(json.dumps(name))} ws ":" ws')
+
+        if is_list:
+            parts.append("string-list ws")
+        elif "enum" in prop:
+            rule = f"{name.replace('_', '-')}-value"
+            options = " | ".join(_gbnf_literal(json.dumps(v)) for v in prop["enum"])
+            rules.append(f"{rule} ::= {options}")
+            parts.append(f"{rule} ws")
+        else:
+            parts.append("string ws")
+
+    parts.append('"}" ws')
+    return "\n".join([f"root ::= {' '.join(parts)}"] + rules + [GBNF_STRING, GBNF_STRING_LIST, GBNF_WS])
+
+
+def lmstudio_response_format(schema: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": schema.get("title", "response"),
+            "strict": True,
+            "schema": schema,
+        },
+    }
+
+
+def openai_text_format(schema: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "format": {
+            "type": "json_schema",
+            "name": schema.get("title", "response"),
+            "strict": True,
+            "schema": schema,
+        }
+    }
+
+
+def gemini_response_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Gemini usa un subconjunto de OpenAPI: sin additionalProperties ni
+    title, y el orden de los campos va en propertyOrdering.
+    """
+    return {
+        "type": "object",
+        "properties": {
+            name: {k: v for k, v in prop.items() if k in ("type", "enum", "description", "items")}
+            for name, prop in schema["properties"].items()
+        },
+        "required": list(schema.get("required", [])),
+        "propertyOrdering": list(schema["properties"]),
+    }
@@ -0,0 +1,242 @@
+# backend/traffic_recorder.py
+"""
+Grabación de tráfico real (opcional, con TRAFFIC_RECORD_PATH).
+Cada petición al router se agrega como una línea JSON a un log NDJSON:
+el mensaje, la decisión de ruteo, el SQL, las respuestas de Tavily y las
+salidas del LLM, con sus tiempos. bench/replay.py reproduce el log contra
+el backend sirviendo Tavily y el LLM desde lo grabado, para perfilar
+cambios con la mezcla real de preguntas y sin servicios externos.
+
+La grabación activa vive en un ContextVar (como la traza de metrics.py):
+las llamadas al LLM y a Tavily que ocurren durante la petición, incluidas
+las de ramas especulativas, se agregan a ella.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from .config import TRAFFIC_RECORD_PATH, TRAFFIC_RECORD_SAMPLE_RATE, TRAFFIC_RECORD_MAX_MB
+from .metrics import current_trace, tracing
+
+logger = logging.getLogger(__name__)
+
+# Versión del formato de cada línea
+RECORD_VERSION = 1
+
+
+def prompt_hash(messages: List[Dict[str, str]]) -> str:
+    """
+    Huella de los mensajes de una llamada al LLM. El replay la calcula
+    igual sobre lo que recibe el servidor falso para encontrar la salida.
+    """
+    pairs = [[m.get("role", ""), m.get("content") or ""] for m in messages]
+    return hashlib.sha1(json.dumps(pairs, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+class Recording:
+    """
+    Lo que ocurrió en una petición, hasta escribirlo en el log.
+    """
+
+    def __init__(self, message: str):
+        self.message = message
+        self.at = time.time()
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.llm_calls: List[Dict[str, Any]] = []
+        self.web_searches: List[Dict[str, Any]] = []
+        self.result: Optional[Dict[str, Any]] = None
+
+    def add(self, target: List[Dict[str, Any]], item: Dict[str, Any]) -> None:
+        with self._lock:
+            target.append(item)
+
+    def to_dict(self, spans: List[Dict[str, Any]], error: Optional[str]) -> Dict[str, Any]:
+        result = self.result or {}
+        sql_result = result.get("sql_result")
+
+        record = {
+            "v": RECORD_VERSION,
+            "at": round(self.at, 3),
+            "message": self.message,
+            "total_ms": _ms(time.perf_counter() - self.started),
+            "intent": result.get("intent"),
+            "cached": bool(result.get("cached")),
+            "routing": result.get("routing"),
+            "sql_query": result.get("sql_query"),
+            "web_query": result.get("web_query"),
+            "reply": result.get("reply"),
+            "llm_calls": self.llm_calls,
+            "web_searches": self.web_searches,
+            "spans": spans,
+        }
+        if isinstance(sql_result, dict):
+            # Solo la forma del resultado: el replay vuelve a correr el SQL
+            record["sql_result"] = {
+                "columns": sql_result.get("columns"),
+                "rows": len(sql_result.get("rows") or []),
+                "total_rows": sql_result.get("total_rows"),
+                "truncated": sql_result.get("truncated"),
+                "error_code": sql_result.get("error_code"),
+            }
+        if error:
+            record["error"] = error
+        return record
+
+
+class TrafficRecorder:
+    """
+    Escritor del log: una línea JSON compacta por petición, agregada al
+    final del archivo bajo un lock (las peticiones terminan en paralelo).
+    """
+
+    def __init__(self, path: str, sample_rate: float = 1.0, max_mb: float = 0):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = int(max_mb * 1_000_000)
+        self._lock = threading.Lock()
+        self._file = None
+        self._full = False
+        self.written = 0
+        self.dropped = 0
+
+    def sampled(self) -> bool:
+        return not self._full and (self.sample_rate >= 1 or random.random() < self.sample_rate)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+        with self._lock:
+            if self._full:
+                self.dropped += 1
+                return
+            if self._file is None:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+            self.written += 1
+
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._full = True
+                logger.warning("Log de tráfico %s llegó a su tamaño máximo; se deja de grabar", self.path)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "path": self.path,
+                "sample_rate": self.sample_rate,
+                "written": self.written,
+                "dropped": self.dropped,
+                "full": self._full,
+            }
+
+
+_recorder = (
+    TrafficRecorder(TRAFFIC_RECORD_PATH, TRAFFIC_RECORD_SAMPLE_RATE, TRAFFIC_RECORD_MAX_MB)
+    if TRAFFIC_RECORD_PATH else None
+)
+_current_recording: ContextVar[Optional[Recording]] = ContextVar("agent_recording", default=None)
+
+
+def get_traffic_recorder() -> Optional[TrafficRecorder]:
+    return _recorder
+
+
+@contextmanager
+def recording(message: str) -> Iterator[Optional[Recording]]:
+    """
+    Graba la petición hecha dentro del bloque (si la grabación está
+    activa y la petición sale en la muestra). Los tiempos por etapa salen
+    de la traza de la petición; si no se pidió una, se abre aquí.
+    """
+    if _recorder is None or not _recorder.sampled():
+        yield None
+        return
+
+    rec = Recording(message)
+    token = _current_recording.set(rec)
+    error = None
+    try:
+        with tracing(current_trace() is None) as own_trace:
+            trace = own_trace or current_trace()
+            try:
+                yield rec
+            except BaseException as e:
+                error = type(e).__name__
+                raise
+            finally:
+                spans = trace.to_dict()["spans"] if trace is not None else []
+                try:
+                    _recorder.write(rec.to_dict(spans, error))
+                except (OSError, TypeError, ValueError) as e:
+                    logger.warning("No se pudo grabar la petición: %s", e)
+    finally:
+        try:
+            _current_recording.reset(token)
+        except ValueError:
+            # Igual que en metrics.tracing: un stream cerrado desde otra tarea
+            pass
+
+
+def record_result(result: Dict[str, Any]) -> None:
+    """
+    Resultado final de la petición (intención, SQL, respuesta).
+    """
+    rec = _current_recording.get()
+    if rec is not None:
+        # Copia: los streams sacan "reply" del dict antes de mandarlo
+        rec.result = dict(result)
+
+
+def record_llm_call(
+    stage: str,
+    messages: List[Dict[str, str]],
+    output: str,
+    started: float,
+    attrs: Dict[str, Any],
+    status: str,
+) -> None:
+    """
+    Una llamada al LLM. `attrs` son los atributos de su span (espera de
+    turno y primer token). `status` es "ok", "error" o "cancelled" (ramas
+    especulativas descartadas o streams cortados antes de terminar).
+    """
+    rec = _current_recording.get()
+    if rec is None:
+        return
+    rec.add(rec.llm_calls, {
+        "stage": stage,
+        "prompt_hash": prompt_hash(messages),
+        "output": output,
+        "queue_ms": attrs.get("queue_ms"),
+        "first_token_ms": attrs.get("first_token_ms"),
+        "duration_ms": _ms(time.perf_counter() - started),
+        "status": status,
+    })
+
+
+def record_web_search(query: str, response: Dict[str, Any], started: float) -> None:
+    """
+    Respuesta cruda de Tavily a una búsqueda (antes de filtrar y elegir pasajes).
+    """
+    rec = _current_recording.get()
+    if rec is None:
+        return
+    rec.add(rec.web_searches, {
+        "query": query,
+        "response": response,
+        "duration_ms": _ms(time.perf_counter() - started),
+    })
@@ -0,0 +1,222 @@
+# backend/web_cache.py
+"""
+Caché de búsquedas web.
+La llave es la consulta normalizada (minúsculas, sin acentos ni
+puntuación). Varias peticiones con la misma consulta al mismo tiempo se
+agrupan: solo una llama a Tavily y las demás esperan su resultado.
+Así se ahorra latencia y cuota de la API cuando varios usuarios preguntan
+por la misma noticia.
+"""
+
+import asyncio
+import copy
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from .intent_classifier import normalize_text
+from .metrics import UPSTREAM_ERRORS, UPSTREAM_SECONDS, record_cache
+
+WebResults = List[Dict[str, str]]
+
+
+class _Pending:
+    """
+    Búsqueda síncrona en curso: los demás hilos esperan el evento.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Optional[WebResults] = None
+        self.error: Optional[BaseException] = None
+
+
+class WebSearchCache:
+    """
+    Caché LRU acotada por tamaño y con TTL. `ttl` 0 desactiva el
+    guardado, pero las búsquedas simultáneas se siguen agrupando.
+    Es segura para usarse desde varios hilos y desde el event loop.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Búsquedas en curso: hilos (API síncrona) y tareas del event loop
+        self._pending: Dict[str, _Pending] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "upstream_calls": 0,
+            "upstream_errors": 0,
+        }
+        self._upstream_seconds = 0.0
+        self._upstream_max_seconds = 0.0
+
+    def key(self, query: str, score_threshold: float) -> str:
+        return f"{score_threshold}|{normalize_text(query)}"
+
+    def get(self, key: str) -> Optional[WebResults]:
+        """
+        Devuelve una copia de los resultados guardados o None.
+        """
+        with self._lock:
+            return self._get(key)
+
+    def put(self, key: str, value: WebResults) -> None:
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = {
+                "value": copy.deepcopy(value),
+                "expires_at": time.monotonic() + self.ttl,
+            }
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], WebResults]) -> WebResults:
+        """
+        Resultados de la caché o, si no están, de `fetch()`. Si otro hilo
+        ya está buscando lo mismo, se espera su resultado.
+        """
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                return value
+
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = _Pending()
+            else:
+                self._stats["coalesced"] += 1
+                record_cache("web_search", "coalesced")
+
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return copy.deepcopy(pending.value)
+
+        try:
+            pending.value = fetch()
+            self.put(key, pending.value)
+            return copy.deepcopy(pending.value)
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.done.set()
+
+    async def aget_or_fetch(self, key: str, fetch: Callable[[], Awaitable[WebResults]]) -> WebResults:
+        """
+        Versión async de get_or_fetch(). La búsqueda corre en su propia
+        tarea: si quien la lanzó se cancela (por ejemplo una rama
+        especulativa descartada), los demás la siguen esperando y el
+        resultado igual queda guardado.
+        """
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                return value
+
+            task = self._tasks.get(key)
+            if task is None:
+                task = asyncio.create_task(self._afetch(key, fetch))
+                # Si todos los que esperaban se cancelaron, nadie lee el error
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                self._tasks[key] = task
+            else:
+                self._stats["coalesced"] += 1
+                record_cache("web_search", "coalesced")
+
+        value = await asyncio.shield(task)
+        return copy.deepcopy(value)
+
+    @contextmanager
+    def upstream(self) -> Iterator[None]:
+        """
+        Mide una llamada a Tavily. Se abre ya dentro del slot del limitador,
+        para que la espera en la cola no cuente como latencia de Tavily.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self._observe(started, ok=False)
+            raise
+        self._observe(started, ok=True)
+
+    async def _afetch(self, key: str, fetch: Callable[[], Awaitable[WebResults]]) -> WebResults:
+        try:
+            value = await fetch()
+            # Se guarda antes de soltar la tarea para no abrir un hueco
+            # en el que otra petición vuelva a llamar a Tavily
+            self.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._tasks.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            calls = self._stats["upstream_calls"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                # Las búsquedas agrupadas tampoco llamaron a Tavily
+                "hit_rate": round((self._stats["hits"] + self._stats["coalesced"]) / lookups, 4) if lookups else 0.0,
+                "upstream_avg_seconds": round(self._upstream_seconds / calls, 4) if calls else 0.0,
+                "upstream_max_seconds": round(self._upstream_max_seconds, 4),
+            }
+
+    # ---------------------------
+    # UTILIDADES INTERNAS
+    # ---------------------------
+
+    def _get(self, key: str) -> Optional[WebResults]:
+        # Requiere el lock
+        entry = self._entries.get(key)
+        if entry is not None and entry["expires_at"] <= time.monotonic():
+            del self._entries[key]
+            self._stats["expirations"] += 1
+            entry = None
+
+        if entry is None:
+            self._stats["misses"] += 1
+            record_cache("web_search", "miss")
+            return None
+
+        self._stats["hits"] += 1
+        record_cache("web_search", "hit")
+        self._entries.move_to_end(key)
+        return copy.deepcopy(entry["value"])
+
+    def _observe(self, started: float, ok: bool) -> None:
+        elapsed = time.perf_counter() - started
+        UPSTREAM_SECONDS.observe(elapsed, upstream="tavily")
+        if not ok:
+            UPSTREAM_ERRORS.inc(upstream="tavily")
+        with self._lock:
+            self._stats["upstream_calls"] += 1
+            self._upstream_seconds += elapsed
+            self._upstream_max_seconds = max(self._upstream_max_seconds, elapsed)
+            if not ok:
+                self._stats["upstream_errors"] += 1
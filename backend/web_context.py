@@ -0,0 +1,160 @@
+# backend/web_context.py
+"""
+Contexto de la búsqueda web para el prompt de respuesta.
+Cada resultado se parte en pasajes (párrafos u oraciones agrupadas), los
+pasajes se ordenan por relevancia con la consulta (BM25) y se eligen los
+mejores hasta llenar un presupuesto de tokens entre todos los resultados,
+en lugar de cortar cada uno a un largo fijo a media oración.
+"""
+
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from .config import WEB_CONTEXT_TOKEN_BUDGET
+from .intent_classifier import normalize_text
+from .result_summarizer import estimate_tokens
+
+# Largo máximo de un pasaje (~100 tokens)
+PASSAGE_MAX_CHARS = 400
+# Parámetros usuales de BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_passages(text: str) -> List[str]:
+    """
+    Parte el texto en pasajes de hasta PASSAGE_MAX_CHARS: cada párrafo es
+    un pasaje y los párrafos largos se parten por oraciones.
+    """
+    passages = []
+    for paragraph in re.split(r"\n\s*\n|\n", text or ""):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        if len(paragraph) <= PASSAGE_MAX_CHARS:
+            passages.append(paragraph)
+            continue
+
+        current = ""
+        for sentence in SENTENCE_END.split(paragraph):
+            # Una oración más larga que el máximo se corta en una palabra
+            while len(sentence) > PASSAGE_MAX_CHARS:
+                cut = sentence.rfind(" ", 0, PASSAGE_MAX_CHARS)
+                cut = cut if cut > 0 else PASSAGE_MAX_CHARS
+                if current:
+                    passages.append(current)
+                    current = ""
+                passages.append(sentence[:cut] + "…")
+                sentence = sentence[cut:].strip()
+
+            if current and len(current) + 1 + len(sentence) > PASSAGE_MAX_CHARS:
+                passages.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}".strip()
+
+        if current:
+            passages.append(current)
+
+    return passages
+
+
+def _terms(text: str) -> List[str]:
+    return [w for w in normalize_text(text).split() if len(w) >= 3]
+
+
+def bm25_scores(query: str, passages: List[str]) -> List[float]:
+    """
+    Puntaje BM25 de cada pasaje contra la consulta, usando los propios
+    pasajes como colección.
+    """
+    docs = [Counter(_terms(p)) for p in passages]
+    if not docs:
+        return []
+
+    lengths = [sum(doc.values()) for doc in docs]
+    avg_length = sum(lengths) / len(docs) or 1.0
+    query_terms = set(_terms(query))
+
+    idf = {}
+    for term in query_terms:
+        df = sum(1 for doc in docs if term in doc)
+        idf[term] = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+
+    scores = []
+    for doc, length in zip(docs, lengths):
+        score = 0.0
+        for term in query_terms:
+            tf = doc.get(term, 0)
+            if tf:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                score += idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+        scores.append(score)
+    return scores
+
+
+def build_web_context(
+    query: str,
+    results: List[Dict[str, str]],
+    token_budget: int = WEB_CONTEXT_TOKEN_BUDGET,
+) -> List[Dict[str, str]]:
+    """
+    `results` es [{"title", "url", "text"}] en el orden de Tavily.
+    Devuelve [{"title", "url", "content"}] donde content son los pasajes
+    elegidos (en su orden original), sin pasar de `token_budget` en total.
+    Primero entra el mejor pasaje de cada resultado, para que todas las
+    fuentes estén representadas, y después los demás por puntaje.
+    """
+    # (resultado, posición, texto)
+    passages: List[Tuple[int, int, str]] = [
+        (i, j, passage)
+        for i, item in enumerate(results)
+        for j, passage in enumerate(split_passages(item.get("text", "")))
+    ]
+    scores = bm25_scores(query, [p[2] for p in passages])
+    ranked = sorted(zip(scores, passages), key=lambda sp: (-sp[0], sp[1][1], sp[1][0]))
+
+    best_per_result = {}
+    for score, passage in ranked:
+        best_per_result.setdefault(passage[0], passage)
+    first_round = sorted(best_per_result.values(), key=lambda p: p[0])
+    rest = [p for _, p in ranked if best_per_result[p[0]] is not p]
+
+    # Título y url solo cuestan si entra algún pasaje del resultado
+    headers = [estimate_tokens(f"{item.get('title', '')} {item.get('url', '')}") for item in results]
+    used = 0
+    chosen: Dict[int, List[Tuple[int, str]]] = {}
+    for i, j, text in first_round + rest:
+        cost = estimate_tokens(text) + (headers[i] if i not in chosen else 0)
+        if used + cost > token_budget:
+            continue
+        used += cost
+        chosen.setdefault(i, []).append((j, text))
+
+    context = []
+    for i, item in enumerate(results):
+        if i not in chosen:
+            continue
+        context.append({
+            "title": item.get("title", "Sin título"),
+            "content": " … ".join(text for _, text in sorted(chosen[i])),
+            "url": item.get("url", ""),
+        })
+    return context
+
+
+def format_web_context(context: List[Dict[str, str]]) -> str:
+    """
+    Texto de los resultados para el prompt: "[n] título (url)" y sus pasajes.
+    """
+    if not context:
+        return "Sin resultados relevantes."
+
+    return "\n\n".join(
+        f"[{n}] {item['title']} ({item['url']})\n{item['content']}"
+        for n, item in enumerate(context, start=1)
+    )
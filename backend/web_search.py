@@ -2,12 +2,28 @@
 """
 Módulo para búsquedas web usando Tavily.
 Devuelve una lista de resultados simples: [{"title": "...", "content": "...", "url": "..."}].
+Los resultados se guardan por un rato en WebSearchCache (ver web_cache.py)
+y su contenido son los pasajes más relevantes para la consulta, dentro de
+un presupuesto de tokens (ver web_context.py).
 """
 
+import time
 from typing import Dict, Any, List
 from tavily import TavilyClient
 
-from .config import TAVILY_API_KEY
+from .config import (
+    TAVILY_API_KEY,
+    TAVILY_API_URL,
+    WEB_SEARCH_CACHE_TTL,
+    WEB_SEARCH_CACHE_MAX_ENTRIES,
+    WEB_SEARCH_MAX_RESULTS,
+    WEB_SEARCH_RAW_CONTENT,
+)
+from .admission import upstream_limiter
+from .http_client import get_async_http_client
+from .traffic_recorder import record_web_search
+from .web_cache import WebSearchCache
+from .web_context import build_web_context
 
 
 class WebSearchClient:
@@ -15,6 +31,7 @@ class WebSearchClient:
         if not TAVILY_API_KEY:
             raise ValueError("TAVILY_API_KEY no está configurado en el .env")
         self.client = TavilyClient(api_key=TAVILY_API_KEY)
+        self.cache = WebSearchCache(WEB_SEARCH_CACHE_MAX_ENTRIES, WEB_SEARCH_CACHE_TTL)
 
     def search(self, query: str, score_threshold: float = 0.30) -> List[Dict[str, str]]:
         """
@@ -25,32 +42,70 @@ class WebSearchClient:
             "url": "..."
         }]
         """
+        key = self.cache.key(query, score_threshold)
+        return self.cache.get_or_fetch(key, lambda: self._search(query, score_threshold))
 
-        result = self.client.search(
-            query=query,
-            include_answer="basic",
-            include_raw_content="text",
-            max_results=3
-        )
+    async def asearch(self, query: str, score_threshold: float = 0.30) -> List[Dict[str, str]]:
+        """
+        Versión async de search().
+        """
+        key = self.cache.key(query, score_threshold)
+        return await self.cache.aget_or_fetch(key, lambda: self._asearch(query, score_threshold))
 
-        raw_results = result.get("results", [])
-        filtered = [r for r in raw_results if r.get("score", 0) >= score_threshold]
+    def _search(self, query: str, score_threshold: float) -> List[Dict[str, str]]:
+        with upstream_limiter("tavily").slot(), self.cache.upstream():
+            started = time.perf_counter()
+            result = self.client.search(query=query, **self._search_options())
+        record_web_search(query, result, started)
 
-        simplified = []
+        return self._simplify(query, result, score_threshold)
+
+    async def _asearch(self, query: str, score_threshold: float) -> List[Dict[str, str]]:
+        """
+        Llama directamente a la API REST de Tavily con el cliente HTTP
+        compartido, para reutilizar conexiones keep-alive.
+        """
+        async with upstream_limiter("tavily").aslot():
+            with self.cache.upstream():
+                started = time.perf_counter()
+                response = await get_async_http_client().post(
+                    f"{TAVILY_API_URL}/search",
+                    headers={"Authorization": f"Bearer {TAVILY_API_KEY}"},
+                    json={"query": query, **self._search_options()},
+                )
+                if response.is_error:
+                    raise RuntimeError(
+                        f"Error Tavily: {response.status_code} -> {response.text}"
+                    )
 
-        for item in filtered:
-            title = item.get("title", "Sin título")
-            content = (item.get("content") or "").strip()
-            url = item.get("url", "")
+        result = response.json()
+        record_web_search(query, result, started)
 
-            # Recortar contenido largo
-            if len(content) > 500:
-                content = content[:500] + "..."
+        return self._simplify(query, result, score_threshold)
+
+    def _search_options(self) -> Dict[str, Any]:
+        """
+        Solo pedimos lo que se usa: sin "answer" de Tavily y sin el texto
+        completo de las páginas, salvo que WEB_SEARCH_RAW_CONTENT lo active.
+        """
+        return {
+            "include_answer": False,
+            "include_raw_content": "text" if WEB_SEARCH_RAW_CONTENT else False,
+            "max_results": WEB_SEARCH_MAX_RESULTS,
+        }
+
+    def _simplify(self, query: str, result: Dict[str, Any], score_threshold: float) -> List[Dict[str, str]]:
+        raw_results = result.get("results", [])
+        filtered = [r for r in raw_results if r.get("score", 0) >= score_threshold]
 
-            simplified.append({
-                "title": title,
-                "content": content,
-                "url": url,
-            })
+        # Con texto completo se eligen sus mejores pasajes; si no, los del snippet
+        items = [
+            {
+                "title": item.get("title", "Sin título"),
+                "url": item.get("url", ""),
+                "text": item.get("raw_content") or item.get("content") or "",
+            }
+            for item in filtered
+        ]
 
-        return simplified
+        return build_web_context(query, items)
@@ -0,0 +1,4 @@
+# bench/__init__.py
+"""
+Herramientas de benchmark y pruebas de carga del agente (ver bench/README.md).
+"""
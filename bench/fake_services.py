@@ -0,0 +1,308 @@
+# bench/fake_services.py
+"""
+Servicios falsos para benchmarks: un servidor LLM OpenAI-like
+(/v1/chat/completions, /v1/embeddings, /v1/models) y la API de Tavily
+(/search) en el mismo proceso, con latencia, velocidad de generación y
+slots de generación configurables. Así se mide el agente sin depender de
+un modelo real ni de cuota de Tavily.
+
+    python -m bench.fake_services --port 8001 --ttft 0.2 --tokens-per-second 40
+
+y en el .env del backend:
+
+    LLM_API_BASE=http://localhost:8001/v1
+    TAVILY_API_URL=http://localhost:8001
+    TAVILY_API_KEY=fake
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Valores por defecto; main() los reemplaza con los argumentos
+SETTINGS: Dict[str, Any] = {
+    "ttft": 0.2,                # segundos hasta el primer token (prefill)
+    "tokens_per_second": 40.0,  # velocidad de generación por petición
+    "answer_tokens": 120,       # largo de las respuestas que no son del router
+    "slots": 4,                 # generaciones en paralelo (como --parallel de llama.cpp; 0 = sin límite)
+    "search_latency": 0.4,      # segundos por búsqueda en Tavily
+    "jitter": 0.1,              # variación aleatoria (+/- proporción) de las latencias
+}
+
+JSON_MARKER = "Responde únicamente con un JSON válido"
+MESSAGE_MARKER = "Mensaje del usuario:"
+BATCH_MARKER = "Mensajes del usuario:"
+
+SQL_WORDS = ("ticket", "asignacion", "colaborador", "departamento", "cuantos", "promedio", "estatus", "sla")
+WEB_WORDS = ("noticia", "hoy", "clima", "actual", "reciente", "pronostico", "precio")
+
+SQL_QUERIES = [
+    "SELECT estatus_ticket, COUNT(*) AS total FROM tickets GROUP BY estatus_ticket",
+    "SELECT departamento_asignado, AVG(tiempo_solucion_total) AS promedio FROM tickets "
+    "GROUP BY departamento_asignado ORDER BY promedio DESC",
+    "SELECT colaborador_asignado, COUNT(*) AS total FROM tickets GROUP BY colaborador_asignado "
+    "ORDER BY total DESC LIMIT 10",
+    "SELECT t.servicio, AVG(a.sla_asignacion) AS sla FROM tickets t JOIN asignaciones a "
+    "ON a.folio_ticket = t.folio_ticket GROUP BY t.servicio",
+    "SELECT * FROM tickets WHERE estatus_ticket = 'EN PROCESO' ORDER BY fecha_registro DESC",
+]
+
+WORDS = (
+    "el sistema registra los tickets por departamento y el tiempo promedio de atención "
+    "depende del servicio la carga de trabajo y la disponibilidad de cada colaborador "
+    "en general los resultados muestran una tendencia estable durante el periodo"
+).split()
+
+# Respuesta del LLM: (texto, segundos hasta el primer token, segundos por
+# fragmento) y de Tavily: (JSON, segundos de latencia)
+ChatResponder = Callable[[Dict[str, Any]], Tuple[str, float, float]]
+SearchResponder = Callable[[Dict[str, Any]], Tuple[Dict[str, Any], float]]
+
+
+def _jitter(seconds: float) -> float:
+    spread = SETTINGS["jitter"]
+    return max(0.0, seconds * random.uniform(1 - spread, 1 + spread))
+
+
+def _normalize(text: str) -> str:
+    text = text.lower()
+    for a, b in zip("áéíóúü", "aeiouu"):
+        text = text.replace(a, b)
+    return text
+
+
+def _user_message(messages: List[Dict[str, str]]) -> str:
+    content = messages[-1]["content"] if messages else ""
+    if MESSAGE_MARKER in content:
+        content = content.split(MESSAGE_MARKER, 1)[1]
+    return content.strip()
+
+
+def is_router_call(body: Dict[str, Any]) -> bool:
+    return any(JSON_MARKER in (m.get("content") or "") for m in body["messages"])
+
+
+def _router_decision(body: Dict[str, Any]) -> str:
+    """
+    JSON del router: la intención sale de palabras clave del mensaje. La
+    variante por lotes trae una decisión por cada línea "[id] mensaje", y
+    si el esquema admite planes, un mensaje con palabras de SQL y de web
+    pide las dos cosas.
+    """
+    content = body["messages"][-1]["content"] if body["messages"] else ""
+    if BATCH_MARKER in content:
+        lines = re.findall(r"^\[(\d+)\] (.*)$", content.split(BATCH_MARKER, 1)[1], flags=re.M)
+        decisions = []
+        for index, message in lines:
+            decision = _decide(message)
+            del decision["explanation"]
+            decisions.append({"id": int(index), **decision})
+        return json.dumps({"decisions": decisions}, ensure_ascii=False)
+
+    message = _user_message(body["messages"])
+    schema = json.dumps(body.get("response_format") or {}) + json.dumps(body.get("messages"))
+    decision = _decide(message, plans='"sql_queries"' in schema)
+    # Modo inline_answer: el esquema pide también "answer"
+    if '"answer"' in schema:
+        decision["answer"] = _answer_text(_digest(message)) if decision["intent"] == "llm" else ""
+    return json.dumps(decision, ensure_ascii=False)
+
+
+def _digest(message: str) -> int:
+    return int(hashlib.md5(message.encode()).hexdigest(), 16)
+
+
+def _decide(message: str, plans: bool = False) -> Dict[str, Any]:
+    text = _normalize(message)
+    digest = _digest(message)
+    sql = any(word in text for word in SQL_WORDS)
+    web = any(word in text for word in WEB_WORDS)
+
+    if plans and sql and web:
+        intent = "plan"
+    elif sql:
+        intent = "sql"
+    elif web:
+        intent = "web"
+    else:
+        intent = "llm"
+
+    decision = {
+        "intent": intent,
+        "sql_query": SQL_QUERIES[digest % len(SQL_QUERIES)] if intent == "sql" else "",
+        "web_query": message if intent == "web" else "",
+    }
+    if plans:
+        decision["sql_queries"] = [SQL_QUERIES[(digest + i) % len(SQL_QUERIES)] for i in range(2)] if intent == "plan" else []
+        decision["web_queries"] = [message] if intent == "plan" else []
+    decision["explanation"] = "Decisión simulada para benchmark."
+    return decision
+
+
+def _answer_text(seed: int) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(SETTINGS["answer_tokens"])) + "."
+
+
+def pieces(text: str) -> List[str]:
+    # ~4 caracteres por token, igual que la estimación del backend
+    return re.findall(r".{1,4}", text, flags=re.S)
+
+
+def _usage(body: Dict[str, Any], completion_tokens: int) -> Dict[str, Any]:
+    prompt_tokens = sum(len(m.get("content") or "") for m in body["messages"]) // 4 + 1
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def synthetic_chat(body: Dict[str, Any]) -> Tuple[str, float, float]:
+    """
+    Respuesta inventada con la latencia y velocidad de SETTINGS.
+    """
+    seed = int(hashlib.md5(json.dumps(body["messages"]).encode()).hexdigest(), 16)
+    text = _router_decision(body) if is_router_call(body) else _answer_text(seed)
+    return text, _jitter(SETTINGS["ttft"]), 1 / SETTINGS["tokens_per_second"]
+
+
+def synthetic_search(body: Dict[str, Any]) -> Tuple[Dict[str, Any], float]:
+    query = body.get("query", "")
+    results = []
+    for i in range(int(body.get("max_results", 3))):
+        content = f"Resultado {i + 1} sobre {query}. " + " ".join(WORDS[: 20 + 5 * i])
+        item = {
+            "title": f"{query} - fuente {i + 1}",
+            "url": f"https://example.com/{i + 1}",
+            "content": content,
+            "score": round(0.9 - 0.1 * i, 2),
+        }
+        if body.get("include_raw_content"):
+            item["raw_content"] = "\n\n".join([content] + [" ".join(WORDS)] * 20)
+        results.append(item)
+
+    latency = _jitter(SETTINGS["search_latency"])
+    return {"query": query, "results": results, "response_time": round(latency, 3)}, latency
+
+
+def create_app(chat: ChatResponder = synthetic_chat, search: SearchResponder = synthetic_search) -> FastAPI:
+    """
+    API OpenAI-like y de Tavily sobre las funciones que deciden cada
+    respuesta (bench/replay.py usa las que salen de un log grabado).
+    Las generaciones en paralelo se limitan a SETTINGS["slots"] (0 = sin límite).
+    """
+    app = FastAPI(title="Servicios falsos para benchmark")
+    slots = asyncio.Semaphore(SETTINGS["slots"]) if SETTINGS["slots"] > 0 else None
+
+    @asynccontextmanager
+    async def slot():
+        if slots is None:
+            yield
+            return
+        async with slots:
+            yield
+
+    # ---------------------------
+    # LLM (OpenAI-like)
+    # ---------------------------
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "fake-model", "object": "model"}]}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        digest = hashlib.sha256(str(body.get("input")).encode()).digest()
+        vector = [b / 255 for b in digest] * 12
+        return {"object": "list", "data": [{"object": "embedding", "index": 0, "embedding": vector}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        text, ttft, per_piece = chat(body)
+        parts = pieces(text)
+
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+            return StreamingResponse(
+                _stream(body, parts, ttft, per_piece, include_usage),
+                media_type="text/event-stream",
+            )
+
+        async with slot():
+            await asyncio.sleep(ttft + len(parts) * per_piece)
+
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "model": body.get("model", "fake-model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": _usage(body, len(parts)),
+        }
+
+    async def _stream(
+        body: Dict[str, Any],
+        parts: List[str],
+        ttft: float,
+        per_piece: float,
+        include_usage: bool,
+    ) -> AsyncIterator[str]:
+        # Si el cliente corta el stream, la cancelación libera el slot
+        async with slot():
+            await asyncio.sleep(ttft)
+            for piece in parts:
+                chunk = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(per_piece)
+
+        if include_usage:
+            yield f"data: {json.dumps({'choices': [], 'usage': _usage(body, len(parts))})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    # ---------------------------
+    # TAVILY
+    # ---------------------------
+
+    @app.post("/search")
+    async def tavily_search(request: Request):
+        body = await request.json()
+        response, latency = search(body)
+        await asyncio.sleep(latency)
+        return JSONResponse(response)
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft", type=float, default=SETTINGS["ttft"])
+    parser.add_argument("--tokens-per-second", type=float, default=SETTINGS["tokens_per_second"])
+    parser.add_argument("--answer-tokens", type=int, default=SETTINGS["answer_tokens"])
+    parser.add_argument("--slots", type=int, default=SETTINGS["slots"])
+    parser.add_argument("--search-latency", type=float, default=SETTINGS["search_latency"])
+    parser.add_argument("--jitter", type=float, default=SETTINGS["jitter"])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="LLM OpenAI-like y Tavily falsos para benchmarks")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    SETTINGS.update({k: v for k, v in vars(args).items() if k in SETTINGS})
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
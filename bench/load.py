@@ -0,0 +1,386 @@
+# bench/load.py
+"""
+Generador de carga para el agente. Manda preguntas a /agent (o a
+/agent/stream con --stream) con una mezcla configurable de intenciones y
+concurrencia fija, pide la traza de cada petición (cabecera X-Agent-Debug)
+y reporta throughput y p50/p95/p99 por intención y por etapa.
+
+    python -m bench.load --url http://localhost:8000 --concurrency 16 --requests 500 \
+        --mix sql=0.5,web=0.2,llm=0.3 --out bench/results/base.json
+
+El JSON de salida incluye el commit del backend, así que dos corridas de
+commits distintos se comparan con --baseline:
+
+    python -m bench.load ... --out nuevo.json --baseline bench/results/base.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+# Preguntas por intención; el LLM falso (bench.fake_services) decide la
+# intención con las mismas palabras clave
+QUESTIONS: Dict[str, List[str]] = {
+    "sql": [
+        "¿Cuántos tickets hay por estatus?",
+        "¿Cuál es el tiempo promedio de solución por departamento?",
+        "¿Qué colaborador tiene más tickets asignados?",
+        "¿Cuál es el SLA promedio de las asignaciones por servicio?",
+        "Muéstrame los tickets en proceso más recientes",
+    ],
+    "web": [
+        "¿Cuáles son las noticias de tecnología de hoy?",
+        "¿Cuál es el pronóstico del clima en Monterrey?",
+        "¿Cuál es el precio actual del dólar?",
+        "¿Qué novedades recientes hay sobre ciberseguridad?",
+    ],
+    "llm": [
+        "Explícame qué es un SLA",
+        "Dame consejos para priorizar mi trabajo",
+        "¿Cómo redacto un correo formal?",
+        "Resume las buenas prácticas de una mesa de ayuda",
+    ],
+}
+
+PERCENTILES = (50, 95, 99)
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """
+    "sql=0.5,web=0.2,llm=0.3" -> proporciones normalizadas.
+    """
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in QUESTIONS:
+            raise ValueError(f"Intención desconocida en --mix: {name!r}")
+        mix[name] = float(weight)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("--mix debe tener al menos un peso positivo")
+    return {name: weight / total for name, weight in mix.items()}
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Percentil con interpolación lineal (como numpy por defecto).
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    if not values:
+        return {"count": 0}
+    summary = {"count": len(values), "mean_ms": round(sum(values) / len(values), 2)}
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = round(percentile(values, p), 2)
+    summary["max_ms"] = round(max(values), 2)
+    return summary
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---------------------------
+# PETICIONES
+# ---------------------------
+
+class Sample:
+    __slots__ = ("expected", "intent", "path", "cached", "latency_ms", "ttft_ms", "spans", "error")
+
+    def __init__(self, expected: str):
+        self.expected = expected
+        self.intent: Optional[str] = None
+        self.path: Optional[str] = None
+        self.cached = False
+        self.latency_ms = 0.0
+        self.ttft_ms: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+        self.error: Optional[str] = None
+
+
+class LoadGenerator:
+    """
+    Manda las preguntas de next_question() con `args.concurrency`
+    clientes y arma el reporte. Las subclases eligen las preguntas.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.headers = {"X-Agent-Debug": "1"}
+
+    def next_question(self) -> Optional[Tuple[Sample, str]]:
+        """
+        (muestra con la intención esperada, pregunta) o None si ya no hay más.
+        """
+        raise NotImplementedError
+
+    async def send(self, client: httpx.AsyncClient, sample: Sample, question: str) -> None:
+        started = time.perf_counter()
+        try:
+            if self.args.stream:
+                await self._send_stream(client, sample, question, started)
+            else:
+                response = await client.post("/agent", json={"message": question}, headers=self.headers)
+                response.raise_for_status()
+                self._read_result(sample, response.json())
+        except (httpx.HTTPError, ValueError) as e:
+            sample.error = type(e).__name__
+        sample.latency_ms = (time.perf_counter() - started) * 1000
+
+    async def _send_stream(self, client: httpx.AsyncClient, sample: Sample, question: str, started: float) -> None:
+        async with client.stream("POST", "/agent/stream", json={"message": question}, headers=self.headers) as response:
+            response.raise_for_status()
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[7:]
+                    continue
+                if not line.startswith("data: "):
+                    continue
+                data = json.loads(line[6:])
+                if event == "token" and sample.ttft_ms is None:
+                    sample.ttft_ms = (time.perf_counter() - started) * 1000
+                elif event == "meta":
+                    self._read_result(sample, data)
+                elif event == "trace":
+                    sample.spans = data.get("spans", [])
+                elif event == "error":
+                    sample.error = "stream_error"
+
+    @staticmethod
+    def _read_result(sample: Sample, result: Dict[str, Any]) -> None:
+        sample.intent = result.get("intent")
+        sample.path = (result.get("routing") or {}).get("path")
+        sample.cached = bool(result.get("cached"))
+        if result.get("trace"):
+            sample.spans = result["trace"].get("spans", [])
+
+    async def run(self) -> Dict[str, Any]:
+        args = self.args
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+            if args.warmup:
+                # Calentamiento: conexiones, caché de esquema y prompts
+                await self._run_batch(client, args.warmup, None)
+
+            samples: List[Sample] = []
+            started = time.perf_counter()
+            await self._run_batch(client, args.requests, args.duration, samples)
+            elapsed = time.perf_counter() - started
+
+        return self.report(samples, elapsed)
+
+    async def _run_batch(
+        self,
+        client: httpx.AsyncClient,
+        requests: int,
+        duration: Optional[float],
+        samples: Optional[List[Sample]] = None,
+    ) -> None:
+        deadline = time.perf_counter() + duration if duration else None
+        remaining = [requests]
+
+        async def worker() -> None:
+            while True:
+                if deadline is not None:
+                    if time.perf_counter() >= deadline:
+                        return
+                elif remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                item = self.next_question()
+                if item is None:
+                    return
+                sample, question = item
+                await self.send(client, sample, question)
+                if samples is not None:
+                    samples.append(sample)
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+
+    # ---------------------------
+    # REPORTE
+    # ---------------------------
+
+    def report(self, samples: List[Sample], elapsed: float) -> Dict[str, Any]:
+        ok = [s for s in samples if s.error is None]
+        errors: Dict[str, int] = defaultdict(int)
+        for s in samples:
+            if s.error:
+                errors[s.error] += 1
+
+        by_intent: Dict[str, List[float]] = defaultdict(list)
+        by_path: Dict[str, List[float]] = defaultdict(list)
+        stages: Dict[str, List[float]] = defaultdict(list)
+        ttft: Dict[str, List[float]] = defaultdict(list)
+        misrouted = 0
+        for s in ok:
+            intent = s.intent or "unknown"
+            by_intent[intent].append(s.latency_ms)
+            by_path["cache" if s.cached else (s.path or "unknown")].append(s.latency_ms)
+            if s.intent and s.intent != s.expected:
+                misrouted += 1
+            if s.ttft_ms is not None:
+                ttft[intent].append(s.ttft_ms)
+            for span in s.spans:
+                stages[span["name"]].append(span["duration_ms"])
+
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "args": vars(self.args),
+            },
+            "summary": {
+                "requests": len(samples),
+                "ok": len(ok),
+                "errors": dict(errors),
+                "misrouted": misrouted,
+                "cached": sum(1 for s in ok if s.cached),
+                "elapsed_s": round(elapsed, 2),
+                "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+                "latency": summarize([s.latency_ms for s in ok]),
+            },
+            "latency_by_intent": {k: summarize(v) for k, v in sorted(by_intent.items())},
+            "latency_by_path": {k: summarize(v) for k, v in sorted(by_path.items())},
+            "stages": {k: summarize(v) for k, v in sorted(stages.items())},
+        }
+        if self.args.stream:
+            report["ttft_by_intent"] = {k: summarize(v) for k, v in sorted(ttft.items())}
+        return report
+
+
+class MixedLoad(LoadGenerator):
+    """
+    Preguntas de QUESTIONS con la mezcla de intenciones de --mix.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        super().__init__(args)
+        self.mix = parse_mix(args.mix)
+        self.rng = random.Random(args.seed)
+        self.counter = 0
+        # Distinto en cada corrida: con --unique tampoco se reusa la caché
+        # de una corrida anterior contra el mismo backend
+        self.run_id = format(int(time.time()) % 100_000, "05d")
+
+    def next_question(self) -> Tuple[Sample, str]:
+        intent = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        question = self.rng.choice(QUESTIONS[intent])
+        self.counter += 1
+        if self.args.unique:
+            # Sufijo distinto por petición: evita la caché de respuestas
+            question = f"{question} (consulta {self.run_id}-{self.counter})"
+        return Sample(intent), question
+
+
+# ---------------------------
+# COMPARACIÓN
+# ---------------------------
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """
+    Diferencias de throughput y p50/p95/p99 contra una corrida anterior.
+    """
+    lines = [f"Comparación contra {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):"]
+
+    def delta(label: str, new: float, old: float) -> None:
+        change = (new - old) / old * 100 if old else 0.0
+        lines.append(f"  {label:<40} {old:>10.2f} -> {new:>10.2f}  ({change:+.1f}%)")
+
+    delta("throughput_rps", current["summary"]["throughput_rps"], baseline["summary"]["throughput_rps"])
+    for section in ("latency_by_intent", "stages", "ttft_by_intent"):
+        for name, stats in current.get(section, {}).items():
+            old = baseline.get(section, {}).get(name)
+            if not old or not old.get("count") or not stats.get("count"):
+                continue
+            for p in PERCENTILES:
+                key = f"p{p}_ms"
+                delta(f"{section}.{name}.{key}", stats[key], old[key])
+    return lines
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    summary = report["summary"]
+    print(
+        f"{summary['ok']}/{summary['requests']} ok en {summary['elapsed_s']} s "
+        f"-> {summary['throughput_rps']} req/s (errores: {summary['errors'] or 0}, "
+        f"caché: {summary['cached']}, mal enrutadas: {summary['misrouted']})"
+    )
+    for section in ("latency_by_intent", "latency_by_path", "ttft_by_intent", "stages"):
+        if section not in report:
+            continue
+        print(f"\n{section}:")
+        for name, stats in report[section].items():
+            if not stats.get("count"):
+                continue
+            print(
+                f"  {name:<22} n={stats['count']:<6} p50={stats['p50_ms']:>9.1f}  "
+                f"p95={stats['p95_ms']:>9.1f}  p99={stats['p99_ms']:>9.1f}  max={stats['max_ms']:>9.1f} ms"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prueba de carga del agente")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="total de peticiones (si no se usa --duration)")
+    parser.add_argument("--duration", type=float, default=None, help="segundos de carga en lugar de --requests")
+    parser.add_argument("--mix", default="sql=0.5,web=0.2,llm=0.3")
+    parser.add_argument("--stream", action="store_true", help="usar /agent/stream y medir el primer token")
+    parser.add_argument("--unique", action="store_true", help="preguntas únicas para no pegarle a la caché")
+    parser.add_argument("--warmup", type=int, default=10, help="peticiones de calentamiento (no se miden)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None, help="archivo JSON con los resultados")
+    parser.add_argument("--baseline", default=None, help="JSON de una corrida anterior para comparar")
+    args = parser.parse_args()
+
+    report = asyncio.run(MixedLoad(args).run())
+    finish(report, args)
+
+
+def finish(report: Dict[str, Any], args: argparse.Namespace) -> None:
+    """
+    Imprime el reporte, lo guarda en --out y lo compara con --baseline.
+    """
+    print_report(report)
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nResultados en {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            print("\n" + "\n".join(compare(report, json.load(f))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# bench/make_db.py
+"""
+Genera una base SQLite sintética con las tablas tickets y asignaciones
+(mismo esquema que prompts.DB_SCHEMA_DESCRIPTION) para medir el agente a
+distintas escalas, de 10k a 10M tickets:
+
+    python -m bench.make_db --rows 1M --out bench/tickets_1M.db
+
+Los datos son deterministas para una misma semilla, así que dos corridas
+con la misma escala miden lo mismo.
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, Tuple
+
+BATCH_SIZE = 50_000
+
+TICKETS_DDL = """
+CREATE TABLE tickets (
+    folio_ticket INTEGER,
+    fecha_registro TEXT,
+    estatus_ticket TEXT,
+    tiempo_solucion_total REAL,
+    efectividad_ticket REAL,
+    colaborador_asignado TEXT,
+    departamento_asignado TEXT,
+    fecha_cierre TEXT,
+    servicio TEXT,
+    personal_reporta TEXT,
+    departamento_reporta TEXT,
+    unidad_negocio TEXT,
+    empresa TEXT,
+    "ubicación" TEXT,
+    sucursal TEXT,
+    motivo_ticket TEXT,
+    personal_registra_ticket TEXT
+)
+"""
+
+ASIGNACIONES_DDL = """
+CREATE TABLE asignaciones (
+    folio_ticket INTEGER,
+    colaborador_asignado TEXT,
+    departamento_asigando TEXT,
+    inicio_asignacion TEXT,
+    fin_asignacion TEXT,
+    estatus_asigancion TEXT,
+    servicio_asignacion TEXT,
+    tiempo_atencion_asignacion TEXT,
+    sla_asignacion REAL,
+    efectividad_asignacion REAL,
+    estatus_ticket TEXT
+)
+"""
+
+# Índices que tendría una base real: sin ellos los JOIN por folio a escala
+# de millones miden otra cosa
+INDEXES = [
+    "CREATE INDEX idx_tickets_folio ON tickets (folio_ticket)",
+    "CREATE INDEX idx_tickets_estatus ON tickets (estatus_ticket)",
+    "CREATE INDEX idx_asignaciones_folio ON asignaciones (folio_ticket)",
+]
+
+DEPARTAMENTOS = ["TI", "Recursos Humanos", "Finanzas", "Operaciones", "Compras", "Mantenimiento", "Legal", "Ventas"]
+SERVICIOS = [f"{area} - {tipo}" for area in ("Correo", "Red", "ERP", "Impresión", "Accesos", "Nómina", "Equipo")
+             for tipo in ("Falla", "Solicitud", "Consulta")]
+EMPRESAS = ["Grupo Norte", "Comercial Sur", "Servicios Centro"]
+UNIDADES = ["Corporativo", "Retail", "Logística", "Manufactura"]
+UBICACIONES = ["CDMX", "Monterrey", "Guadalajara", "Mérida", "Cancún", "Puebla"]
+MOTIVOS = ["Falla de equipo", "Alta de usuario", "Cambio de contraseña", "Error en sistema", "Solicitud de acceso",
+           "Instalación de software", "Consulta general"]
+ESTATUS_TICKET = ["ATENDIDO", "EN PROCESO"]
+ESTATUS_ASIGNACION = ["CERRADA", "ABIERTA", "REASIGNADA"]
+START_DATE = datetime(2023, 1, 1)
+
+
+def parse_rows(text: str) -> int:
+    """
+    "10k", "1M", "2.5M" o un número.
+    """
+    text = text.strip().lower().replace("_", "")
+    factor = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    number = text[:-1] if factor > 1 else text
+    return int(float(number) * factor)
+
+
+def _people(prefix: str, count: int):
+    return [f"{prefix} {i:04d}" for i in range(1, count + 1)]
+
+
+def generate(rows: int, seed: int) -> Iterator[Tuple[tuple, list]]:
+    """
+    Genera (ticket, [asignaciones]) de uno en uno, con memoria constante.
+    """
+    rng = random.Random(seed)
+    # Más gente y sucursales en bases más grandes, como en una empresa real
+    colaboradores = _people("Colaborador", max(50, rows // 2_000))
+    personal = _people("Empleado", max(200, rows // 500))
+    sucursales = [f"Sucursal {i:03d}" for i in range(1, max(10, rows // 20_000) + 2)]
+    span_minutes = 2 * 365 * 24 * 60
+
+    for folio in range(1, rows + 1):
+        registro = START_DATE + timedelta(minutes=rng.randrange(span_minutes))
+        atendido = rng.random() < 0.8
+        horas = round(rng.lognormvariate(2.0, 1.0), 2)
+        departamento = rng.choice(DEPARTAMENTOS)
+        servicio = rng.choice(SERVICIOS)
+        colaborador = rng.choice(colaboradores)
+        estatus = ESTATUS_TICKET[0] if atendido else ESTATUS_TICKET[1]
+
+        ticket = (
+            folio,
+            registro.strftime("%Y-%m-%d %H:%M:%S"),
+            estatus,
+            horas if atendido else None,
+            round(rng.uniform(0.5, 1.0), 3) if atendido else None,
+            colaborador,
+            departamento,
+            (registro + timedelta(hours=horas)).strftime("%Y-%m-%d %H:%M:%S") if atendido else None,
+            servicio,
+            rng.choice(personal),
+            rng.choice(DEPARTAMENTOS),
+            rng.choice(UNIDADES),
+            rng.choice(EMPRESAS),
+            rng.choice(UBICACIONES),
+            rng.choice(sucursales),
+            rng.choice(MOTIVOS),
+            rng.choice(personal),
+        )
+
+        # 1 a 3 asignaciones por ticket (~1.5 en promedio)
+        asignaciones = []
+        inicio = registro
+        count = 1 + (rng.random() < 0.35) + (rng.random() < 0.15)
+        for n in range(count):
+            ultima = n == count - 1
+            duracion = round(horas / count if atendido else rng.uniform(0.5, 8), 2)
+            fin = inicio + timedelta(hours=duracion)
+            asignaciones.append((
+                folio,
+                colaborador if ultima else rng.choice(colaboradores),
+                departamento if ultima else rng.choice(DEPARTAMENTOS),
+                inicio.strftime("%Y-%m-%d %H:%M:%S"),
+                fin.strftime("%Y-%m-%d %H:%M:%S") if atendido or not ultima else None,
+                ESTATUS_ASIGNACION[2] if not ultima else (ESTATUS_ASIGNACION[0] if atendido else ESTATUS_ASIGNACION[1]),
+                servicio,
+                f"{duracion:.2f}",
+                round(rng.uniform(0.6, 1.0), 3),
+                round(rng.uniform(0.5, 1.0), 3),
+                estatus,
+            ))
+            inicio = fin
+
+        yield ticket, asignaciones
+
+
+def build(path: str, rows: int, seed: int) -> dict:
+    if os.path.exists(path):
+        os.remove(path)
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(path)
+    # Carga masiva: sin journal ni fsync (la base se puede regenerar)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute(TICKETS_DDL)
+    conn.execute(ASIGNACIONES_DDL)
+
+    tickets, asignaciones = [], []
+    total_asignaciones = 0
+    for ticket, items in generate(rows, seed):
+        tickets.append(ticket)
+        asignaciones.extend(items)
+        if len(tickets) >= BATCH_SIZE:
+            total_asignaciones += _flush(conn, tickets, asignaciones)
+            tickets, asignaciones = [], []
+            print(f"  {ticket[0]:,} / {rows:,} tickets", end="\r", flush=True)
+    total_asignaciones += _flush(conn, tickets, asignaciones)
+
+    for ddl in INDEXES:
+        conn.execute(ddl)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+    return {
+        "path": path,
+        "tickets": rows,
+        "asignaciones": total_asignaciones,
+        "seconds": round(time.perf_counter() - started, 2),
+        "size_mb": round(os.path.getsize(path) / 1_000_000, 1),
+    }
+
+
+def _flush(conn: sqlite3.Connection, tickets: list, asignaciones: list) -> int:
+    conn.executemany(f"INSERT INTO tickets VALUES ({', '.join('?' * 17)})", tickets)
+    conn.executemany(f"INSERT INTO asignaciones VALUES ({', '.join('?' * 11)})", asignaciones)
+    conn.commit()
+    return len(asignaciones)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Base SQLite sintética de tickets para benchmarks")
+    parser.add_argument("--rows", default="10k", help="tickets a generar: 10k, 100k, 1M, 10M...")
+    parser.add_argument("--out", default=None, help="archivo de salida (por defecto bench/tickets_<rows>.db)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rows = parse_rows(args.rows)
+    path = args.out or os.path.join(os.path.dirname(__file__), f"tickets_{args.rows}.db")
+    info = build(path, rows, args.seed)
+    print(f"\nBase generada: {info}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+# bench/replay.py
+"""
+Reproduce contra el backend un log de tráfico grabado con
+TRAFFIC_RECORD_PATH (ver backend/traffic_recorder.py). El mismo proceso
+sirve el LLM y Tavily con las respuestas grabadas, así se perfilan
+cambios de ruteo, SQL o serialización con la mezcla real de preguntas y
+sin servicios externos:
+
+    python -m bench.replay traffic.ndjson --serve-port 8001 --url http://localhost:8000 \
+        --latency recorded --pace recorded --out bench/results/replay.json
+
+con el backend apuntando al replay (y DB_PATH a una base con los datos):
+
+    LLM_API_BASE=http://localhost:8001/v1
+    TAVILY_API_URL=http://localhost:8001
+    TAVILY_API_KEY=fake
+
+Cada llamada al LLM se busca por la huella de sus mensajes; si el prompt
+cambió (por ejemplo al tocar prompts.py) se usa la llamada grabada del
+mismo tipo (router o respuesta) para ese mensaje, y si tampoco hay, una
+respuesta sintética de bench.fake_services. El reporte cuenta cada caso.
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import uvicorn
+
+from backend.traffic_recorder import prompt_hash
+from bench.fake_services import SETTINGS, create_app, is_router_call, pieces, synthetic_chat, synthetic_search
+from bench.load import LoadGenerator, Sample, finish, summarize
+
+
+def load_records(path: str) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Lee el log en orden de llegada. Devuelve (registros, líneas inválidas);
+    la última línea puede quedar cortada si el backend se detuvo escribiendo.
+    """
+    records, invalid = [], 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                invalid += 1
+                continue
+            if record.get("message"):
+                records.append(record)
+    records.sort(key=lambda r: r.get("at", 0))
+    return records, invalid
+
+
+def _query_key(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+class RecordedUpstreams:
+    """
+    Respuestas del LLM y de Tavily sacadas del log, con la latencia
+    grabada ("recorded") o sin latencia ("zero").
+    """
+
+    def __init__(self, records: List[Dict[str, Any]], latency: str):
+        self.latency = latency
+        self.stats: Counter = Counter()
+        self.by_hash: Dict[str, Dict[str, Any]] = {}
+        self.by_message: Dict[str, List[Dict[str, Any]]] = {}
+        self.searches: Dict[str, Dict[str, Any]] = {}
+
+        for record in records:
+            calls = [c for c in record.get("llm_calls", []) if c.get("status") != "error"]
+            for call in calls:
+                known = self.by_hash.get(call["prompt_hash"])
+                # Una llamada completa gana sobre una cortada (rama cancelada)
+                if known is None or (known["status"] != "ok" and call["status"] == "ok"):
+                    self.by_hash[call["prompt_hash"]] = call
+            self.by_message.setdefault(record["message"], []).extend(calls)
+            for search in record.get("web_searches", []):
+                self.searches.setdefault(_query_key(search["query"]), search)
+
+        # Los mensajes más largos primero: uno corto puede estar dentro de otro
+        self._messages = sorted(self.by_message, key=len, reverse=True)
+
+    def chat(self, body: Dict[str, Any]) -> Tuple[str, float, float]:
+        call = self.by_hash.get(prompt_hash(body["messages"]))
+        if call is not None:
+            self.stats["llm_exact"] += 1
+        else:
+            call = self._same_kind_call(body)
+            self.stats["llm_by_message" if call is not None else "llm_synthetic"] += 1
+
+        if call is None:
+            text, ttft, per_piece = synthetic_chat(body)
+            return (text, 0.0, 0.0) if self.latency == "zero" else (text, ttft, per_piece)
+        return (call["output"],) + self._timing(call)
+
+    def _same_kind_call(self, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        prompt = (body["messages"][-1].get("content") or "") if body["messages"] else ""
+        message = next((m for m in self._messages if m in prompt), None)
+        if message is None:
+            return None
+
+        want_router = is_router_call(body)
+        candidates = [c for c in self.by_message[message] if (c["stage"] == "router") == want_router]
+        candidates.sort(key=lambda c: c["status"] != "ok")
+        return candidates[0] if candidates else None
+
+    def _timing(self, call: Dict[str, Any]) -> Tuple[float, float]:
+        """
+        (segundos al primer fragmento, segundos por fragmento). La espera
+        de turno en el backend (queue_ms) no es del proveedor y se descuenta.
+        """
+        if self.latency == "zero":
+            return 0.0, 0.0
+        total = max(0.0, (call["duration_ms"] - (call.get("queue_ms") or 0)) / 1000)
+        first = call.get("first_token_ms")
+        # Sin primer token grabado (llamada sin streaming) todo es espera inicial
+        ttft = min(first / 1000, total) if first is not None else total
+        return ttft, (total - ttft) / max(1, len(pieces(call["output"])))
+
+    def search(self, body: Dict[str, Any]) -> Tuple[Dict[str, Any], float]:
+        found = self.searches.get(_query_key(body.get("query", "")))
+        if found is None:
+            self.stats["web_synthetic"] += 1
+            response, latency = synthetic_search(body)
+            return response, 0.0 if self.latency == "zero" else latency
+
+        self.stats["web_recorded"] += 1
+        return found["response"], 0.0 if self.latency == "zero" else found["duration_ms"] / 1000
+
+
+def serve_upstreams(upstreams: RecordedUpstreams, host: str, port: int) -> uvicorn.Server:
+    """
+    Levanta el LLM y Tavily grabados en un hilo aparte, con su propio
+    event loop, para no competir con el generador de carga.
+    """
+    app = create_app(upstreams.chat, upstreams.search)
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+class ReplayLoad(LoadGenerator):
+    """
+    Manda los mensajes del log en su orden. Con --pace recorded respeta
+    los intervalos de llegada grabados (divididos entre --speed); si no,
+    los manda tan rápido como permite --concurrency.
+    """
+
+    def __init__(self, args: argparse.Namespace, records: List[Dict[str, Any]]):
+        super().__init__(args)
+        self.records = records
+        self.position = 0
+
+    def next_question(self) -> Optional[Tuple[Sample, str]]:
+        if self.position >= len(self.records):
+            return None
+        record = self.records[self.position]
+        self.position += 1
+        # La intención grabada es la esperada: "mal enrutadas" cuenta cambios de ruteo
+        return Sample(record.get("intent") or "unknown"), record["message"]
+
+    async def _run_batch(
+        self,
+        client: httpx.AsyncClient,
+        requests: int,
+        duration: Optional[float],
+        samples: Optional[List[Sample]] = None,
+    ) -> None:
+        if self.args.pace != "recorded" or samples is None:
+            await super()._run_batch(client, requests, duration, samples)
+            return
+
+        async def send(sample: Sample, question: str) -> None:
+            await self.send(client, sample, question)
+            samples.append(sample)
+
+        started = time.perf_counter()
+        first_at = self.records[self.position]["at"] if self.position < len(self.records) else 0
+        tasks = []
+        for _ in range(requests):
+            if self.position >= len(self.records):
+                break
+            delay = (self.records[self.position]["at"] - first_at) / self.args.speed
+            wait = delay - (time.perf_counter() - started)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            sample, question = self.next_question()
+            tasks.append(asyncio.create_task(send(sample, question)))
+        await asyncio.gather(*tasks)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reproduce tráfico grabado contra el agente")
+    parser.add_argument("log", help="log NDJSON de TRAFFIC_RECORD_PATH")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--serve-host", default="127.0.0.1")
+    parser.add_argument("--serve-port", type=int, default=8001, help="puerto del LLM y Tavily grabados")
+    parser.add_argument("--serve-only", action="store_true", help="solo servir las respuestas grabadas")
+    parser.add_argument("--latency", choices=("recorded", "zero"), default="recorded")
+    parser.add_argument("--pace", choices=("recorded", "max"), default="max",
+                        help="recorded: intervalos de llegada grabados; max: tan rápido como --concurrency")
+    parser.add_argument("--speed", type=float, default=1.0, help="acelera (>1) los intervalos grabados")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="clientes (8); con --pace recorded, conexiones máximas (256)")
+    parser.add_argument("--slots", type=int, default=0, help="generaciones en paralelo del LLM (0 = sin límite)")
+    parser.add_argument("--requests", type=int, default=None, help="solo los primeros N mensajes")
+    parser.add_argument("--warmup", type=int, default=0, help="mensajes iniciales que no se miden")
+    parser.add_argument("--stream", action="store_true", help="usar /agent/stream y medir el primer token")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--out", default=None, help="archivo JSON con los resultados")
+    parser.add_argument("--baseline", default=None, help="JSON de una corrida anterior para comparar")
+    args = parser.parse_args()
+
+    records, invalid = load_records(args.log)
+    if not records:
+        raise SystemExit(f"{args.log} no tiene peticiones grabadas")
+    print(f"{len(records)} peticiones grabadas ({invalid} líneas inválidas)")
+
+    SETTINGS["slots"] = args.slots
+    upstreams = RecordedUpstreams(records, args.latency)
+    server = serve_upstreams(upstreams, args.serve_host, args.serve_port)
+
+    if args.serve_only:
+        print(f"Sirviendo LLM y Tavily grabados en http://{args.serve_host}:{args.serve_port} (Ctrl+C para salir)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.should_exit = True
+        return
+
+    measured = records[args.warmup:]
+    if args.requests is not None:
+        measured = measured[:args.requests]
+    # Atributos que usa LoadGenerator
+    args.requests = len(measured)
+    args.duration = None
+    if args.concurrency is None:
+        # Con llegadas grabadas el límite de conexiones no debe agregar fila
+        args.concurrency = 256 if args.pace == "recorded" else 8
+
+    load = ReplayLoad(args, records[:args.warmup + len(measured)])
+    report = asyncio.run(load.run())
+    report["replay"] = {
+        "log": args.log,
+        "records": len(measured),
+        "invalid_lines": invalid,
+        "upstreams": dict(upstreams.stats),
+        # Latencia que tuvieron esas mismas peticiones al grabarse
+        "recorded_latency": summarize([r["total_ms"] for r in measured if "total_ms" in r]),
+    }
+    server.should_exit = True
+
+    finish(report, args)
+    print(f"\nreplay: {report['replay']['upstreams']}")
+
+
+if __name__ == "__main__":
+    main()
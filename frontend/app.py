@@ -3,11 +3,21 @@
 Interfaz tipo chat usando Streamlit.
 """
 
+import base64
+import json
+from urllib.parse import urlencode
+
 import requests
 import streamlit as st
 
 BACKEND_URL = "http://localhost:8000/agent"
+BACKEND_STREAM_URL = f"{BACKEND_URL}/stream"
+BACKEND_PAGE_URL = f"{BACKEND_URL}/sql/page"
+BACKEND_EXPORT_URL = f"{BACKEND_URL}/sql/export"
 CHAT_NAME = "BEDUito"
+# Formato columnar: el backend no valida cada celda y aquí armamos el
+# dataframe directo de los arreglos por columna
+RESULT_FORMAT = "columnar"
 
 def send_message_to_backend(message: str):
     payload = {"message": message}
@@ -16,6 +26,152 @@ def send_message_to_backend(message: str):
     return resp.json()
 
 
+def stream_message_from_backend(message: str, meta: dict):
+    """
+    Consume el endpoint SSE del backend. Va devolviendo los tokens de la
+    respuesta y guarda en `meta` la intención y los datos de SQL/web.
+    """
+    payload = {"message": message, "result_format": RESULT_FORMAT}
+    with requests.post(BACKEND_STREAM_URL, json=payload, timeout=60, stream=True) as resp:
+        resp.raise_for_status()
+
+        event = None
+        for line in resp.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):].strip())
+                if event == "meta":
+                    meta.update(data)
+                elif event == "token":
+                    yield data.get("content", "")
+                elif event == "error":
+                    raise RuntimeError(data.get("error"))
+
+
+def fetch_next_page(sql_res: dict):
+    """
+    Pide la siguiente página al backend y la agrega al resultado guardado.
+    """
+    params = {"token": sql_res["next_token"], "format": sql_res.get("encoding", "rows")}
+    resp = requests.get(BACKEND_PAGE_URL, params=params, timeout=60)
+    resp.raise_for_status()
+    page = resp.json()
+
+    if page.get("error"):
+        st.error(f"Error SQL: {page['error']}")
+        return
+
+    if sql_res.get("encoding") == "columnar":
+        sql_res["data"] = [old + new for old, new in zip(sql_res["data"], page["data"])]
+    else:
+        sql_res["rows"] = sql_res.get("rows", []) + page.get("rows", [])
+    sql_res["truncated"] = page.get("truncated", False)
+    sql_res["next_token"] = page.get("next_token")
+
+
+def sql_result_table(sql_res: dict):
+    """
+    Devuelve (datos para st.dataframe, número de filas) según la codificación.
+    """
+    cols = sql_res.get("columns", [])
+    encoding = sql_res.get("encoding", "rows")
+
+    if encoding == "columnar":
+        data = sql_res.get("data", [])
+        return dict(zip(cols, data)), len(data[0]) if data else 0
+
+    if encoding == "arrow":
+        import pyarrow as pa
+
+        table = pa.ipc.open_stream(base64.b64decode(sql_res["data"])).read_all()
+        return table, table.num_rows
+
+    rows = sql_res.get("rows", [])
+    return [dict(zip(cols, row)) for row in rows], len(rows)
+
+
+def render_assistant_meta(meta: dict, key: int):
+    """
+    Muestra tablas SQL, fuentes web y el origen de la respuesta.
+    `key` identifica el mensaje para los botones de Streamlit.
+    """
+    source_caption = ""
+
+    # Si hay meta de SQL, mostramos tabla
+    if meta.get("intent") == "sql" and meta.get("sql_result"):
+        sql_res = meta["sql_result"]
+        source_caption = "**🚀 Fuente:** Base de datos de tickets"
+        # Por si el backend manda algún error encapsulado ahí
+        if isinstance(sql_res, dict) and sql_res.get("error"):
+            st.error(f"Error SQL: {sql_res['error']}")
+        elif isinstance(sql_res, dict):
+            cols = sql_res.get("columns", [])
+            table, n_rows = sql_result_table(sql_res)
+            if cols and n_rows:
+                st.caption("Resultados de la consulta SQL:")
+                st.code(f"{meta.get('sql_query')}",language="sql")
+
+                # Descarga de todas las filas (el backend las manda en streaming)
+                csv_col, ndjson_col = st.columns(2)
+                for col, fmt in ((csv_col, "csv"), (ndjson_col, "ndjson")):
+                    params = urlencode({"sql_query": meta.get("sql_query") or "", "format": fmt})
+                    col.link_button(f"⬇️ Descargar {fmt.upper()}", f"{BACKEND_EXPORT_URL}?{params}")
+
+                st.dataframe(table)
+
+                if sql_res.get("truncated"):
+                    total = sql_res.get("total_rows")
+                    total_text = f"{total:,}" if total is not None else "muchas"
+                    st.caption(f"Mostrando {n_rows:,} de {total_text} filas.")
+
+                    if sql_res.get("next_token") and st.button("Cargar más filas", key=f"more_{key}"):
+                        fetch_next_page(sql_res)
+                        st.rerun()
+
+    # Opcional: mostrar fuentes web si la intención fue "web"
+    if meta.get("intent") == "web" and meta.get("web_raw_result"):
+        source_caption ="**🌍 Fuente:** Búsqueda en la web"
+        sources = meta["web_raw_result"]
+        # Esperamos una lista de dicts con 'title' y 'url'
+        if isinstance(sources, list):
+            for i, source in enumerate(sources, start=1):
+                title = source.get("title", "Sin título")
+                url = source.get("url")
+                if url:
+                    st.badge(f"{i}. [{title}] ({url})", color="violet")
+                else:
+                    st.badge(f"{i}. {title}", color="violet")
+
+    # Plan: una sección por cada consulta SQL o búsqueda web
+    if meta.get("intent") == "plan" and meta.get("actions"):
+        source_caption = "**🧩 Fuente:** Varias consultas (base de datos y/o web)"
+        for i, action in enumerate(meta["actions"], start=1):
+            result = action.get("result")
+            if action.get("error"):
+                st.error(f"{i}. Falló la consulta: {action['error']}")
+            elif action.get("type") == "sql" and isinstance(result, dict):
+                st.caption(f"{i}. Consulta SQL:")
+                st.code(action.get("query", ""), language="sql")
+                if result.get("error"):
+                    st.error(f"Error SQL: {result['error']}")
+                else:
+                    table, n_rows = sql_result_table(result)
+                    if n_rows:
+                        st.dataframe(table)
+            elif isinstance(result, list):
+                st.caption(f"{i}. Búsqueda web: {action.get('query', '')}")
+                for source in result:
+                    title = source.get("title", "Sin título")
+                    url = source.get("url")
+                    st.badge(f"[{title}] ({url})" if url else title, color="violet")
+
+    if meta.get("intent") == "llm":
+        source_caption = "**🧠 Fuente:** Conocimiento del LLM"
+
+    st.caption(source_caption)
+
+
 def main():
     st.set_page_config(page_title=CHAT_NAME, page_icon="🤖")
     st.title("🧠 BEDUito Chat")
@@ -30,47 +186,9 @@ def main():
     history_container = st.container()
     input_container = st.container()
 
-    # --- INPUT DEL USUARIO (lógicamente primero, visualmente abajo) ---
-    with input_container:
-        user_input = st.chat_input("Escribe tu mensaje...")
-
-        if user_input:
-            # Guardamos mensaje de usuario en el historial
-            st.session_state.chat_history.append(
-                {"role": "user", "content": user_input, "meta": {}}
-            )
-
-            # Llamamos al backend y guardamos la respuesta del asistente
-            try:
-                with st.spinner("Procesando..."):
-                    response = send_message_to_backend(user_input)
-                
-                # print(f"All response from LLm: {response}")            
-                reply = response.get("reply", "")
-                
-                st.session_state.chat_history.append(
-                    {
-                        "role": "assistant",
-                        "content": reply,
-                        "meta": {
-                            "intent": response.get("intent"),
-                            "sql_query": response.get("sql_query"),
-                            "sql_result": response.get("sql_result"),
-                            "web_raw_result": response.get("web_raw_result"),
-                        },
-                    }
-                )
-
-            except Exception as e:
-                # En caso de error, agregamos un mensaje de asistente con el error
-                error_msg = f"Error al comunicar con el backend: {e}"
-                st.session_state.chat_history.append(
-                    {"role": "assistant", "content": error_msg, "meta": {}}
-                )
-
-    # --- MOSTRAR HISTORIAL COMPLETO (incluye el último turno) ---
-    with history_container: 
-        for msg in st.session_state.chat_history:
+    # --- MOSTRAR HISTORIAL ---
+    with history_container:
+        for i, msg in enumerate(st.session_state.chat_history):
             role = msg["role"]
             content = msg["content"]
             meta = msg.get("meta", {}) or {}
@@ -79,45 +197,49 @@ def main():
                 with st.chat_message("user"):
                     st.markdown(content)
             else:
-                source_caption = ""
                 with st.chat_message("assistant"):
                     st.markdown(content)
+                    render_assistant_meta(meta, key=i)
+
+    # --- INPUT DEL USUARIO (visualmente abajo) ---
+    with input_container:
+        user_input = st.chat_input("Escribe tu mensaje...")
 
-                    # Si hay meta de SQL, mostramos tabla
-                    if meta.get("intent") == "sql" and meta.get("sql_result"):                                                
-                        sql_res = meta["sql_result"]
-                        source_caption = "**🚀 Fuente:** Base de datos de tickets"
-                        # Por si el backend manda algún error encapsulado ahí
-                        if isinstance(sql_res, dict) and sql_res.get("error"):
-                            st.error(f"Error SQL: {sql_res['error']}")
-                        elif isinstance(sql_res, dict):
-                            cols = sql_res.get("columns", [])
-                            rows = sql_res.get("rows", [])
-                            if cols and rows:
-                                st.caption("Resultados de la consulta SQL:")
-                                st.code(f"{meta.get('sql_query')}",language="sql")
-                                st.dataframe(
-                                    [dict(zip(cols, row)) for row in rows],                                    
-                                )
-
-                    # Opcional: mostrar fuentes web si la intención fue "web"
-                    if meta.get("intent") == "web" and meta.get("web_raw_result"):
-                        source_caption ="**🌍 Fuente:** Búsqueda en la web"
-                        sources = meta["web_raw_result"]
-                        # Esperamos una lista de dicts con 'title' y 'url'
-                        if isinstance(sources, list):
-                            for i, source in enumerate(sources, start=1):
-                                title = source.get("title", "Sin título")
-                                url = source.get("url")
-                                if url:
-                                    st.badge(f"{i}. [{title}] ({url})", color="violet")
-                                else:
-                                    st.badge(f"{i}. {title}", color="violet")
-
-                    if meta.get("intent") == "llm":
-                        source_caption = "**🧠 Fuente:** Conocimiento del LLM"
-                    
-                    st.caption(source_caption) 
+    if user_input:
+        # Guardamos mensaje de usuario en el historial
+        st.session_state.chat_history.append(
+            {"role": "user", "content": user_input, "meta": {}}
+        )
+
+        # El turno nuevo se pinta al final del historial mientras llega la respuesta
+        with history_container:
+            with st.chat_message("user"):
+                st.markdown(user_input)
+
+            with st.chat_message("assistant"):
+                meta = {}
+                try:
+                    reply = st.write_stream(stream_message_from_backend(user_input, meta))
+                    render_assistant_meta(meta, key=len(st.session_state.chat_history))
+                except Exception as e:
+                    # En caso de error, agregamos un mensaje de asistente con el error
+                    reply = f"Error al comunicar con el backend: {e}"
+                    meta = {}
+                    st.markdown(reply)
+
+        st.session_state.chat_history.append(
+            {
+                "role": "assistant",
+                "content": reply,
+                "meta": {
+                    "intent": meta.get("intent"),
+                    "sql_query": meta.get("sql_query"),
+                    "sql_result": meta.get("sql_result"),
+                    "web_raw_result": meta.get("web_raw_result"),
+                    "actions": meta.get("actions"),
+                },
+            }
+        )
 
 if __name__ == "__main__":
     main()
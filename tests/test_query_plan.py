@@ -0,0 +1,64 @@
+# tests/test_query_plan.py
+"""
+Guardia del plan de ejecución (check_query_plan): las consultas de una
+sola tabla y las que cortan con LIMIT pasan; un join cartesiano real no.
+"""
+
+import sqlite3
+
+import pytest
+
+from backend import db_client
+
+ROWS = 3000
+MAX_ROWS = 50_000
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    db_path = tmp_path / "plan.db"
+    with sqlite3.connect(db_path) as db:
+        db.execute("CREATE TABLE tickets (folio INTEGER PRIMARY KEY, estatus TEXT)")
+        db.execute("CREATE TABLE asignaciones (id INTEGER PRIMARY KEY, folio INTEGER, colaborador TEXT)")
+        db.execute("CREATE INDEX idx_asignaciones_folio ON asignaciones (folio)")
+        db.executemany("INSERT INTO tickets VALUES (?, ?)", ((i, f"E{i % 4}") for i in range(ROWS)))
+        db.executemany("INSERT INTO asignaciones VALUES (?, ?, ?)", ((i, i, f"C{i % 9}") for i in range(ROWS)))
+
+    pool = db_client.SQLiteConnectionPool(str(db_path), size=1)
+    monkeypatch.setattr(db_client, "_pool", pool)
+    with pool.connection() as conn:
+        yield conn
+    pool.close()
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT COUNT(*) FROM tickets",
+    "SELECT * FROM tickets LIMIT 10",
+    "SELECT estatus, COUNT(*) FROM tickets GROUP BY estatus",
+    "SELECT t.estatus, a.colaborador FROM tickets t JOIN asignaciones a ON a.folio = t.folio",
+    "SELECT * FROM tickets, asignaciones LIMIT 10",
+])
+def test_cheap_queries_pass(conn, query):
+    assert db_client.check_query_plan(conn, query, max_rows=MAX_ROWS) is None
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM tickets, asignaciones",
+    "SELECT COUNT(*) FROM tickets t CROSS JOIN asignaciones a",
+    "SELECT * FROM tickets, asignaciones ORDER BY colaborador LIMIT 10",
+])
+def test_cross_join_rejected(conn, query):
+    rejection = db_client.check_query_plan(conn, query, max_rows=MAX_ROWS)
+    assert rejection is not None
+    assert rejection["error_code"] == "plan_rejected"
+    assert rejection["error_detail"]["estimated_rows"] > MAX_ROWS
+
+
+def test_row_counts_refresh_when_db_changes(conn, tmp_path):
+    pool = db_client.get_pool()
+    assert pool.table_row_counts(conn)["tickets"] == ROWS
+
+    with sqlite3.connect(tmp_path / "plan.db") as db:
+        db.executemany("INSERT INTO tickets VALUES (?, ?)", ((ROWS + i, "E0") for i in range(10)))
+
+    assert pool.table_row_counts(conn)["tickets"] == ROWS + 10